@@ -1,6 +1,5 @@
-from flask import Flask, jsonify
+from flask import Flask
 from flask_cors import CORS
-from flask_sqlalchemy import SQLAlchemy
 
 app = Flask(__name__)
 cors = CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -8,9 +7,45 @@ cors = CORS(app, resources={r"/api/*": {"origins": "*"}})
 # Load default config
 app.config.from_object('config')
 
-# Create a Database object
+# Create a Database object, with the engine options of
+# DATABASE_CONNECT_OPTIONS
+from .database import SQLAlchemy
 db = SQLAlchemy(app)
 
+# Create the content negotiation and compression of API responses
+from .encoding import ResponseEncoder
+encoder = ResponseEncoder(app)
+
+# Create a vote buffer. Votes are coalesced when VOTE_BUFFER_ENABLED is set
+from .vote_buffer import VoteBuffer
+vote_buffer = VoteBuffer(app)
+
+# Create a response cache for list endpoints
+from .cache import ResponseCache
+response_cache = ResponseCache(app)
+
+# Create the event bus of the Server-Sent Events streams, see EVENTS_ENABLED
+from .events import EventBus
+events = EventBus(app)
+
+# Create the rate limiter of writes and their admission control, see
+# RATE_LIMIT_ENABLED and ADMISSION_MAX_LOCK_WAIT_MS
+from .ratelimit import AdmissionControl, RateLimiter
+rate_limiter = RateLimiter(app)
+admission = AdmissionControl(app)
+
+# Create the registry of categories, see CATEGORY_REGISTRY_TTL
+from .categories import CategoryRegistry
+category_registry = CategoryRegistry(app)
+
+# Create the archiver of deleted posts and comments, see ARCHIVE_ENABLED
+from .archive import Archiver
+archiver = Archiver(app)
+
+# Create the instrumentation of the API, see METRICS_ENABLED
+from .metrics import Metrics
+metrics = Metrics(app)
+
 # Import api blueprint
 from .controllers import api as api_module
 
@@ -23,7 +58,7 @@ def route_not_found(e):
     """ Return an error message in JSON when clients trying
         to get access to unavailable API endpoints
     """
-    return jsonify({'error': 'No Result Found'}), 404
+    return encoder.jsonify({'error': 'No Result Found'}), 404
 
 
 @app.errorhandler(405)
@@ -32,4 +67,4 @@ def method_not_allowed(e):
         in the request-line is not allowed for the resource identified
         by the request-URI
     """
-    return jsonify({'error': 'Method Not Allowed'}), 405
+    return encoder.jsonify({'error': 'Method Not Allowed'}), 405
@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from sqlalchemy import literal, select
+
+# Import the database object and models
+from . import db
+from .models import COMMENT_ARCHIVE, POST_ARCHIVE, Comment, Post
+from .serializers import POST_FIELDS
+
+DAY_MS = 86400000
+
+# Keys of Post.serialize and columns of the archived posts
+ARCHIVED_POST_FIELDS = tuple((key, POST_ARCHIVE.c[column.key])
+                             for key, column in POST_FIELDS)
+
+
+def now_ms():
+    """ Return the current time in milliseconds """
+    return int(time.time() * 1000)
+
+
+def select_archived_post(post_id):
+    """ Return a SELECT of the fields of an archived post """
+    return select([column for key, column in ARCHIVED_POST_FIELDS])\
+        .where(POST_ARCHIVE.c.id == post_id)
+
+
+def copy_rows(table, archive, condition, now):
+    """ Return an INSERT which copies the rows of a table which match a
+        condition into its archive, archived at now
+    """
+    names = [column.name for column in table.columns]
+    return archive.insert().prefix_with('OR REPLACE').from_select(
+        names + ['archived_ms'],
+        select([table.c[name] for name in names] +
+               [literal(now, db.BigInteger)])
+        .where(condition))
+
+
+def stamp_deleted(connection, now=None):
+    """ Set deleted_ms of deleted posts and comments which have none, e.g.
+        rows which were deleted before the column existed, or loaded in
+        bulk without the triggers
+
+    They are archived ARCHIVE_AFTER_DAYS after now. Returns the number of
+    rows stamped
+    """
+    now = now or now_ms()
+    stamped = 0
+    for table in (Post.__table__, Comment.__table__):
+        stamped += connection.execute(
+            table.update()
+            .where(table.c.deleted.is_(True))
+            .where(table.c.deleted_ms.is_(None))
+            .values(deleted_ms=now)).rowcount
+    return stamped
+
+
+class Archiver(object):
+    """ Move deleted posts and comments out of the live tables
+
+    Posts and comments are only flagged as deleted, and a trigger stamps
+    them with the time. Once ARCHIVE_AFTER_DAYS have passed, the archiver
+    moves them to the post_archive and comment_archive tables, posts with
+    all of their comments. So the tables and indexes which every list reads
+    only hold live rows and recently deleted ones. GET /posts/:id still
+    returns archived posts. Archived rows are deleted for good after
+    ARCHIVE_PURGE_AFTER_DAYS more days, unless it is None.
+
+    Rows are moved in transactions of ARCHIVE_BATCH_SIZE posts or comments,
+    so writers never wait long for the lock. Afterwards, pages which were
+    freed are returned to the filesystem ARCHIVE_VACUUM_PAGES at a time with
+    'PRAGMA incremental_vacuum', when the database has auto_vacuum set to
+    INCREMENTAL. There is never a full VACUUM, which would rewrite the
+    whole database and may renumber the rows of the full-text indexes.
+
+    With ARCHIVE_ENABLED, every server process runs the archiver in a
+    thread of its own every ARCHIVE_INTERVAL_SECONDS. serve.py only runs it
+    in one worker. archive_db.py runs it once, e.g. from cron.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config['ARCHIVE_ENABLED']
+        self.interval = app.config['ARCHIVE_INTERVAL_SECONDS']
+        self.archive_after_ms = app.config['ARCHIVE_AFTER_DAYS'] * DAY_MS
+        purge_after_days = app.config['ARCHIVE_PURGE_AFTER_DAYS']
+        self.purge_after_ms = purge_after_days * DAY_MS \
+            if purge_after_days is not None else None
+        self.batch_size = app.config['ARCHIVE_BATCH_SIZE']
+        self.vacuum_pages = app.config['ARCHIVE_VACUUM_PAGES']
+        app.before_first_request(self.start)
+
+    def start(self):
+        """ Start the archiving thread of this process, if enabled
+
+        Called once per process, because threads don't survive fork()
+        """
+        with self._lock:
+            if not self.enabled or self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        archiver = threading.Thread(target=self._run, name='archiver')
+        archiver.daemon = True
+        archiver.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run()
+            except Exception:
+                self.app.logger.exception('Failed to archive deleted rows')
+
+    def run(self, now=None):
+        """ Archive, purge and vacuum once. Returns a dict of the number of
+            posts and comments archived, archived rows purged and pages
+            freed
+        """
+        now = now or now_ms()
+        cutoff = now - self.archive_after_ms
+        post, comment = Post.__table__, Comment.__table__
+        counts = dict.fromkeys(('posts', 'comments', 'purged', 'pages'), 0)
+
+        # Deleted posts, with all of their comments. The posts are deleted
+        # before their comments, so that the comment_count triggers have no
+        # post to update
+        while True:
+            with db.engine.begin() as connection:
+                ids = [id for id, in connection.execute(
+                    select([post.c.id])
+                    .where(post.c.deleted_ms <= cutoff)
+                    .where(post.c.deleted.is_(True))
+                    .limit(self.batch_size))]
+                if not ids:
+                    break
+                connection.execute(copy_rows(post, POST_ARCHIVE,
+                                             post.c.id.in_(ids), now))
+                children = comment.c.parent_id.in_(ids)
+                counts['comments'] += connection.execute(
+                    copy_rows(comment, COMMENT_ARCHIVE, children,
+                              now)).rowcount
+                connection.execute(post.delete().where(post.c.id.in_(ids)))
+                connection.execute(comment.delete().where(children))
+            counts['posts'] += len(ids)
+
+        # Deleted comments of live posts
+        while True:
+            with db.engine.begin() as connection:
+                ids = [id for id, in connection.execute(
+                    select([comment.c.id])
+                    .where(comment.c.deleted_ms <= cutoff)
+                    .where(comment.c.deleted.is_(True))
+                    .limit(self.batch_size))]
+                if not ids:
+                    break
+                connection.execute(copy_rows(comment, COMMENT_ARCHIVE,
+                                             comment.c.id.in_(ids), now))
+                connection.execute(
+                    comment.delete().where(comment.c.id.in_(ids)))
+            counts['comments'] += len(ids)
+
+        if self.purge_after_ms is not None:
+            counts['purged'] = self.purge(now - self.purge_after_ms)
+        counts['pages'] = self.vacuum()
+        return counts
+
+    def purge(self, cutoff):
+        """ Delete the rows archived before cutoff. Returns their number """
+        purged = 0
+        for archive in (POST_ARCHIVE, COMMENT_ARCHIVE):
+            while True:
+                with db.engine.begin() as connection:
+                    deleted = connection.execute(
+                        archive.delete().where(archive.c.id.in_(
+                            select([archive.c.id])
+                            .where(archive.c.archived_ms <= cutoff)
+                            .limit(self.batch_size)))).rowcount
+                purged += deleted
+                if deleted == 0:
+                    break
+        return purged
+
+    def vacuum(self):
+        """ Return free pages to the filesystem, a few at a time, when the
+            database has auto_vacuum set to INCREMENTAL. Returns the number
+            of pages freed
+        """
+        if db.engine.dialect.name != 'sqlite':
+            return 0
+        freed = 0
+        # Through the DBAPI cursor, because every step of the statement
+        # frees one page, and SQLAlchemy only takes the first step of a
+        # statement which returns no rows
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            # 2 is INCREMENTAL
+            if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                return 0
+            free = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+            while free:
+                cursor.execute('PRAGMA incremental_vacuum({})'.format(
+                    self.vacuum_pages)).fetchall()
+                left = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+                if left >= free:
+                    break
+                freed += free - left
+                free = left
+        finally:
+            connection.close()
+        return freed
@@ -0,0 +1,880 @@
+"""
+    Asynchronous variant of the 'api' blueprint, served by aiohttp
+
+    The routes and the JSON contract are the same as those of controllers.py.
+    Queries are built with SQLAlchemy, compiled for SQLite and executed with
+    aiosqlite, so a request which waits for the database doesn't hold a
+    thread, and one process can serve thousands of concurrent clients.
+
+    Requires the 'aiohttp' and 'aiosqlite' packages. Run it with
+    'python3 run_async.py'.
+"""
+import asyncio
+import collections
+import functools
+import json
+import sqlite3
+import aiosqlite
+from aiohttp import web
+from sqlalchemy import select
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.sql import Select
+
+from . import app as flask_app, archiver, category_registry, db, events
+from .archive import ARCHIVED_POST_FIELDS, select_archived_post
+from .categories import SELECT_NAMES, SELECT_STATS, serialize_categories
+from .changes import CHANGE_MODELS, ChangesCompacted, check_since, \
+    compact_statements, compaction_due, insert_changes, parse_change_args, \
+    select_changes, select_latest, select_objects, serialize_changes
+from .controllers import chunked, parse_comment, parse_post, \
+    query_comments, query_posts
+from .database import connection_factory
+from .events import KEEPALIVE_FRAME, RESET_FRAME, RETRY_FRAME, \
+    SSE_MIMETYPE, AsyncSubscription
+from .models import Change, Comment, Post, ResourceVersion, \
+    hot_score, to_milliseconds, vote_values
+from .pagination import InvalidPageArgument, SortOrder, decode_cursor, \
+    parse_include, parse_page_args, parse_sort
+from .serializers import COMMENT_FIELDS, POST_FIELDS, POST_SORTS, \
+    attach_comments, select_embedded_comments, select_statement, \
+    serialize_rows
+from .versions import version_keys
+from .votes import LIVE_FLAGS
+
+DIALECT = sqlite.dialect()
+
+# Comments are always listed in the order in which they were posted
+COMMENT_ORDER = SortOrder(Comment.timestamp, False, decode_cursor)
+
+
+def compile_statement(statement):
+    """ Compile a SQLAlchemy statement into SQL and a list of parameters
+        for the sqlite3 module
+    """
+    compiled = statement.compile(dialect=DIALECT)
+    params = compiled.construct_params()
+    values = []
+    for name in compiled.positiontup:
+        processor = compiled.binds[name].type.dialect_impl(DIALECT)\
+            .bind_processor(DIALECT)
+        values.append(processor(params[name]) if processor
+                      else params[name])
+    return compiled.string, values
+
+
+# Row types of SELECT statements, by SQL string
+ROW_TYPES = {}
+
+
+def result_row_type(sql, statement):
+    """ Return a namedtuple for the rows of a SELECT, and a list of the
+        result processors of its columns
+
+    Creating a namedtuple is slow, so they are kept by the SQL string
+    """
+    row_type = ROW_TYPES.get(sql)
+    if row_type is None:
+        columns = list(statement.inner_columns)
+        row = collections.namedtuple('Row', [c.name for c in columns],
+                                     rename=True)
+        processors = [c.type.dialect_impl(DIALECT)
+                      .result_processor(DIALECT, None) for c in columns]
+        row_type = ROW_TYPES[sql] = (row, processors)
+    return row_type
+
+
+class Transaction(object):
+    """ A connection of the pool, used by one request at a time
+
+    Commits when the block exits normally, and rolls back on an exception.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection = None
+
+    async def __aenter__(self):
+        self.connection = await self.pool.idle.get()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                await self.connection.commit()
+            else:
+                await self.connection.rollback()
+        finally:
+            self.pool.idle.put_nowait(self.connection)
+            self.connection = None
+
+    async def execute(self, statement):
+        """ Execute a statement and return the number of changed rows """
+        sql, params = compile_statement(statement)
+        cursor = await self.connection.execute(sql, params)
+        rowcount = cursor.rowcount
+        await cursor.close()
+        return rowcount
+
+    async def fetch(self, statement):
+        """ Execute a SELECT and return its rows as namedtuples """
+        sql, params = compile_statement(statement)
+        cursor = await self.connection.execute(sql, params)
+        rows = await cursor.fetchall()
+        await cursor.close()
+        row_type, processors = result_row_type(sql, statement)
+        return [row_type(*[process(value) if process else value
+                           for process, value in zip(processors, row)])
+                for row in rows]
+
+    async def fetch_one(self, statement):
+        """ Return the only row of a SELECT
+
+        Raise NoResultFound when there is no row
+        """
+        rows = await self.fetch(statement)
+        if not rows:
+            raise NoResultFound()
+        return rows[0]
+
+
+class ConnectionPool(object):
+    """ A fixed number of aiosqlite connections to the database of
+        SQLALCHEMY_DATABASE_URI
+
+    aiosqlite runs every connection in a thread of its own, so the size of
+    the pool is the number of queries which can run at the same time, not
+    the number of requests which can be served.
+    """
+
+    def __init__(self, config):
+        url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+        if url.drivername != 'sqlite':
+            raise ValueError('The async API only supports SQLite databases')
+        self.path = url.database
+        self.size = config['ASYNC_POOL_SIZE']
+        self.pragmas = sorted(config['SQLITE_PRAGMAS'].items())
+        self.connections = []
+        self.idle = None
+
+    async def open(self):
+        """ Open the connections, with the SQL functions of db, and run
+            SQLITE_PRAGMAS on each
+        """
+        self.idle = asyncio.Queue()
+        factory = connection_factory(db.sql_functions)
+        for _ in range(self.size):
+            connection = await aiosqlite.connect(self.path, factory=factory)
+            for name, value in self.pragmas:
+                await connection.execute('PRAGMA {} = {}'.format(name, value))
+            self.connections.append(connection)
+            self.idle.put_nowait(connection)
+
+    async def close(self):
+        for connection in self.connections:
+            await connection.close()
+
+    def transaction(self):
+        return Transaction(self)
+
+
+def json_response(data, status=200):
+    """ Return a compact JSON response with sorted keys, like
+        flask.jsonify
+    """
+    return web.json_response(data, status=status,
+                             dumps=functools.partial(json.dumps,
+                                                     separators=(',', ':'),
+                                                     sort_keys=True))
+
+
+def error(message, status):
+    return json_response({'error': message}, status=status)
+
+
+def serialize_row(fields, row):
+    """ Serialize a row of the columns of fields, e.g. POST_FIELDS """
+    return dict(zip([key for key, column in fields], row))
+
+
+def serialize_values(fields, values):
+    """ Serialize a dict of column values, e.g. of parse_post() """
+    return {key: values[column.key] for key, column in fields}
+
+
+def select_live(model, fields, object_id):
+    """ Return a SELECT of the fields of a live post or comment """
+    statement = select([column for key, column in fields])\
+        .where(model.id == object_id)
+    for flag in LIVE_FLAGS[model]:
+        statement = statement.where(getattr(model, flag).is_(False))
+    return statement
+
+
+async def bump(transaction, *keys):
+    """ Increment versions of resources, like versions.bump """
+    table = ResourceVersion.__table__
+    for key in version_keys(keys):
+        updated = await transaction.execute(
+            table.update()
+            .where(table.c.key == key)
+            .values(version=table.c.version + 1))
+        if updated == 0:
+            await transaction.execute(table.insert().values(key=key,
+                                                            version=1))
+
+
+async def record(request, transaction, kind, ids):
+    """ Append changes of posts or comments to the change log, like
+        changes.record. ids is a list of ids, or a SELECT of ids
+    """
+    if isinstance(ids, Select):
+        count = await transaction.execute(insert_changes(kind, ids))
+    else:
+        for object_id in ids:
+            await transaction.execute(Change.__table__.insert()
+                                      .values(kind=kind, object_id=object_id))
+        count = len(ids)
+    if count == 0:
+        return
+
+    config = request.app['config']
+    latest, = await transaction.fetch_one(select_latest())
+    if compaction_due(latest, count, config):
+        for statement in compact_statements(latest, config):
+            await transaction.execute(statement)
+
+
+def publish_post(post):
+    """ Publish the data of a post, like controllers.publish_post """
+    events.publish(['post:' + post['id'], 'category:' + post['category']],
+                   'post', post)
+
+
+def publish_comment(comment):
+    """ Publish the data of a comment, like controllers.publish_comment """
+    events.publish(['post:' + comment['parentId']], 'comment', comment)
+
+
+async def stream_events(request, channel):
+    """ Stream the events of a channel with Server-Sent Events, like
+        EventBus.stream, without holding a thread per stream
+
+    aiohttp cancels the handler when the client disconnects
+    """
+    subscription = events.subscribe(AsyncSubscription(
+        channel, events.queue_size, asyncio.get_event_loop()))
+    response = web.StreamResponse(headers={
+        'Access-Control-Allow-Origin': '*',
+        'Cache-Control': 'no-cache',
+        'Content-Type': SSE_MIMETYPE,
+        'X-Accel-Buffering': 'no',
+    })
+    try:
+        await response.prepare(request)
+        await response.write(RETRY_FRAME.encode('utf-8'))
+        while True:
+            frame = await subscription.get(events.keepalive)
+            await response.write((frame or KEEPALIVE_FRAME).encode('utf-8'))
+            if frame is RESET_FRAME:
+                break
+    finally:
+        events.unsubscribe(subscription)
+    return response
+
+
+async def read_json(request):
+    """ Return the JSON body of a request, or None if it can't be parsed """
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def fetch_embedded_comments(transaction, posts, limit):
+    """ Add the first limit comments of each post to the serialized posts,
+        like controllers.embed_comments
+    """
+    rows = []
+    for post_ids in chunked(post['id'] for post in posts):
+        rows.extend(await transaction.fetch(
+            select_embedded_comments(post_ids, limit)))
+    attach_comments(posts, rows)
+
+
+async def fetch_page(request, query, fields, sort, id_column,
+                     embed_comments=False):
+    """ Return a tuple (list of dicts, next_cursor) of a page of a query in
+        the SortOrder sort, with the comments of 'include=comments' embedded
+        in each item if embed_comments is True
+
+    Raise InvalidPageArgument when 'limit', 'cursor' or 'include' are
+    invalid
+    """
+    config = request.app['config']
+    page = parse_page_args(request.query, config, decode=sort.decode)
+    comment_limit = parse_include(request.query, config) \
+        if embed_comments else None
+    async with request.app['pool'].transaction() as transaction:
+        rows = await transaction.fetch(select_statement(
+            query, fields, page, sort.column, id_column, sort.descending))
+        items, next_cursor = [], None
+        for item, next_cursor in serialize_rows(rows, fields, page,
+                                                sort.column):
+            if item is not None:
+                items.append(item)
+        if comment_limit is not None:
+            await fetch_embedded_comments(transaction, items, comment_limit)
+    return items, next_cursor
+
+
+async def category_names(transaction):
+    """ Return the names of all categories by path from the registry,
+        which is loaded within the transaction when stale
+    """
+    names = category_registry.current()
+    if names is None:
+        names = category_registry.update(await transaction.fetch(SELECT_NAMES))
+    return names
+
+
+async def category_stats(transaction):
+    """ Return the aggregates of all categories from the registry, which
+        are read within the transaction when stale
+    """
+    rows, version = category_registry.current_stats()
+    if rows is None:
+        rows = category_registry.update_stats(
+            await transaction.fetch(SELECT_STATS), version)
+    return rows
+
+
+async def jsonify_all_categories(request):
+    """ GET     /categories
+            - Return all categories in JSON, with the aggregates of their
+              posts
+    """
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            names = await category_names(transaction)
+            rows = await category_stats(transaction)
+    except Exception:
+        return error('Internal Server Error', 500)
+    return json_response({'categories': serialize_categories(names, rows)})
+
+
+async def jsonify_posts_for_category(request):
+    """ GET     /:category/posts
+            - Return all posts for a category in JSON
+    """
+    try:
+        posts, next_cursor = await fetch_page(
+            request, query_posts(request.match_info['category']),
+            POST_FIELDS, parse_sort(request.query, POST_SORTS, 'timestamp'),
+            Post.id, embed_comments=True)
+    except InvalidPageArgument as e:
+        return error(str(e), 400)
+    except Exception:
+        return error('Internal Server Error', 500)
+    return json_response({'posts': posts, 'next': next_cursor})
+
+
+async def jsonify_all_posts(request):
+    """ GET     /posts
+            - Return all posts in JSON
+    """
+    try:
+        posts, next_cursor = await fetch_page(
+            request, query_posts(), POST_FIELDS,
+            parse_sort(request.query, POST_SORTS, 'timestamp'), Post.id,
+            embed_comments=True)
+    except InvalidPageArgument as e:
+        return error(str(e), 400)
+    except Exception:
+        return error('Internal Server Error', 500)
+    return json_response({'posts': posts, 'next': next_cursor})
+
+
+async def jsonify_changes(request):
+    """ GET     /changes?since=<seq>
+            - Return the posts and comments changed after 'since' in JSON
+    """
+    config = request.app['config']
+    try:
+        since, limit = parse_change_args(request.query, config)
+    except InvalidPageArgument as e:
+        return error(str(e), 400)
+
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            latest, = await transaction.fetch_one(select_latest())
+            latest = latest or 0
+            if since is None:
+                return json_response({'changes': [], 'more': False,
+                                      'next': latest})
+            check_since(since, latest, config)
+
+            rows = await transaction.fetch(select_changes(since, limit))
+            objects = {}
+            for kind, statement in select_objects(rows[:limit]):
+                for row in await transaction.fetch(statement):
+                    data = serialize_row(CHANGE_MODELS[kind][1], row)
+                    objects[(kind, data['id'])] = data
+    except ChangesCompacted as e:
+        return error(str(e), 410)
+    except Exception:
+        return error('Internal Server Error', 500)
+    changes, next_since, more = serialize_changes(since, rows, objects,
+                                                  limit)
+    return json_response({'changes': changes, 'more': more,
+                          'next': next_since})
+
+
+async def add_post(request):
+    """ POST    /posts
+            - Add a new Post and return it in JSON
+    """
+    try:
+        values = parse_post(await read_json(request))
+    except ValueError as e:
+        return error(str(e), 400)
+    values['timestamp_ms'] = to_milliseconds(values['timestamp'])
+    values['hot_score'] = hot_score(values['vote_score'],
+                                    values['timestamp_ms'])
+
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            # In SQLite, Foreign Key constraints have no effect by default,
+            # so it's necessary to validate category_path manually
+            if values['category_path'] not in \
+                    await category_names(transaction):
+                raise NoResultFound()
+            await transaction.execute(Post.__table__.insert().values(values))
+            await bump(transaction, 'posts')
+            await record(request, transaction, 'post', [values['id']])
+    except NoResultFound:
+        return error('Wrong Category', 400)
+    except sqlite3.IntegrityError:
+        return error('Duplicate Post ID', 400)
+    except Exception:
+        return error('Internal Server Error', 500)
+    category_registry.invalidate_stats()
+    post = serialize_values(POST_FIELDS, values)
+    publish_post(post)
+    return json_response({'post': post})
+
+
+async def jsonify_post(request):
+    """ GET     /posts/:id
+            - Return the post information in JSON
+    """
+    try:
+        comment_limit = parse_include(request.query, request.app['config'])
+    except InvalidPageArgument as e:
+        return error(str(e), 400)
+
+    post_id = request.match_info['post_id']
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            try:
+                post = serialize_row(POST_FIELDS, await transaction.fetch_one(
+                    select([column for key, column in POST_FIELDS])
+                    .where(Post.id == post_id)))
+            except NoResultFound:
+                # Posts which were deleted long ago are in the archive
+                post = serialize_row(
+                    ARCHIVED_POST_FIELDS,
+                    await transaction.fetch_one(
+                        select_archived_post(post_id)))
+            if comment_limit is not None:
+                await fetch_embedded_comments(transaction, [post],
+                                              comment_limit)
+    except NoResultFound:
+        return error('No Result Found', 404)
+    except Exception:
+        return error('Internal Server Error', 500)
+    return json_response({'post': post})
+
+
+async def vote(request, model, fields, name):
+    """ Vote for/against a post or a comment and return it in JSON
+
+    The score is incremented by a single UPDATE statement, and the object
+    is selected within the same transaction
+    """
+    object_id = request.match_info[name + '_id']
+    try:
+        option = (await read_json(request))['option']
+    except Exception:
+        return error('Bad Request', 400)
+
+    # Validate option from the request
+    if option != 'upVote' and option != 'downVote':
+        return error("'option' parameter can be either 'upVote' or "
+                     "'downVote'", 400)
+
+    table = model.__table__
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            statement = table.update()\
+                .where(table.c.id == object_id)\
+                .values(vote_values(table, 1 if option == 'upVote' else -1))
+            for flag in LIVE_FLAGS[model]:
+                statement = statement.where(table.c[flag].is_(False))
+            if await transaction.execute(statement) == 0:
+                raise NoResultFound()
+            row = await transaction.fetch_one(
+                select([column for key, column in fields])
+                .where(model.id == object_id))
+            obj = serialize_row(fields, row)
+            if model is Post:
+                await bump(transaction, 'posts', 'post:' + object_id)
+            else:
+                await bump(transaction, 'comments:' + obj['parentId'])
+            await record(request, transaction, name, [object_id])
+    except NoResultFound:
+        return error('No Result Found', 404)
+    except Exception:
+        return error('Internal Server Error', 500)
+    if model is Post:
+        category_registry.invalidate_stats()
+        publish_post(obj)
+    else:
+        publish_comment(obj)
+    return json_response({name: obj})
+
+
+async def vote_post(request):
+    """ POST    /posts/:id
+            - Vote for/against a post and return it in JSON
+    """
+    return await vote(request, Post, POST_FIELDS, 'post')
+
+
+async def edit_post(request):
+    """ PUT     /posts/:id
+            - Edit a post and return it in JSON
+    """
+    post_id = request.match_info['post_id']
+    try:
+        data = await read_json(request)
+        body = data['body'].strip()
+        title = data['title'].strip()
+    except Exception:
+        return error('Bad Request', 400)
+
+    # Validate data from the request
+    if body == '' or title == '':
+        return error("Post title, body can't be a blank", 400)
+
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            row = await transaction.fetch_one(
+                select_live(Post, POST_FIELDS, post_id))
+            await transaction.execute(
+                Post.__table__.update()
+                .where(Post.id == post_id)
+                .values(body=body, title=title))
+            await bump(transaction, 'posts', 'post:' + post_id)
+            await record(request, transaction, 'post', [post_id])
+    except NoResultFound:
+        return error('No Result Found', 404)
+    except Exception:
+        return error('Internal Server Error', 500)
+    post = dict(serialize_row(POST_FIELDS, row), body=body, title=title)
+    publish_post(post)
+    return json_response({'post': post})
+
+
+async def delete_post(request):
+    """ DELETE  /posts/:id
+            - Delete a Post and return it in JSON
+    """
+    post_id = request.match_info['post_id']
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            row = await transaction.fetch_one(
+                select_live(Post, POST_FIELDS, post_id))
+            await transaction.execute(
+                Post.__table__.update()
+                .where(Post.id == post_id)
+                .values(deleted=True))
+            # Set the parent_deleted flag for all child comments to True
+            await transaction.execute(
+                Comment.__table__.update()
+                .where(Comment.parent_id == post_id)
+                .values(parent_deleted=True))
+            await bump(transaction, 'posts', 'post:' + post_id,
+                       'comments:' + post_id)
+            await record(request, transaction, 'post', [post_id])
+            await record(request, transaction, 'comment',
+                         select([Comment.id])
+                         .where(Comment.parent_id == post_id))
+    except NoResultFound:
+        return error('No Result Found', 404)
+    except Exception:
+        return error('Internal Server Error', 500)
+    category_registry.invalidate_stats()
+    post = dict(serialize_row(POST_FIELDS, row), deleted=True)
+    publish_post(post)
+    return json_response({'post': post})
+
+
+async def jsonify_comments_for_post(request):
+    """ GET     /posts/:id/comments
+            - Return all comments for a post in JSON
+    """
+    try:
+        comments, next_cursor = await fetch_page(
+            request, query_comments(request.match_info['post_id']),
+            COMMENT_FIELDS, COMMENT_ORDER, Comment.id)
+    except InvalidPageArgument as e:
+        return error(str(e), 400)
+    except Exception:
+        return error('Internal Server Error', 500)
+    return json_response({'comments': comments, 'next': next_cursor})
+
+
+async def add_comment(request):
+    """ POST    /comments
+            - Add a comment to a post and return it in JSON
+    """
+    try:
+        values = parse_comment(await read_json(request))
+    except ValueError as e:
+        return error(str(e), 400)
+    values['timestamp_ms'] = to_milliseconds(values['timestamp'])
+    post_id = values['parent_id']
+
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            # Find the parent post. Its comment_count is incremented by the
+            # comment_count_insert trigger
+            await transaction.fetch_one(
+                select_live(Post, [('id', Post.id)], post_id))
+            await transaction.execute(
+                Comment.__table__.insert().values(values))
+            await bump(transaction, 'posts', 'post:' + post_id,
+                       'comments:' + post_id)
+            await record(request, transaction, 'comment', [values['id']])
+            await record(request, transaction, 'post', [post_id])
+            # comment_count of the post was changed by the trigger
+            post = None
+            if events.enabled:
+                post = serialize_row(POST_FIELDS, await transaction.fetch_one(
+                    select_live(Post, POST_FIELDS, post_id)))
+    except NoResultFound:
+        return error('No Parent Post Found', 403)
+    except sqlite3.IntegrityError:
+        return error('Duplicate Comment ID', 409)
+    except Exception:
+        return error('Internal Server Error', 500)
+    comment = serialize_values(COMMENT_FIELDS, values)
+    publish_comment(comment)
+    if post is not None:
+        publish_post(post)
+    return json_response({'comment': comment})
+
+
+async def jsonify_comment(request):
+    """ GET     /comments/:id
+            - Return the comment information in JSON
+    """
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            row = await transaction.fetch_one(select_live(
+                Comment, COMMENT_FIELDS, request.match_info['comment_id']))
+    except NoResultFound:
+        return error('No Result Found', 404)
+    except Exception:
+        return error('Internal Server Error', 500)
+    return json_response({'comment': serialize_row(COMMENT_FIELDS, row)})
+
+
+async def vote_comment(request):
+    """ POST    /comments/:id
+            - Vote for/against a comment and return it in JSON
+    """
+    return await vote(request, Comment, COMMENT_FIELDS, 'comment')
+
+
+async def edit_comment(request):
+    """ PUT     /comments/:id
+            - Edit a comment and return it in JSON
+    """
+    comment_id = request.match_info['comment_id']
+    try:
+        body = (await read_json(request))['body'].strip()
+    except Exception:
+        return error('Bad Request', 400)
+
+    # Validate data from the request
+    if body == '':
+        return error("Comment body can't be a blank", 400)
+
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            row = await transaction.fetch_one(
+                select_live(Comment, COMMENT_FIELDS, comment_id))
+            comment = dict(serialize_row(COMMENT_FIELDS, row), body=body)
+            await transaction.execute(
+                Comment.__table__.update()
+                .where(Comment.id == comment_id)
+                .values(body=body))
+            await bump(transaction, 'comments:' + comment['parentId'])
+            await record(request, transaction, 'comment', [comment_id])
+    except NoResultFound:
+        return error('No Result Found', 404)
+    except Exception:
+        return error('Internal Server Error', 500)
+    publish_comment(comment)
+    return json_response({'comment': comment})
+
+
+async def delete_comment(request):
+    """ DELETE  /comments/:id
+            - Delete a comment and return it in JSON
+    """
+    comment_id = request.match_info['comment_id']
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            row = await transaction.fetch_one(
+                select_live(Comment, COMMENT_FIELDS, comment_id))
+            comment = dict(serialize_row(COMMENT_FIELDS, row), deleted=True)
+            post_id = comment['parentId']
+            await transaction.execute(
+                Comment.__table__.update()
+                .where(Comment.id == comment_id)
+                .values(deleted=True))
+
+            # Find the parent post. Its comment_count is decremented by the
+            # comment_count_flag trigger
+            post = serialize_row(POST_FIELDS, await transaction.fetch_one(
+                select_live(Post, POST_FIELDS, post_id)))
+            await bump(transaction, 'posts', 'post:' + post_id,
+                       'comments:' + post_id)
+            await record(request, transaction, 'comment', [comment_id])
+            await record(request, transaction, 'post', [post_id])
+    except NoResultFound:
+        return error('No Result Found', 404)
+    except Exception:
+        return error('Internal Server Error', 500)
+    publish_comment(comment)
+    publish_post(post)
+    return json_response({'comment': comment})
+
+
+async def stream_post_events(request):
+    """ GET     /posts/:id/events
+            - Stream changes of the post and of its comments with
+              Server-Sent Events
+    """
+    post_id = request.match_info['post_id']
+    if not events.enabled:
+        return error('No Result Found', 404)
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            await transaction.fetch_one(
+                select([Post.id]).where(Post.id == post_id))
+    except NoResultFound:
+        return error('No Result Found', 404)
+    except Exception:
+        return error('Internal Server Error', 500)
+    return await stream_events(request, 'post:' + post_id)
+
+
+async def stream_category_events(request):
+    """ GET     /:category/events
+            - Stream changes of the posts of the category with Server-Sent
+              Events
+    """
+    category = request.match_info['category']
+    if not events.enabled:
+        return error('No Result Found', 404)
+    try:
+        async with request.app['pool'].transaction() as transaction:
+            names = await category_names(transaction)
+    except Exception:
+        return error('Internal Server Error', 500)
+    if category not in names:
+        return error('No Result Found', 404)
+    return await stream_events(request, 'category:' + category)
+
+
+@web.middleware
+async def api_errors(request, handler):
+    """ Return errors of unknown routes and methods in JSON, like the
+        error handlers of the Flask app, allow requests from any origin and
+        compress large responses
+    """
+    if request.method == 'OPTIONS':
+        # Answer CORS preflight requests
+        response = web.Response()
+        response.headers['Access-Control-Allow-Methods'] = \
+            request.headers.get('Access-Control-Request-Method', '')
+        response.headers['Access-Control-Allow-Headers'] = \
+            request.headers.get('Access-Control-Request-Headers', '')
+    else:
+        try:
+            response = await handler(request)
+        except web.HTTPNotFound:
+            response = error('No Result Found', 404)
+        except web.HTTPMethodNotAllowed:
+            response = error('Method Not Allowed', 405)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    # Compress large bodies with a coding of Accept-Encoding, like
+    # ResponseEncoder. Streams are already sent
+    if isinstance(response, web.Response) and response.body is not None \
+            and len(response.body) >= \
+            request.app['config']['COMPRESS_MIN_SIZE']:
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.enable_compression()
+    return response
+
+
+def create_app(config=None):
+    """ Create the aiohttp application, with the settings of the Flask app
+        by default
+    """
+    config = config if config is not None else flask_app.config
+    app = web.Application(middlewares=[api_errors])
+    app['config'] = config
+    app['pool'] = ConnectionPool(config)
+
+    async def open_pool(app):
+        await app['pool'].open()
+        # Preload the registry of categories
+        async with app['pool'].transaction() as transaction:
+            await category_names(transaction)
+        archiver.start()
+
+    async def close_pool(app):
+        await app['pool'].close()
+
+    app.on_startup.append(open_pool)
+    app.on_cleanup.append(close_pool)
+
+    # Static routes first, so that /posts/... isn't taken for a category
+    routes = [
+        ('GET', '/categories', jsonify_all_categories),
+        ('GET', '/changes', jsonify_changes),
+        ('GET', '/posts', jsonify_all_posts),
+        ('POST', '/posts', add_post),
+        ('GET', '/posts/{post_id}', jsonify_post),
+        ('POST', '/posts/{post_id}', vote_post),
+        ('PUT', '/posts/{post_id}', edit_post),
+        ('DELETE', '/posts/{post_id}', delete_post),
+        ('GET', '/posts/{post_id}/comments', jsonify_comments_for_post),
+        ('GET', '/posts/{post_id}/events', stream_post_events),
+        ('POST', '/comments', add_comment),
+        ('GET', '/comments/{comment_id}', jsonify_comment),
+        ('POST', '/comments/{comment_id}', vote_comment),
+        ('PUT', '/comments/{comment_id}', edit_comment),
+        ('DELETE', '/comments/{comment_id}', delete_comment),
+        ('GET', '/{category}/posts', jsonify_posts_for_category),
+        ('GET', '/{category}/events', stream_category_events),
+    ]
+    for method, path, handler in routes:
+        app.router.add_route(method, '/api' + path, handler)
+    return app
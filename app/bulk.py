@@ -0,0 +1,59 @@
+import contextlib
+
+# Import the database object and models
+from . import db
+from .archive import stamp_deleted
+from .models import CATEGORY_STATS_TRIGGERS, COMMENT_COUNT_TRIGGERS, \
+    DELETED_MS_TRIGGERS, Category, Comment, Post, category_stats
+from .search import SEARCH_INDEXES
+
+# Tables whose secondary indexes and triggers are dropped by bulk_load()
+BULK_TABLES = (Post.__table__, Comment.__table__)
+
+
+@contextlib.contextmanager
+def bulk_load(engine=None):
+    """ Drop the secondary indexes and the triggers of posts and comments
+        while rows are loaded in bulk, and recreate them afterwards
+
+    Building an index once from all rows is much cheaper than updating it
+    for every inserted row. Without the triggers, inserting a comment
+    doesn't update its post, and rows aren't added to the full-text indexes
+    one by one. So posts must be loaded with their final comment_count. The
+    aggregates of categories are recounted, deleted rows are stamped for
+    the archiver, and the full-text indexes are rebuilt from the loaded rows
+    at the end.
+
+    Nothing else may write to the database during the load.
+    """
+    engine = engine or db.engine
+    if engine.dialect.name != 'sqlite':
+        yield
+        return
+
+    indexes = [index for table in BULK_TABLES for index in table.indexes]
+    names = ', '.join("'{}'".format(table.name) for table in BULK_TABLES)
+    with engine.begin() as connection:
+        triggers = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+            "AND tbl_name IN ({})".format(names)).fetchall()
+        for name, in triggers:
+            connection.execute('DROP TRIGGER {}'.format(name))
+        for index in indexes:
+            connection.execute('DROP INDEX IF EXISTS {}'.format(index.name))
+    try:
+        yield
+    finally:
+        for index in indexes:
+            index.create(bind=engine)
+        with engine.begin() as connection:
+            for trigger in COMMENT_COUNT_TRIGGERS + CATEGORY_STATS_TRIGGERS + \
+                    DELETED_MS_TRIGGERS:
+                connection.execute(trigger)
+            connection.execute(
+                Category.__table__.update().values(category_stats()))
+            stamp_deleted(connection)
+            for index in SEARCH_INDEXES:
+                for statement in index.ddl:
+                    connection.execute(statement)
+                index.rebuild(connection)
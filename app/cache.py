@@ -0,0 +1,167 @@
+import collections
+import functools
+import threading
+import time
+from flask import Response, g, make_response, request
+from werkzeug.urls import url_encode
+from werkzeug.utils import import_string
+
+from . import encoder
+
+
+class LRUBackend(object):
+    """ In-process LRU cache with a TTL, private to one server process
+
+    Every key belongs to a namespace, and a namespace can be invalidated as
+    a whole, e.g. all pages of GET /posts.
+    """
+
+    def __init__(self, app):
+        self.maxsize = app.config['RESPONSE_CACHE_MAXSIZE']
+        self.ttl = app.config['RESPONSE_CACHE_TTL']
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._namespaces = collections.defaultdict(set)
+
+    def get(self, key):
+        """ Return the cached value, or None if missing or expired """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            namespace, value, expires = entry
+            if expires < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, namespace, value):
+        """ Store a value, evicting the least recently used entries """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (namespace, value, time.time() + self.ttl)
+            self._namespaces[namespace].add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, namespace):
+        """ Remove all keys of a namespace """
+        with self._lock:
+            for key in list(self._namespaces.get(namespace, ())):
+                self._remove(key)
+
+    def _remove(self, key):
+        namespace = self._entries.pop(key)[0]
+        keys = self._namespaces[namespace]
+        keys.discard(key)
+        if not keys:
+            del self._namespaces[namespace]
+
+
+class RedisBackend(object):
+    """ Cache shared by all server processes, stored in Redis
+
+    Requires the 'redis' package and RESPONSE_CACHE_REDIS_URL. Redis evicts
+    keys by itself, so evictions are not counted.
+    """
+
+    def __init__(self, app):
+        import redis
+        self.redis = redis.StrictRedis.from_url(
+            app.config['RESPONSE_CACHE_REDIS_URL'])
+        self.ttl = app.config['RESPONSE_CACHE_TTL']
+        self.evictions = None
+
+    def get(self, key):
+        return self.redis.get('cache:' + key)
+
+    def set(self, key, namespace, value):
+        pipeline = self.redis.pipeline()
+        pipeline.setex('cache:' + key, self.ttl, value)
+        pipeline.sadd('namespace:' + namespace, 'cache:' + key)
+        pipeline.expire('namespace:' + namespace, self.ttl)
+        pipeline.execute()
+
+    def invalidate(self, namespace):
+        keys = self.redis.smembers('namespace:' + namespace)
+        self.redis.delete('namespace:' + namespace, *keys)
+
+
+class ResponseCache(object):
+    """ Read-through cache of serialized JSON responses
+
+    Responses are cached per endpoint namespace, per set of query
+    parameters and per preferred mimetype. Streamed responses aren't cached.
+    Write paths invalidate the namespaces they affect.
+    The backend is RESPONSE_CACHE_BACKEND, an import path of a class which
+    is created with the app, like LRUBackend or RedisBackend.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['RESPONSE_CACHE_ENABLED']
+        if self.enabled:
+            backend = import_string(app.config['RESPONSE_CACHE_BACKEND'])
+            self.backend = backend(app)
+
+    def cached(self, namespace):
+        """ Decorator which caches 200 responses of a view function
+
+        namespace is called with the view arguments and returns the cache
+        namespace of the response, e.g. 'posts:react', or None when the
+        response must not be cached
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return view(*args, **kwargs)
+
+                name = namespace(*args, **kwargs)
+                if name is None:
+                    return view(*args, **kwargs)
+                key = '{}?{}|{}'.format(name,
+                                        url_encode(request.args, sort=True),
+                                        request.accept_mimetypes.best)
+                # Responses of conditional views are cached per ETag, so
+                # that a new ETag is never sent with an old body
+                if 'etag' in g:
+                    key += '#' + g.etag
+                body = self.backend.get(key)
+                if body is not None:
+                    self.hits += 1
+                    return Response(body, mimetype=encoder.mimetype())
+
+                self.misses += 1
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    self.backend.set(key, name, response.get_data())
+                return response
+            return wrapper
+        return decorator
+
+    def invalidate(self, *namespaces):
+        """ Remove all cached responses of the namespaces """
+        if self.enabled:
+            for name in namespaces:
+                self.backend.invalidate(name)
+
+    @property
+    def stats(self):
+        """ Return hit, miss and eviction counters """
+        return {
+            'enabled': self.enabled,
+            'evictions': self.backend.evictions if self.enabled else 0,
+            'hits': self.hits,
+            'misses': self.misses
+        }
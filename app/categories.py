@@ -0,0 +1,135 @@
+import collections
+import threading
+import time
+from sqlalchemy import select
+
+from . import db
+from .models import Category
+
+# Names of all categories by path
+SELECT_NAMES = select([Category.path, Category.name]).order_by(Category.path)
+
+# Aggregates of all categories, maintained by CATEGORY_STATS_TRIGGERS
+SELECT_STATS = select([Category.path, Category.post_count,
+                       Category.latest_post_ms, Category.vote_total])\
+    .order_by(Category.path)
+
+
+def serialize_categories(names, rows):
+    """ Serialize the registered categories with their aggregates, from rows
+        of SELECT_STATS
+    """
+    return [{'latestPostTimestamp': latest_post_ms, 'name': names[path],
+             'path': path, 'postCount': post_count, 'voteTotal': vote_total}
+            for path, post_count, latest_post_ms, vote_total in rows
+            if path in names]
+
+
+class CategoryRegistry(object):
+    """ Names and aggregates of all categories by path, loaded once per
+        server process
+
+    Categories almost never change, so new posts are validated and
+    GET /categories is served from the registry instead of querying the
+    category table every time. The registry is loaded before the first
+    request, and again once it is older than CATEGORY_REGISTRY_TTL seconds,
+    so that categories added to the database of a running server are seen.
+    Code which changes categories in the process calls invalidate().
+
+    The aggregates change with every post and vote. Triggers keep them in
+    the columns of category, whichever process or script writes the posts,
+    and the registry keeps the last rows of SELECT_STATS it read. The
+    process drops them with invalidate_stats() when it writes posts, and
+    they are read again after CATEGORY_STATS_TTL seconds, so that writes of
+    other processes are seen.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 0
+        self.stats_ttl = 0
+        self._names = None
+        self._loaded = 0.0
+        self._lock = threading.Lock()
+        self._stats = None
+        self._stats_loaded = 0.0
+        self._stats_version = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config['CATEGORY_REGISTRY_TTL']
+        self.stats_ttl = app.config['CATEGORY_STATS_TTL']
+        app.before_first_request(self.names)
+
+    def current(self):
+        """ Return the ordered dict of names by path, or None when the
+            registry must be loaded first
+        """
+        names = self._names
+        if names is None or time.monotonic() - self._loaded > self.ttl:
+            return None
+        return names
+
+    def update(self, rows):
+        """ Replace the registry with (path, name) rows of SELECT_NAMES, and
+            return the new ordered dict of names by path
+        """
+        self._names = collections.OrderedDict(rows)
+        self._loaded = time.monotonic()
+        return self._names
+
+    def invalidate(self):
+        """ Load the registry again when it is used next """
+        self._names = None
+        self.invalidate_stats()
+
+    def names(self):
+        """ Return an ordered dict of the names of all categories by path,
+            loaded with the session of the app when stale
+        """
+        names = self.current()
+        if names is None:
+            names = self.update(db.session.execute(SELECT_NAMES).fetchall())
+        return names
+
+    def current_stats(self):
+        """ Return a tuple (rows of SELECT_STATS or None when they must be
+            loaded first, version to pass to update_stats())
+        """
+        with self._lock:
+            rows = self._stats
+            if rows is not None and \
+                    time.monotonic() - self._stats_loaded > self.stats_ttl:
+                rows = None
+            return rows, self._stats_version
+
+    def update_stats(self, rows, version):
+        """ Keep rows of SELECT_STATS which were read after current_stats()
+            returned version, and return them as a list
+
+        They are not kept when posts were written meanwhile
+        """
+        rows = [tuple(row) for row in rows]
+        with self._lock:
+            if version == self._stats_version:
+                self._stats = rows
+                self._stats_loaded = time.monotonic()
+        return rows
+
+    def invalidate_stats(self):
+        """ Read the aggregates again when they are used next, after posts
+            were added, voted or deleted
+        """
+        with self._lock:
+            self._stats = None
+            self._stats_version += 1
+
+    def stats(self):
+        """ Return rows of SELECT_STATS, read with the session of the app
+            when stale
+        """
+        rows, version = self.current_stats()
+        if rows is None:
+            rows = self.update_stats(db.session.execute(SELECT_STATS),
+                                     version)
+        return rows
@@ -0,0 +1,179 @@
+from flask import current_app
+from sqlalchemy import func, literal, select
+from sqlalchemy.sql import Select
+
+# Import the database object and models
+from . import db
+from .models import Change, Comment, Post
+from .pagination import InvalidPageArgument, parse_limit
+from .serializers import COMMENT_FIELDS, POST_FIELDS
+
+# Models and fields of the data of a change, by kind
+CHANGE_MODELS = {
+    'post': (Post, POST_FIELDS),
+    'comment': (Comment, COMMENT_FIELDS),
+}
+
+
+class ChangesCompacted(Exception):
+    """ Raised when changes after the 'since' sequence number of GET /changes
+        may have been removed from the change log by compaction
+    """
+
+
+def insert_changes(kind, ids):
+    """ Return an INSERT which appends a change of every post or comment
+        whose id is selected by a SELECT
+    """
+    return Change.__table__.insert().from_select(
+        ['object_id', 'kind'], ids.column(literal(kind)))
+
+
+def select_latest():
+    """ Return a SELECT of the sequence number of the latest change """
+    return select([func.max(Change.seq)])
+
+
+def compaction_due(latest, count, config):
+    """ Return True if the last count changes, up to latest, crossed a
+        multiple of CHANGES_COMPACT_INTERVAL
+    """
+    interval = config['CHANGES_COMPACT_INTERVAL']
+    return latest // interval != (latest - count) // interval
+
+
+def compact_statements(latest, config):
+    """ Return DELETE statements which compact the change log
+
+    Only the CHANGES_MAX_ENTRIES latest sequence numbers are kept, and only
+    the latest change of each object, since a change carries the current
+    data of its object. The latest change of the log is never removed, so
+    sequence numbers keep increasing.
+    """
+    table = Change.__table__
+    horizon = latest - config['CHANGES_MAX_ENTRIES']
+    latest_changes = select([func.max(table.c.seq)])\
+        .group_by(table.c.kind, table.c.object_id)
+    return [table.delete().where(table.c.seq <= horizon),
+            table.delete().where(table.c.seq.notin_(latest_changes))]
+
+
+def record(kind, ids, connection=None):
+    """ Append changes of posts or comments to the change log. ids is a list
+        of ids, or a SELECT of ids
+
+    Must be called within the transaction which changes the objects, like
+    versions.bump. SQLite has a single writer, so changes become visible in
+    the order of their sequence numbers. Every CHANGES_COMPACT_INTERVAL
+    changes, the log is compacted in the same transaction.
+    """
+    executor = connection if connection is not None else db.session
+    if isinstance(ids, Select):
+        count = executor.execute(insert_changes(kind, ids)).rowcount
+    else:
+        rows = [{'kind': kind, 'object_id': id} for id in ids]
+        if rows:
+            executor.execute(Change.__table__.insert(), rows)
+        count = len(rows)
+    if count == 0:
+        return
+
+    latest = executor.execute(select_latest()).scalar()
+    if compaction_due(latest, count, current_app.config):
+        for statement in compact_statements(latest, current_app.config):
+            executor.execute(statement)
+
+
+def parse_change_args(args, config=None):
+    """ Parse 'since' and 'limit' query parameters of GET /changes
+
+    Returns a tuple (since, limit). since is None when it isn't given
+    """
+    if config is None:
+        config = current_app.config
+    since = args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            since = -1
+        if since < 0:
+            raise InvalidPageArgument(
+                "'since' parameter must be a non-negative integer")
+    return since, parse_limit(args, config)
+
+
+def check_since(since, latest, config=None):
+    """ Raise ChangesCompacted when changes after since may be missing from
+        the log, or since is ahead of the log, e.g. of another database
+    """
+    if config is None:
+        config = current_app.config
+    if since > latest or since < latest - config['CHANGES_MAX_ENTRIES']:
+        raise ChangesCompacted(
+            'Changes since {} are no longer available, fetch the lists '
+            'again'.format(since))
+
+
+def select_changes(since, limit):
+    """ Return a SELECT of the changes after since, plus one to find out
+        whether there are more
+    """
+    table = Change.__table__
+    return select([table.c.seq, table.c.kind, table.c.object_id])\
+        .where(table.c.seq > since)\
+        .order_by(table.c.seq)\
+        .limit(limit + 1)
+
+
+def select_objects(rows):
+    """ Yield (kind, SELECT of the fields of the changed objects of that
+        kind) for rows of select_changes
+    """
+    ids = {}
+    for seq, kind, object_id in rows:
+        ids.setdefault(kind, set()).add(object_id)
+    for kind, object_ids in sorted(ids.items()):
+        model, fields = CHANGE_MODELS[kind]
+        yield kind, select([column for key, column in fields])\
+            .where(model.id.in_(sorted(object_ids)))
+
+
+def serialize_changes(since, rows, objects, limit):
+    """ Return a tuple (list of changes, next since, more) of rows of
+        select_changes, with objects, a dict of (kind, id): current data
+
+    The data of an object which no longer exists is null
+    """
+    changes = [{'data': objects.get((kind, object_id)), 'id': object_id,
+                'seq': seq, 'type': kind}
+               for seq, kind, object_id in rows[:limit]]
+    next_since = changes[-1]['seq'] if changes else since
+    return changes, next_since, len(rows) > limit
+
+
+def read_changes(since, limit, pending=None):
+    """ Return a tuple (list of changes, next since, more) of the changes
+        after since, or ([], latest sequence number, False) without since
+
+    pending, if given, is called with the model and the id of an object and
+    returns the sum of its votes which are not written yet, like
+    VoteBuffer.pending(). Raise ChangesCompacted when the changes after
+    since aren't available
+    """
+    latest = db.session.execute(select_latest()).scalar() or 0
+    if since is None:
+        return [], latest, False
+    check_since(since, latest)
+
+    rows = db.session.execute(select_changes(since, limit)).fetchall()
+    objects = {}
+    for kind, statement in select_objects(rows[:limit]):
+        keys = [key for key, column in CHANGE_MODELS[kind][1]]
+        for row in db.session.execute(statement):
+            data = dict(zip(keys, row))
+            if pending is not None:
+                data['voteScore'] += pending(CHANGE_MODELS[kind][0],
+                                             data['id'])
+            objects[(kind, data['id'])] = data
+    return serialize_changes(since, rows, objects, limit)
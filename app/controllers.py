@@ -1,44 +1,295 @@
+import collections
 import datetime
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, request
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 
 # Import the database object and models
-from . import db
-from .models import Category, Comment, Post
+from . import admission, category_registry, db, encoder, events, metrics, \
+    rate_limiter, response_cache, vote_buffer
+from .categories import serialize_categories
+from .archive import ARCHIVED_POST_FIELDS, select_archived_post
+from .changes import ChangesCompacted, parse_change_args, read_changes, \
+    record
+from .models import Comment, Post
+from .pagination import InvalidPageArgument, parse_include, \
+    parse_page_args, parse_sort
+from .search import decode_search_cursor, search
+from .serializers import COMMENT_FIELDS, POST_FIELDS, POST_SORTS, \
+    attach_comments, select_embedded_comments, serialize_page
+from .streaming import stream_list, streaming_format
+from .versions import bump, conditional
+from .votes import serialize, vote
 
 
 # Define the blueprint: 'api'
 api = Blueprint('api', __name__)
+metrics.instrument(api)
+# After metrics, so that the bytes of compressed bodies are counted
+encoder.register(api)
+admission.register(api)
+
+# Responses are encoded in the format negotiated with Accept
+jsonify = encoder.jsonify
+
+# Number of values per IN (...) clause, below SQLite's limit of variables
+IN_CHUNK_SIZE = 500
+
+
+def chunked(values, size=IN_CHUNK_SIZE):
+    """ Split a list of values into lists of at most size values """
+    values = list(values)
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+def parse_batch(request):
+    """ Return the array of items of a batch request
+
+    Raise ValueError with an error message when it isn't a valid array
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        raise ValueError('Bad Request')
+    max_size = current_app.config['MAX_BATCH_SIZE']
+    if len(items) > max_size:
+        raise ValueError(
+            'A batch can contain at most {} items'.format(max_size))
+    return items
+
+
+def query_posts(category=None):
+    """ Return a query for all non-deleted posts, optionally of a category
+
+    Matches ix_post_deleted_timestamp and ix_post_category_deleted_timestamp,
+    and the vote_score and hot_score indexes of the other POST_SORTS
+    """
+    query = db.session.query(Post)
+    if category is not None:
+        query = query.filter(Post.category_path == category)
+    return query.filter(Post.deleted.is_(False))
+
+
+def query_comments(post_id):
+    """ Return a query for all live comments of a post
+
+    Matches ix_comment_parent_deleted_timestamp
+    """
+    return db.session.query(Comment)\
+        .filter(Comment.parent_id == post_id)\
+        .filter(Comment.deleted.is_(False))\
+        .filter(Comment.parent_deleted.is_(False))
+
+
+def includes_comments():
+    """ Return True if the request embeds comments in posts, so that the
+        response changes with the comments as well
+    """
+    return 'include' in request.args
+
+
+def embed_comments(posts, limit):
+    """ Add the first limit comments of each post to the serialized posts,
+        with one query per IN_CHUNK_SIZE posts
+    """
+    rows = []
+    for post_ids in chunked(post['id'] for post in posts):
+        rows.extend(db.session.execute(
+            select_embedded_comments(post_ids, limit)))
+    attach_comments(posts, rows)
+
+
+def invalidate_post(post):
+    """ Invalidate cached responses which contain the post, or the
+        aggregates of its category
+    """
+    category_registry.invalidate_stats()
+    response_cache.invalidate('posts', 'posts:' + post.category_path,
+                              'post:' + post.id, 'categories')
+
+
+def publish_post(post):
+    """ Publish the current data of a post to the event streams of the post
+        and of its category
+    """
+    channels = ['post:' + post.id, 'category:' + post.category_path]
+    if events.wants(channels):
+        events.publish(channels, 'post', serialize(post))
+
+
+def publish_comment(comment):
+    """ Publish the current data of a comment to the event stream of its
+        post
+    """
+    channels = ['post:' + comment.parent_id]
+    if events.wants(channels):
+        events.publish(channels, 'comment', serialize(comment))
+
+
+@vote_buffer.on_flush
+def invalidate_flushed_posts(keys):
+    """ Invalidate cached lists of posts whose votes were just flushed """
+    post_ids = [object_id for table, object_id in keys if table == 'post']
+    if post_ids:
+        category_registry.invalidate_stats()
+        categories = db.session.query(Post.category_path)\
+            .filter(Post.id.in_(post_ids))\
+            .distinct()
+        response_cache.invalidate(
+            'posts', 'categories', *['posts:' + path for path, in categories])
+
+
+@api.route('/cache/stats', methods=['GET'])
+def jsonify_cache_stats():
+    """ GET     /cache/stats
+            - Return hit, miss and eviction counters of the response cache
+    """
+    return jsonify(response_cache.stats)
 
 
 @api.route('/categories', methods=['GET'])
+@response_cache.cached(lambda: 'categories')
 def jsonify_all_categories():
     """ GET     /categories
-            - Return all categories in JSON
+            - Return all categories in JSON, with the number of their
+              posts, the timestamp of their newest post and the sum of
+              the vote scores of their posts
     """
     try:
-        categories = db.session.query(Category).order_by(Category.path)
+        names = category_registry.names()
+        categories = serialize_categories(names, category_registry.stats())
     except Exception:
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(categories=[category.serialize for category in categories])  # noqa
+        return jsonify(categories=categories)
 
 
 @api.route('/<category>/posts', methods=['GET'])
+# Lists with embedded comments aren't cached: comment edits and votes
+# would have to invalidate the lists of the category of their post
+@response_cache.cached(
+    lambda category: None if includes_comments() else 'posts:' + category)
 def jsonify_posts_for_category(category):
     """ GET     /:category/posts
             - Return all posts for a category in JSON
+            - Optional query parameters 'limit' and 'cursor' paginate posts
+            - Optional query parameter 'sort' orders posts by 'timestamp'
+              (default), or by 'voteScore' or 'hot', best first
+            - Optional query parameter 'include=comments' embeds the first
+              'comment_limit' comments of each post, which isn't streamed
+            - Streamed with 'stream=true', or as NDJSON with
+              'Accept: application/x-ndjson'
     """
     try:
-        posts = db.session.query(Post)\
-            .filter(Post.category_path == category)\
-            .filter(Post.deleted.is_(False))\
-            .order_by(Post.timestamp)
+        sort = parse_sort(request.args, POST_SORTS, 'timestamp')
+        page = parse_page_args(request.args, decode=sort.decode)
+        comment_limit = parse_include(request.args)
+    except InvalidPageArgument as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        query = query_posts(category)
+        stream = streaming_format()
+        if stream and comment_limit is None:
+            return stream_list(query, POST_FIELDS, page, sort.column,
+                               Post.id, 'posts', stream, sort.descending)
+        posts, next_cursor = serialize_page(query, POST_FIELDS, page,
+                                            sort.column, Post.id,
+                                            sort.descending)
+        if comment_limit is not None:
+            embed_comments(posts, comment_limit)
+    except Exception:
+        return jsonify({'error': 'Internal Server Error'}), 500
+    else:
+        return jsonify(posts=posts, next=next_cursor)
+
+
+@api.route('/search', methods=['GET'])
+def jsonify_search_results():
+    """ GET     /search?q=<words>
+            - Return posts and comments which contain all words in JSON,
+              best matches first
+            - Paginated with optional query parameters 'limit' and 'cursor'
+    """
+    q = request.args.get('q', '').strip()
+    if q == '':
+        return jsonify({'error': "'q' parameter can't be a blank"}), 400
+
+    try:
+        page = parse_page_args(request.args, decode=decode_search_cursor) \
+            or (current_app.config['DEFAULT_PAGE_SIZE'], None)
+    except InvalidPageArgument as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        results, next_cursor = search(q, page)
+    except Exception:
+        return jsonify({'error': 'Internal Server Error'}), 500
+    else:
+        return jsonify(results=results, next=next_cursor)
+
+
+@api.route('/changes', methods=['GET'])
+def jsonify_changes():
+    """ GET     /changes?since=<seq>
+            - Return the posts and comments changed after the sequence
+              number 'since' in JSON, oldest change first, with their
+              current data, and the 'since' of the next request
+            - Without 'since', return the latest sequence number, to sync
+              from after fetching the lists
+            - Optional query parameter 'limit' limits the number of changes
+    """
+    try:
+        since, limit = parse_change_args(request.args)
+    except InvalidPageArgument as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        changes, next_since, more = vote_buffer.consistent(
+            lambda: read_changes(since, limit, vote_buffer.pending))
+    except ChangesCompacted as e:
+        return jsonify({'error': str(e)}), 410
+    except Exception:
+        return jsonify({'error': 'Internal Server Error'}), 500
+    else:
+        return jsonify(changes=changes, more=more, next=next_since)
+
+
+@api.route('/posts/<post_id>/events', methods=['GET'])
+def stream_post_events(post_id):
+    """ GET     /posts/:id/events
+            - Stream changes of the post and of its comments with
+              Server-Sent Events: 'post' and 'comment' events with their
+              current data in JSON
+    """
+    if not events.enabled:
+        return jsonify({'error': 'No Result Found'}), 404
+    try:
+        db.session.query(Post.id).filter(Post.id == post_id).one()
+    except NoResultFound:
+        return jsonify({'error': 'No Result Found'}), 404
     except Exception:
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(posts=[post.serialize for post in posts])
+        return events.stream('post:' + post_id)
+
+
+@api.route('/<category>/events', methods=['GET'])
+def stream_category_events(category):
+    """ GET     /:category/events
+            - Stream new, voted, edited and deleted posts of the category
+              with Server-Sent Events: 'post' events with their current
+              data in JSON
+    """
+    if not events.enabled:
+        return jsonify({'error': 'No Result Found'}), 404
+    try:
+        names = category_registry.names()
+    except Exception:
+        return jsonify({'error': 'Internal Server Error'}), 500
+    if category not in names:
+        return jsonify({'error': 'No Result Found'}), 404
+    return events.stream('category:' + category)
 
 
 @api.route('/posts', methods=['GET', 'POST'])
@@ -51,55 +302,97 @@ def handle_requests_posts():
     return add_post(request)
 
 
+@conditional(lambda: ('posts', 'comments') if includes_comments()
+             else 'posts')
+@response_cache.cached(lambda: 'posts')
 def jsonify_all_posts():
     """ GET     /posts
             - Return all posts in JSON
+            - Optional query parameters 'limit' and 'cursor' paginate posts
+            - Optional query parameter 'sort' orders posts by 'timestamp'
+              (default), or by 'voteScore' or 'hot', best first
+            - Optional query parameter 'include=comments' embeds the first
+              'comment_limit' comments of each post, which isn't streamed
+            - Streamed with 'stream=true', or as NDJSON with
+              'Accept: application/x-ndjson'
     """
     try:
-        posts = db.session.query(Post)\
-            .filter(Post.deleted.is_(False))\
-            .order_by(Post.timestamp)
+        sort = parse_sort(request.args, POST_SORTS, 'timestamp')
+        page = parse_page_args(request.args, decode=sort.decode)
+        comment_limit = parse_include(request.args)
+    except InvalidPageArgument as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        query = query_posts()
+        stream = streaming_format()
+        if stream and comment_limit is None:
+            return stream_list(query, POST_FIELDS, page, sort.column,
+                               Post.id, 'posts', stream, sort.descending)
+        posts, next_cursor = serialize_page(query, POST_FIELDS, page,
+                                            sort.column, Post.id,
+                                            sort.descending)
+        if comment_limit is not None:
+            embed_comments(posts, comment_limit)
     except Exception:
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(posts=[post.serialize for post in posts])
+        return jsonify(posts=posts, next=next_cursor)
 
 
-def add_post(request):
-    """ POST    /posts
-            - Add a new Post and return it in JSON
+def parse_post(data):
+    """ Parse a post in the JSON format of POST /posts into column values
+
+    Raise ValueError with an error message when the data is invalid, or
+    None when the request has no valid JSON body
     """
-    # Parse data from the request
+    if not isinstance(data, dict):
+        raise ValueError('Bad Request')
     try:
-        author = request.get_json()['author'].strip()
-        body = request.get_json()['body'].strip()
-        category_path = request.get_json()['category']
-        id = request.get_json()['id']
-        timestamp = int(request.get_json()['timestamp'])
-        title = request.get_json()['title'].strip()
+        author = data['author'].strip()
+        body = data['body'].strip()
+        category_path = data['category']
+        id = data['id']
+        timestamp = int(data['timestamp'])
+        title = data['title'].strip()
 
         # Convert time in milliseconds to datetime.datetime() object
         timestamp = datetime.datetime.fromtimestamp(timestamp / 1000.0)
     except Exception:
-        return jsonify({'error': 'Bad Request'}), 400
+        raise ValueError('Bad Request')
 
     # Validate data from the request
     if author == '' or body == '' or title == '':
-        return jsonify({'error': "Post title, body and author can't be a blank"}), 400  # noqa
+        raise ValueError("Post title, body and author can't be a blank")
+
+    return dict(author=author, body=body, category_path=category_path,
+                comment_count=0, deleted=False, id=id, timestamp=timestamp,
+                title=title, vote_score=0)
+
+
+@rate_limiter.limited('posts')
+def add_post(request):
+    """ POST    /posts
+            - Add a new Post and return it in JSON
+    """
+    # Parse and validate data from the request
+    try:
+        values = parse_post(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     try:
         # Validate category_path from the request
         # In SQLite, Foreign Key constraints have no effect by default,
         # so it's necessary to validate category_path manually
-        category = db.session.query(Category)\
-            .filter(Category.path == category_path)\
-            .one()
+        if values['category_path'] not in category_registry.names():
+            raise NoResultFound()
 
         # Create a new post and store it in Database
-        new_post = Post(author=author, body=body, category_path=category_path,
-                        comment_count=0, deleted=False, id=id,
-                        timestamp=timestamp, title=title, vote_score=0)
+        new_post = Post(**values)
         db.session.add(new_post)
+        bump('posts')
+        record('post', [new_post.id])
 
         # Commit changes
         db.session.commit()
@@ -113,9 +406,72 @@ def add_post(request):
         db.session.rollback()
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
+        invalidate_post(new_post)
+        publish_post(new_post)
         return jsonify(post=new_post.serialize)
 
 
+@api.route('/posts:batch', methods=['POST'])
+@rate_limiter.limited('posts')
+def add_posts_batch():
+    """ POST    /posts:batch
+            - Add an array of new posts in a single transaction and return
+              the result for each post in JSON
+    """
+    try:
+        items = parse_batch(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Parse and validate data of each post
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, parse_post(item)))
+        except ValueError as e:
+            results[index] = {'error': str(e), 'status': 400}
+
+    try:
+        # Validate categories with the registry, and IDs with one query
+        # per chunk of values
+        categories = category_registry.names()
+        ids = {values['id'] for index, values in parsed}
+        existing = set()
+        for chunk in chunked(ids):
+            existing.update(id for id, in db.session.query(Post.id)
+                            .filter(Post.id.in_(chunk)))
+
+        new_posts = []
+        for index, values in parsed:
+            if values['category_path'] not in categories:
+                results[index] = {'error': 'Wrong Category', 'status': 400}
+            elif values['id'] in existing:
+                results[index] = {'error': 'Duplicate Post ID', 'status': 400}
+            else:
+                existing.add(values['id'])
+                new_posts.append(values)
+                results[index] = {'id': values['id'], 'status': 200}
+
+        # Insert all valid posts with executemany
+        if new_posts:
+            db.session.execute(Post.__table__.insert(), new_posts)
+            bump('posts')
+            record('post', [values['id'] for values in new_posts])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        return jsonify({'error': 'Internal Server Error'}), 500
+    else:
+        category_registry.invalidate_stats()
+        response_cache.invalidate('posts', 'categories', *{
+            'posts:' + values['category_path'] for values in new_posts})
+        if events.enabled:
+            for values in new_posts:
+                publish_post(Post(**values))
+        return jsonify(results=results)
+
+
 @api.route('/posts/<post_id>', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def handle_requests_post(post_id):
     """ Handle HTTP requests for API Endpoint: /posts/:id """
@@ -133,29 +489,53 @@ def handle_requests_post(post_id):
     return delete_post(post_id)
 
 
+@conditional(lambda post_id: ('post:' + post_id, 'comments:' + post_id)
+             if includes_comments() else 'post:' + post_id,
+             pending=lambda post_id: vote_buffer.pending(Post, post_id),
+             consistent=vote_buffer.consistent)
+@response_cache.cached(lambda post_id: 'post:' + post_id)
 def jsonify_post(post_id):
     """ GET     /posts/:id
             - Return the post information in JSON
+            - Optional query parameter 'include=comments' embeds its first
+              'comment_limit' comments
+            - Posts which were deleted long ago are read from the archive
     """
+    try:
+        comment_limit = parse_include(request.args)
+    except InvalidPageArgument as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         post = db.session.query(Post)\
             .filter(Post.id == post_id)\
-            .one()
+            .first()
+        if post is not None:
+            post = serialize(post)
+        else:
+            row = db.session.execute(select_archived_post(post_id)).first()
+            if row is None:
+                raise NoResultFound()
+            post = dict(zip([key for key, column in ARCHIVED_POST_FIELDS],
+                            row))
+        if comment_limit is not None:
+            embed_comments([post], comment_limit)
     except NoResultFound:
         return jsonify({'error': 'No Result Found'}), 404
     except Exception:
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(post=post.serialize)
+        return jsonify(post=post)
 
 
+@rate_limiter.limited('votes')
 def vote_post(post_id, request):
     """ POST    /posts/:id
             - Vote for/against a post and return it in JSON
     """
     # Parse data from the request
     try:
-        option = request.get_json()['option']
+        option = request.get_json(silent=True)['option']
     except Exception:
         return jsonify({'error': 'Bad Request'}), 400
 
@@ -165,15 +545,7 @@ def vote_post(post_id, request):
 
     # Vote for/against the post and store it in database
     try:
-        post = db.session.query(Post)\
-            .filter(Post.id == post_id)\
-            .filter(Post.deleted.is_(False))\
-            .one()
-        if option == 'upVote':
-            post.vote_score += 1
-        else:
-            post.vote_score -= 1
-        db.session.add(post)
+        post = vote(Post, post_id, 1 if option == 'upVote' else -1)
         db.session.commit()
     except NoResultFound:
         db.session.rollback()
@@ -182,7 +554,9 @@ def vote_post(post_id, request):
         db.session.rollback()
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(post=post.serialize)
+        invalidate_post(post)
+        publish_post(post)
+        return jsonify(post=serialize(post))
 
 
 def edit_post(post_id, request):
@@ -191,8 +565,9 @@ def edit_post(post_id, request):
     """
     # Parse data from the request
     try:
-        body = request.get_json()['body'].strip()
-        title = request.get_json()['title'].strip()
+        data = request.get_json(silent=True)
+        body = data['body'].strip()
+        title = data['title'].strip()
     except Exception:
         return jsonify({'error': 'Bad Request'}), 400
 
@@ -209,6 +584,8 @@ def edit_post(post_id, request):
         post.body = body
         post.title = title
         db.session.add(post)
+        bump('posts', 'post:' + post_id)
+        record('post', [post_id])
         db.session.commit()
     except NoResultFound:
         db.session.rollback()
@@ -217,7 +594,9 @@ def edit_post(post_id, request):
         db.session.rollback()
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(post=post.serialize)
+        invalidate_post(post)
+        publish_post(post)
+        return jsonify(post=serialize(post))
 
 
 def delete_post(post_id):
@@ -236,6 +615,10 @@ def delete_post(post_id):
         comments = db.session.query(Comment)\
             .filter(Comment.parent_id == post_id)\
             .update({Comment.parent_deleted: True}, synchronize_session=False)
+        bump('posts', 'post:' + post_id, 'comments:' + post_id)
+        record('post', [post_id])
+        record('comment', select([Comment.id])
+               .where(Comment.parent_id == post_id))
         db.session.commit()
     except NoResultFound:
         db.session.rollback()
@@ -244,66 +627,100 @@ def delete_post(post_id):
         db.session.rollback()
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(post=post.serialize)
+        invalidate_post(post)
+        publish_post(post)
+        return jsonify(post=serialize(post))
 
 
 @api.route('/posts/<post_id>/comments', methods=['GET'])
+@conditional(lambda post_id: 'comments:' + post_id)
 def jsonify_comments_for_post(post_id):
     """ GET     /posts/:id/comments
             - Return all comments for a post in JSON
+            - Optional query parameters 'limit' and 'cursor' paginate comments
+            - Streamed with 'stream=true', or as NDJSON with
+              'Accept: application/x-ndjson'
     """
     try:
-        comments = db.session.query(Comment)\
-            .filter(Comment.parent_id == post_id)\
-            .filter(Comment.deleted.is_(False))\
-            .filter(Comment.parent_deleted.is_(False))\
-            .order_by(Comment.timestamp)
+        page = parse_page_args(request.args)
+    except InvalidPageArgument as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        query = query_comments(post_id)
+        stream = streaming_format()
+        if stream:
+            return stream_list(query, COMMENT_FIELDS, page, Comment.timestamp,
+                               Comment.id, 'comments', stream)
+        comments, next_cursor = serialize_page(query, COMMENT_FIELDS, page,
+                                               Comment.timestamp, Comment.id)
     except Exception:
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(comments=[comment.serialize for comment in comments])
+        return jsonify(comments=comments, next=next_cursor)
 
 
-@api.route('/comments', methods=['POST'])
-def add_comment():
-    """ POST    /comments
-            - Add a comment to a post and return it in JSON
+def parse_comment(data):
+    """ Parse a comment in the JSON format of POST /comments into column
+        values
+
+    Raise ValueError with an error message when the data is invalid, or
+    None when the request has no valid JSON body
     """
-    # Parse data from the request
+    if not isinstance(data, dict):
+        raise ValueError('Bad Request')
     try:
-        author = request.get_json()['author'].strip()
-        body = request.get_json()['body'].strip()
-        id = request.get_json()['id']
-        parent_id = request.get_json()['parentId']
-        timestamp = int(request.get_json()['timestamp'])
+        author = data['author'].strip()
+        body = data['body'].strip()
+        id = data['id']
+        parent_id = data['parentId']
+        timestamp = int(data['timestamp'])
 
         # Convert time in milliseconds to datetime.datetime() object
         timestamp = datetime.datetime.fromtimestamp(timestamp / 1000.0)
     except Exception:
-        return jsonify({'error': 'Bad Request'}), 400
+        raise ValueError('Bad Request')
 
     # Validate data from the request
     if author == '' or body == '':
-        return jsonify({'error': "Comment body and author can't be a blank"}), 400  # noqa
+        raise ValueError("Comment body and author can't be a blank")
+
+    return dict(author=author, body=body, deleted=False, id=id,
+                parent_deleted=False, parent_id=parent_id,
+                timestamp=timestamp, vote_score=0)
+
 
+@api.route('/comments', methods=['POST'])
+@rate_limiter.limited('comments')
+def add_comment():
+    """ POST    /comments
+            - Add a comment to a post and return it in JSON
+    """
+    # Parse and validate data from the request
     try:
-        # Find the parent post and update comment_count
+        values = parse_comment(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        # Find the parent post. Its comment_count is incremented by the
+        # comment_count_insert trigger
         post = db.session.query(Post)\
-            .filter(Post.id == parent_id)\
+            .filter(Post.id == values['parent_id'])\
             .filter(Post.deleted.is_(False))\
             .one()
-        post.comment_count += 1
-        db.session.add(post)
 
         # Create a new comment and store it in Database
-        new_comment = Comment(author=author, body=body, deleted=False, id=id,
-                              parent_deleted=False, parent_id=parent_id,
-                              timestamp=timestamp, vote_score=0)
+        new_comment = Comment(**values)
         db.session.add(new_comment)
+        bump('posts', 'post:' + post.id, 'comments:' + post.id)
+        record('comment', [new_comment.id])
+        record('post', [post.id])
 
         # Commit changes
         db.session.commit()
     except NoResultFound:
+        db.session.rollback()
         return jsonify({'error': 'No Parent Post Found'}), 403
     except IntegrityError:
         db.session.rollback()
@@ -312,9 +729,90 @@ def add_comment():
         db.session.rollback()
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
+        invalidate_post(post)
+        publish_comment(new_comment)
+        # comment_count of the post was changed by the trigger
+        publish_post(post)
         return jsonify(comment=new_comment.serialize)
 
 
+@api.route('/comments:batch', methods=['POST'])
+@rate_limiter.limited('comments')
+def add_comments_batch():
+    """ POST    /comments:batch
+            - Add an array of comments in a single transaction and return
+              the result for each comment in JSON
+    """
+    try:
+        items = parse_batch(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Parse and validate data of each comment
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, parse_comment(item)))
+        except ValueError as e:
+            results[index] = {'error': str(e), 'status': 400}
+
+    try:
+        # Find parent posts and existing IDs with one query per chunk
+        parent_ids = {values['parent_id'] for index, values in parsed}
+        parents = {}
+        for chunk in chunked(parent_ids):
+            parents.update(db.session.query(Post.id, Post.category_path)
+                           .filter(Post.id.in_(chunk))
+                           .filter(Post.deleted.is_(False)))
+        ids = {values['id'] for index, values in parsed}
+        existing = set()
+        for chunk in chunked(ids):
+            existing.update(id for id, in db.session.query(Comment.id)
+                            .filter(Comment.id.in_(chunk)))
+
+        new_comments = []
+        for index, values in parsed:
+            if values['parent_id'] not in parents:
+                results[index] = {'error': 'No Parent Post Found',
+                                  'status': 403}
+            elif values['id'] in existing:
+                results[index] = {'error': 'Duplicate Comment ID',
+                                  'status': 409}
+            else:
+                existing.add(values['id'])
+                new_comments.append(values)
+                results[index] = {'id': values['id'], 'status': 200}
+
+        # Insert all valid comments with executemany. comment_count of
+        # each parent post is incremented by the comment_count_insert trigger
+        counts = collections.Counter(
+            values['parent_id'] for values in new_comments)
+        if new_comments:
+            db.session.execute(Comment.__table__.insert(), new_comments)
+        if counts:
+            bump('posts', *['post:' + post_id for post_id in counts] +
+                 ['comments:' + post_id for post_id in counts])
+            record('comment', [values['id'] for values in new_comments])
+            record('post', sorted(counts))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        return jsonify({'error': 'Internal Server Error'}), 500
+    else:
+        response_cache.invalidate('posts', *{
+            'posts:' + parents[post_id] for post_id in counts})
+        response_cache.invalidate(*['post:' + post_id for post_id in counts])
+        if events.enabled:
+            for values in new_comments:
+                publish_comment(Comment(**values))
+            for post_id in counts:
+                if events.wants(['post:' + post_id,
+                                 'category:' + parents[post_id]]):
+                    publish_post(db.session.query(Post).get(post_id))
+        return jsonify(results=results)
+
+
 @api.route('/comments/<comment_id>', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def handle_requests_comment(comment_id):
     """ Handle HTTP requests for API Endpoint: /comments/:id """
@@ -347,16 +845,17 @@ def jsonify_comment(comment_id):
     except Exception:
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(comment=comment.serialize)
+        return jsonify(comment=serialize(comment))
 
 
+@rate_limiter.limited('votes')
 def vote_comment(comment_id, request):
     """ POST    /comments/:id
             - Vote for/against a comment and return it in JSON
     """
     # Parse data from the request
     try:
-        option = request.get_json()['option']
+        option = request.get_json(silent=True)['option']
     except Exception:
         return jsonify({'error': 'Bad Request'}), 400
 
@@ -366,16 +865,7 @@ def vote_comment(comment_id, request):
 
     # Vote for/against the comment and store it in database
     try:
-        comment = db.session.query(Comment)\
-            .filter(Comment.id == comment_id)\
-            .filter(Comment.deleted.is_(False))\
-            .filter(Comment.parent_deleted.is_(False))\
-            .one()
-        if option == 'upVote':
-            comment.vote_score += 1
-        else:
-            comment.vote_score -= 1
-        db.session.add(comment)
+        comment = vote(Comment, comment_id, 1 if option == 'upVote' else -1)
         db.session.commit()
     except NoResultFound:
         db.session.rollback()
@@ -384,7 +874,8 @@ def vote_comment(comment_id, request):
         db.session.rollback()
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(comment=comment.serialize)
+        publish_comment(comment)
+        return jsonify(comment=serialize(comment))
 
 
 def edit_comment(comment_id, request):
@@ -393,7 +884,7 @@ def edit_comment(comment_id, request):
     """
     # Parse data from the request
     try:
-        body = request.get_json()['body'].strip()
+        body = request.get_json(silent=True)['body'].strip()
     except Exception:
         return jsonify({'error': 'Bad Request'}), 400
 
@@ -410,6 +901,8 @@ def edit_comment(comment_id, request):
             .one()
         comment.body = body
         db.session.add(comment)
+        bump('comments:' + comment.parent_id)
+        record('comment', [comment_id])
         db.session.commit()
     except NoResultFound:
         db.session.rollback()
@@ -418,7 +911,8 @@ def edit_comment(comment_id, request):
         db.session.rollback()
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(comment=comment.serialize)
+        publish_comment(comment)
+        return jsonify(comment=serialize(comment))
 
 
 def delete_comment(comment_id):
@@ -435,13 +929,15 @@ def delete_comment(comment_id):
         comment.deleted = True
         db.session.add(comment)
 
-        # Find the parent post and update comment_count
+        # Find the parent post. Its comment_count is decremented by the
+        # comment_count_flag trigger
         post = db.session.query(Post)\
             .filter(Post.id == comment.parent_id)\
             .filter(Post.deleted.is_(False))\
             .one()
-        post.comment_count -= 1
-        db.session.add(post)
+        bump('posts', 'post:' + post.id, 'comments:' + post.id)
+        record('comment', [comment_id])
+        record('post', [post.id])
 
         # Commit changes
         db.session.commit()
@@ -452,4 +948,7 @@ def delete_comment(comment_id):
         db.session.rollback()
         return jsonify({'error': 'Internal Server Error'}), 500
     else:
-        return jsonify(comment=comment.serialize)
+        invalidate_post(post)
+        publish_comment(comment)
+        publish_post(post)
+        return jsonify(comment=serialize(comment))
@@ -0,0 +1,148 @@
+import copy
+import functools
+import sqlite3
+import weakref
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy, SignallingSession
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import sessionmaker
+
+# Options of DATABASE_CONNECT_OPTIONS which configure the connection pool
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_recycle', 'pool_timeout')
+
+# Methods of requests which are served by the read-only engine
+READ_METHODS = ('GET', 'HEAD')
+
+
+def set_pragmas(pragmas, dbapi_connection, connection_record):
+    """ Run PRAGMA statements on a new SQLite connection """
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas:
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
+
+
+def create_functions(functions, dbapi_connection, connection_record=None):
+    """ Define Python functions in SQL on a new SQLite connection """
+    for name, (num_params, function) in sorted(functions.items()):
+        dbapi_connection.create_function(name, num_params, function)
+
+
+def connection_factory(functions):
+    """ Return a subclass of sqlite3.Connection which defines functions in
+        SQL, for drivers which are not run by SQLAlchemy, e.g. aiosqlite
+    """
+    class Connection(sqlite3.Connection):
+        def __init__(self, *args, **kwargs):
+            super(Connection, self).__init__(*args, **kwargs)
+            create_functions(functions, self)
+    return Connection
+
+
+class RoutingSession(SignallingSession):
+    """ Session which sends the queries of GET requests to the read-only
+        engine, when READ_ENGINE_ENABLED is set
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.app.config['READ_ENGINE_ENABLED'] and \
+                has_request_context() and request.method in READ_METHODS:
+            return self.db.get_read_engine(self.app)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """ Flask-SQLAlchemy with the engine options of DATABASE_CONNECT_OPTIONS
+
+    DATABASE_CONNECT_OPTIONS is a dict of pool_size, max_overflow,
+    pool_recycle, pool_timeout and connect_args, which are passed to
+    create_engine() of every server process.
+
+    Flask-SQLAlchemy opens a new connection per checkout for file-backed
+    SQLite databases. With a pool_size, connections are kept in a QueuePool
+    instead, and may be used by any thread of the process, one at a time.
+    Every new SQLite connection runs the PRAGMA statements of SQLITE_PRAGMAS
+    and defines the functions registered with sql_function().
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._configured_engines = weakref.WeakSet()
+        self._read_engines = {}
+        self.sql_functions = {}
+        super(SQLAlchemy, self).__init__(*args, **kwargs)
+
+    def sql_function(self, name, num_params):
+        """ Decorator which defines a Python function in SQL as name, on
+            every SQLite connection
+        """
+        def register(function):
+            self.sql_functions[name] = (num_params, function)
+            return function
+        return register
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        connect_options = copy.deepcopy(app.config['DATABASE_CONNECT_OPTIONS'])
+        connect_args = connect_options.pop('connect_args', {})
+        options.update(connect_options)
+        options.setdefault('connect_args', {}).update(connect_args)
+
+        if info.drivername == 'sqlite':
+            if info.database in (None, '', ':memory:'):
+                # A memory database lives in its only connection
+                for key in POOL_OPTIONS:
+                    options.pop(key, None)
+            elif options.get('pool_size'):
+                options['poolclass'] = QueuePool
+                options['connect_args']['check_same_thread'] = False
+        return super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+
+    def get_engine(self, app=None, bind=None):
+        engine = super(SQLAlchemy, self).get_engine(app, bind)
+        if engine not in self._configured_engines:
+            self._configured_engines.add(engine)
+            self._configure(self.get_app(app), engine)
+        return engine
+
+    def get_read_engine(self, app=None):
+        """ Return an engine whose connections can't write, for the URI of
+            SQLALCHEMY_DATABASE_URI
+
+        SQLite in WAL mode lets readers run while a writer holds the lock,
+        so reads on this engine never wait for writes on the main engine.
+        """
+        app = self.get_app(app)
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        engine = self._read_engines.get(uri)
+        if engine is None:
+            connector = self.make_connector(app)
+            engine = connector.get_engine()
+            self._configure(app, engine)
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', functools.partial(
+                    set_pragmas, [('query_only', 'ON')]))
+            self._read_engines[uri] = engine
+        return engine
+
+    def dispose(self, app=None):
+        """ Close the pooled connections of all engines, e.g. after fork() """
+        self.get_engine(app).dispose()
+        for engine in self._read_engines.values():
+            engine.dispose()
+
+    def _configure(self, app, engine):
+        """ Run SQLITE_PRAGMAS and define the SQL functions on every new
+            connection of an engine
+        """
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', functools.partial(
+                set_pragmas, sorted(app.config['SQLITE_PRAGMAS'].items())))
+            event.listen(engine, 'connect', functools.partial(
+                create_functions, self.sql_functions))
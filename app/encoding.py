@@ -0,0 +1,123 @@
+import collections
+import importlib
+import zlib
+from flask import current_app, jsonify as jsonify_json, request
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+def optional_import(name):
+    """ Return a module, or None when it isn't installed """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def compressor(coding, config):
+    """ Return a function which compresses bytes with a content coding, or
+        None when the package of the coding isn't installed
+    """
+    if coding == 'gzip':
+        level = config['COMPRESS_GZIP_LEVEL']
+
+        def compress_gzip(data):
+            # zlib with a gzip header, without the timestamp which
+            # gzip.compress() writes, so that equal bodies compress equally
+            compress = zlib.compressobj(level, zlib.DEFLATED,
+                                        16 + zlib.MAX_WBITS)
+            return compress.compress(data) + compress.flush()
+        return compress_gzip
+    if coding == 'br':
+        brotli = optional_import('brotli')
+        if brotli is None:
+            return None
+        quality = config['COMPRESS_BROTLI_QUALITY']
+        return lambda data: brotli.compress(data, quality=quality)
+    raise ValueError('Unknown content coding: {}'.format(coding))
+
+
+class ResponseEncoder(object):
+    """ Content negotiation and compression of the responses of a blueprint
+
+    Views return jsonify(), which encodes data as JSON, or as MessagePack
+    when the client prefers application/msgpack in Accept and MSGPACK_ENABLED
+    is set. JSON is compact unless JSONIFY_PRETTYPRINT_REGULAR is set.
+
+    Bodies of at least COMPRESS_MIN_SIZE bytes are compressed with the
+    content coding of COMPRESS_ENCODINGS which the client prefers in
+    Accept-Encoding. Smaller bodies aren't worth the time, and streamed
+    responses are sent as they are produced.
+
+    MessagePack requires the 'msgpack' package, and the 'br' coding the
+    'brotli' package. Formats and codings whose package isn't installed
+    aren't offered.
+    """
+
+    def __init__(self, app=None):
+        self.msgpack = None
+        self.mimetypes = [JSON_MIMETYPE]
+        self.compressors = collections.OrderedDict()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.msgpack = optional_import('msgpack') \
+            if app.config['MSGPACK_ENABLED'] else None
+        self.mimetypes = [JSON_MIMETYPE]
+        if self.msgpack is not None:
+            self.mimetypes.append(MSGPACK_MIMETYPE)
+        self.compressors = collections.OrderedDict()
+        for coding in app.config['COMPRESS_ENCODINGS']:
+            compress = compressor(coding, app.config)
+            if compress is not None:
+                self.compressors[coding] = compress
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+
+    def register(self, blueprint):
+        """ Compress the responses of a blueprint """
+        blueprint.after_request(self._compress)
+
+    def mimetype(self):
+        """ Return the format of the response negotiated with Accept """
+        return request.accept_mimetypes.best_match(self.mimetypes,
+                                                   default=JSON_MIMETYPE)
+
+    def coding(self):
+        """ Return the content coding negotiated with Accept-Encoding, or
+            None to send the body as it is
+        """
+        return request.accept_encodings.best_match(list(self.compressors))
+
+    def jsonify(self, *args, **kwargs):
+        """ Return a response of data in the negotiated format, with the
+            arguments of flask.jsonify
+        """
+        if self.mimetype() != MSGPACK_MIMETYPE:
+            return jsonify_json(*args, **kwargs)
+        if args and kwargs:
+            raise TypeError('jsonify() behavior undefined when passed both '
+                            'args and kwargs')
+        data = args[0] if len(args) == 1 else args or kwargs
+        return current_app.response_class(
+            self.msgpack.packb(data, use_bin_type=True),
+            mimetype=MSGPACK_MIMETYPE)
+
+    def _compress(self, response):
+        if len(self.mimetypes) > 1:
+            response.vary.add('Accept')
+        if not self.compressors or response.direct_passthrough or \
+                response.is_streamed or response.status_code == 304 or \
+                'Content-Encoding' in response.headers:
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        response.vary.add('Accept-Encoding')
+        coding = self.coding()
+        if coding is not None:
+            response.set_data(self.compressors[coding](data))
+            response.headers['Content-Encoding'] = coding
+        return response
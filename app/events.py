@@ -0,0 +1,249 @@
+import asyncio
+import collections
+import json
+import os
+import threading
+from flask import Response
+from werkzeug.utils import import_string
+
+SSE_MIMETYPE = 'text/event-stream'
+
+# Sent first on every stream: how long EventSource waits before reconnecting
+RETRY_FRAME = 'retry: 3000\n\n'
+
+# Sent to a subscriber whose queue overflowed, right before its stream ends.
+# The client should fetch the post or the list again after reconnecting
+RESET_FRAME = 'event: reset\ndata: {}\n\n'
+
+# Sent when no event was published for EVENTS_KEEPALIVE_SECONDS, so that
+# proxies keep the connection open and closed connections are noticed
+KEEPALIVE_FRAME = ': keepalive\n\n'
+
+
+def format_event(event, data):
+    """ Return an event in the Server-Sent Events format """
+    return 'event: {}\ndata: {}\n\n'.format(
+        event, json.dumps(data, separators=(',', ':'), sort_keys=True))
+
+
+class Subscription(object):
+    """ A bounded queue of the frames of a channel, read by one stream
+
+    Publishing never waits for the reader. When size frames are pending,
+    the reader is too slow: the pending frames are dropped and the reader
+    gets RESET_FRAME instead, which ends its stream. So a slow client never
+    holds up the others, and never holds more than size frames.
+    """
+
+    def __init__(self, channel, size):
+        self.channel = channel
+        self.size = size
+        self.overflowed = False
+        self._frames = collections.deque()
+        self._ready = threading.Condition()
+
+    def put(self, frame):
+        with self._ready:
+            self._append(frame)
+            self._ready.notify()
+
+    def _append(self, frame):
+        if self.overflowed:
+            return
+        if len(self._frames) >= self.size:
+            self.overflowed = True
+            self._frames.clear()
+        else:
+            self._frames.append(frame)
+
+    def _pop(self):
+        if self.overflowed:
+            return RESET_FRAME
+        return self._frames.popleft() if self._frames else None
+
+    def get(self, timeout):
+        """ Return the next frame, or None if there was none for timeout
+            seconds
+        """
+        with self._ready:
+            if not self._frames and not self.overflowed:
+                self._ready.wait(timeout)
+            return self._pop()
+
+
+class AsyncSubscription(Subscription):
+    """ A Subscription read by a coroutine of an asyncio event loop
+
+    Frames may be published from any thread, and are queued by the loop.
+    It must be created by a coroutine running in the loop, which owns its
+    event
+    """
+
+    def __init__(self, channel, size, loop):
+        super(AsyncSubscription, self).__init__(channel, size)
+        self.loop = loop
+        self._event = asyncio.Event()
+
+    def put(self, frame):
+        self.loop.call_soon_threadsafe(self._put, frame)
+
+    def _put(self, frame):
+        self._append(frame)
+        self._event.set()
+
+    async def get(self, timeout):
+        if not self._frames and not self.overflowed:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._event.clear()
+        return self._pop()
+
+
+class LocalBackend(object):
+    """ Deliver events to the subscribers of the same server process """
+
+    shared = False
+
+    def __init__(self, app, deliver):
+        self.deliver = deliver
+
+    def start(self):
+        pass
+
+    def publish(self, channel, frame):
+        self.deliver(channel, frame)
+
+
+class RedisBackend(object):
+    """ Deliver events to the subscribers of all server processes, through
+        Redis publish/subscribe
+
+    Requires the 'redis' package and EVENTS_REDIS_URL. Every process which
+    has subscribers listens to all channels in a thread of its own, started
+    with the first subscription, because threads don't survive fork()
+    """
+
+    shared = True
+
+    def __init__(self, app, deliver):
+        import redis
+        self.redis = redis.StrictRedis.from_url(app.config['EVENTS_REDIS_URL'])
+        self.deliver = deliver
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(**{'events:*': self._on_message})
+            pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def _on_message(self, message):
+        channel = message['channel'].decode('utf-8')[len('events:'):]
+        self.deliver(channel, message['data'].decode('utf-8'))
+
+    def publish(self, channel, frame):
+        self.redis.publish('events:' + channel, frame)
+
+
+class EventBus(object):
+    """ Publish/subscribe of changes of posts and comments, streamed to
+        clients with Server-Sent Events
+
+    Write paths publish the current data of the posts and comments they
+    changed to channels like 'post:<id>' and 'category:<path>', after their
+    transaction is committed. Every stream subscribes to one channel with a
+    Subscription of EVENTS_QUEUE_SIZE frames. An event is serialized once
+    and the same frame is fanned out to every subscriber.
+
+    The backend is EVENTS_BACKEND, an import path of a class which is
+    created with the app, like LocalBackend, which only reaches the streams
+    of the same process, or RedisBackend, which reaches all processes.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._subscribers = collections.defaultdict(set)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['EVENTS_ENABLED']
+        self.queue_size = app.config['EVENTS_QUEUE_SIZE']
+        self.keepalive = app.config['EVENTS_KEEPALIVE_SECONDS']
+        if self.enabled:
+            backend = import_string(app.config['EVENTS_BACKEND'])
+            self.backend = backend(app, self._deliver)
+
+    def wants(self, channels):
+        """ Return True if events of the channels may have subscribers, so
+            that publishers only serialize data which will be sent
+        """
+        if not self.enabled:
+            return False
+        if self.backend.shared:
+            return True
+        with self._lock:
+            return any(channel in self._subscribers for channel in channels)
+
+    def publish(self, channels, event, data):
+        """ Send an event with JSON data to the subscribers of channels """
+        if not self.wants(channels):
+            return
+        frame = format_event(event, data)
+        for channel in channels:
+            self.backend.publish(channel, frame)
+
+    def subscribe(self, subscription):
+        self.backend.start()
+        with self._lock:
+            self._subscribers[subscription.channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def _deliver(self, channel, frame):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(frame)
+
+    def stream(self, channel):
+        """ Return a streamed Server-Sent Events response of a channel
+
+        The stream holds a server thread until the client disconnects,
+        which is noticed by the next write, at most EVENTS_KEEPALIVE_SECONDS
+        later
+        """
+        def generate():
+            # Subscribe once the response is sent, so that a response which
+            # is never iterated doesn't leave its subscription behind
+            subscription = self.subscribe(
+                Subscription(channel, self.queue_size))
+            try:
+                yield RETRY_FRAME
+                while True:
+                    frame = subscription.get(self.keepalive)
+                    yield frame or KEEPALIVE_FRAME
+                    if frame is RESET_FRAME:
+                        return
+            finally:
+                self.unsubscribe(subscription)
+
+        response = Response(generate(), mimetype=SSE_MIMETYPE)
+        response.headers['Cache-Control'] = 'no-cache'
+        # Don't let nginx buffer the stream
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
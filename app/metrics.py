@@ -0,0 +1,222 @@
+import bisect
+import collections
+import threading
+import time
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Mapper
+
+# Content type of the Prometheus text exposition format
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Counters per route and method: (name, help text)
+COUNTERS = (
+    ('readable_sql_statements_total',
+     'SQL statements executed by API requests'),
+    ('readable_sql_duration_seconds_total',
+     'Time spent executing SQL statements of API requests'),
+    ('readable_rows_hydrated_total',
+     'ORM objects loaded from rows by API requests'),
+    ('readable_response_bytes_total',
+     'Bytes of the bodies of API responses'),
+    ('readable_n_plus_one_requests_total',
+     'API requests which executed more than METRICS_MAX_STATEMENTS '
+     'SQL statements'),
+)
+
+
+class Histogram(object):
+    """ Counts of observed values per bucket, with their sum """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        # A value equal to an upper bound belongs to that bucket
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class RequestMetrics(object):
+    """ What a single request has done so far """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = collections.Counter()
+        self.sql_time = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+
+def label_value(value):
+    """ Escape a label value of the Prometheus text format """
+    return value.replace('\\', '\\\\').replace('"', '\\"')\
+        .replace('\n', '\\n')
+
+
+class Metrics(object):
+    """ Opt-in instrumentation of the requests of a blueprint
+
+    When METRICS_ENABLED is set, every request records its latency in a
+    histogram per route and method, and counts the SQL statements it
+    executes and their time, through SQLAlchemy engine events, the ORM
+    objects it loads and the bytes of its response. The totals are served
+    at /metrics in the Prometheus text format, and every response carries
+    a Server-Timing header with the time spent in SQL and in total.
+
+    A request which executes more than METRICS_MAX_STATEMENTS statements is
+    logged with its most repeated statement, which usually is a query per
+    item of a list (N+1).
+
+    Metrics are kept in each server process, so every worker of serve.py
+    serves its own totals.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._counters = collections.defaultdict(int)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['METRICS_ENABLED']
+        self.buckets = sorted(app.config['METRICS_LATENCY_BUCKETS'])
+        self.max_statements = app.config['METRICS_MAX_STATEMENTS']
+        self.logger = app.logger
+        if self.enabled:
+            event.listen(Engine, 'before_cursor_execute',
+                         self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+            event.listen(Mapper, 'load', self._on_load)
+            app.add_url_rule('/metrics', 'metrics', self.render)
+
+    def instrument(self, blueprint):
+        """ Record the requests of a blueprint """
+        blueprint.before_request(self._start)
+        blueprint.after_request(self._finish)
+        blueprint.teardown_request(self._record)
+
+    def _current(self):
+        """ Return the RequestMetrics of the current request, or None """
+        if self.enabled and has_request_context():
+            return g.get('metrics')
+        return None
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        if self._current() is not None:
+            conn.info.setdefault('metrics_started', []).append(
+                time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        current = self._current()
+        if current is not None and conn.info.get('metrics_started'):
+            started = conn.info['metrics_started'].pop()
+            current.sql_time += time.perf_counter() - started
+            current.statements[statement] += 1
+
+    def _on_load(self, target, context):
+        current = self._current()
+        if current is not None:
+            current.rows += 1
+
+    def _start(self):
+        if self.enabled:
+            g.metrics = RequestMetrics()
+
+    def _finish(self, response):
+        """ Add the Server-Timing header, and count the response bytes """
+        current = self._current()
+        if current is None:
+            return response
+
+        elapsed = time.perf_counter() - current.started
+        response.headers['Server-Timing'] = \
+            'sql;dur={:.3f};desc="{} statements", total;dur={:.3f}'.format(
+                current.sql_time * 1000, sum(current.statements.values()),
+                elapsed * 1000)
+        # Let pages of other origins read Server-Timing, like CORS
+        response.headers['Timing-Allow-Origin'] = '*'
+
+        if response.is_streamed:
+            response.response = self._count_bytes(current, response.response)
+        else:
+            current.bytes = response.calculate_content_length() or 0
+        return response
+
+    @staticmethod
+    def _count_bytes(current, chunks):
+        """ Count the bytes of a streamed response as they are sent """
+        for chunk in chunks:
+            current.bytes += len(chunk.encode('utf-8')
+                                 if isinstance(chunk, str) else chunk)
+            yield chunk
+
+    def _record(self, exception):
+        """ Add the metrics of a finished request to the totals
+
+        Called after the last chunk of a streamed response
+        """
+        current = self._current()
+        if current is None or request.url_rule is None:
+            return
+        elapsed = time.perf_counter() - current.started
+        key = (request.url_rule.rule, request.method)
+        statements = sum(current.statements.values())
+
+        with self._lock:
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram(self.buckets)
+            histogram.observe(elapsed)
+            for name, value in zip([name for name, help in COUNTERS], (
+                    statements, current.sql_time, current.rows,
+                    current.bytes, statements > self.max_statements)):
+                self._counters[(name,) + key] += value
+
+        if statements > self.max_statements:
+            statement, count = current.statements.most_common(1)[0]
+            self.logger.warning(
+                'Possible N+1 queries: %s %s executed %d SQL statements, '
+                '%d times: %s', request.method, request.path, statements,
+                count, statement)
+
+    def render(self):
+        """ GET     /metrics
+                - Return the metrics in the Prometheus text format
+        """
+        name = 'readable_request_duration_seconds'
+        lines = ['# HELP {} Latency of API requests'.format(name),
+                 '# TYPE {} histogram'.format(name)]
+        bounds = ['{!r}'.format(float(bound)) for bound in self.buckets]
+        with self._lock:
+            for (route, method), histogram in sorted(self._latency.items()):
+                labels = 'route="{}",method="{}"'.format(label_value(route),
+                                                         method)
+                cumulative = 0
+                for bound, count in zip(bounds + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                        name, labels, bound, cumulative))
+                lines.append('{}_sum{{{}}} {!r}'.format(name, labels,
+                                                        histogram.sum))
+                lines.append('{}_count{{{}}} {}'.format(name, labels,
+                                                        cumulative))
+
+            for name, help in COUNTERS:
+                lines += ['# HELP {} {}'.format(name, help),
+                          '# TYPE {} counter'.format(name)]
+                for (counter, route, method), value in \
+                        sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(
+                            '{}{{route="{}",method="{}"}} {!r}'.format(
+                                name, label_value(route), method,
+                                value))
+        return Response('\n'.join(lines) + '\n', mimetype=PROMETHEUS_MIMETYPE)
@@ -1,17 +1,79 @@
+import math
+from sqlalchemy import and_, event, func, select, text
+
 from . import db
 
+# hot_score of a post is the order of magnitude of its vote score plus its
+# age in units of HOT_SCORE_DECAY_MS since HOT_SCORE_EPOCH_MS. A post needs
+# 10 times the votes of a post 12.5 hours newer to rank as high
+HOT_SCORE_EPOCH_MS = 1467158400000
+HOT_SCORE_DECAY_MS = 45000000
+
+
+def to_milliseconds(timestamp):
+    """ Convert Python datetime.datetime() object to JavaScript Date.now()
+        object (time in milliseconds)
+    """
+    return int(timestamp.timestamp() * 1000)
+
+
+def default_timestamp_ms(context):
+    """ Column default of timestamp_ms: the timestamp of the same row """
+    return to_milliseconds(context.current_parameters['timestamp'])
+
+
+@db.sql_function('hot_score', 2)
+def hot_score(vote_score, timestamp_ms):
+    """ Return the hot score of a post with a vote score and a timestamp in
+        milliseconds. Newer posts rank higher unless older ones have many
+        more votes, and the score of a post never changes unless it is
+        voted on, so it can be stored and indexed
+    """
+    vote_score = vote_score or 0
+    order = math.log10(max(abs(vote_score), 1))
+    sign = (vote_score > 0) - (vote_score < 0)
+    return sign * order + \
+        (timestamp_ms - HOT_SCORE_EPOCH_MS) / HOT_SCORE_DECAY_MS
+
+
+def default_hot_score(context):
+    """ Column default of hot_score: the hot score of the same row """
+    parameters = context.current_parameters
+    return hot_score(parameters.get('vote_score'),
+                     to_milliseconds(parameters['timestamp']))
+
+
+def vote_values(table, delta):
+    """ Return the values of an UPDATE of a post or a comment table which
+        adds delta to the vote score, and updates the hot score of posts
+    """
+    vote_score = table.c.vote_score + delta
+    values = {'vote_score': vote_score}
+    if 'hot_score' in table.c:
+        values['hot_score'] = func.hot_score(vote_score,
+                                             table.c.timestamp_ms)
+    return values
+
 
 class Category(db.Model):
     """ A class which represents Category of Posts
 
     Attributes:
+        latest_post_ms: int. timestamp in milliseconds of the newest post of
+            the category which isn't deleted, or None
         name: string. Name of Category
         path: string. Path in URL. Primary key
+        post_count: int. Number of posts of the category which aren't
+            deleted
+        vote_total: int. Sum of the vote scores of those posts
     """
     __tablename__ = 'category'
 
+    latest_post_ms = db.Column(db.BigInteger)
     name = db.Column(db.String(32), nullable=False)
     path = db.Column(db.String(32), primary_key=True)
+    post_count = db.Column(db.Integer, nullable=False, server_default='0')
+    vote_total = db.Column(db.Integer, nullable=False, server_default='0')
 
     def __repr__(self):
         """ Define string representations of the object """
@@ -21,8 +83,11 @@ class Category(db.Model):
     def serialize(self):
         """ Return object data in easily serializeable format"""
         return {
+            'latestPostTimestamp': self.latest_post_ms,
             'name': self.name,
-            'path': self.path
+            'path': self.path,
+            'postCount': self.post_count,
+            'voteTotal': self.vote_total
         }
 
 
@@ -35,12 +100,35 @@ class Post(db.Model):
         category_path: string. Category path of the post. Foreign Key
         comment_count: int. Number of comments for the post
         deleted: bool. Flag variable if the post is deleted
+        deleted_ms: int. time in milliseconds at which the post was flagged
+            as deleted, or None
+        hot_score: float. hot_score() of vote_score and timestamp, updated
+            by every vote
         id: string. UUID(v4). Primary key
         timestamp: datetime.datetime(). timestamp of the post created
+        timestamp_ms: int. timestamp in milliseconds, stored so that lists
+            can be serialized without converting datetimes
         title: string. Title of the post
         vote_score: int. Vote score of the post
     """
     __tablename__ = 'post'
+    __table_args__ = (
+        # GET /posts: non-deleted posts in (timestamp, id) order
+        db.Index('ix_post_deleted_timestamp', 'deleted', 'timestamp', 'id'),
+        # GET /:category/posts: non-deleted posts of a category in order
+        db.Index('ix_post_category_deleted_timestamp',
+                 'category_path', 'deleted', 'timestamp', 'id'),
+        # ?sort=voteScore and ?sort=hot, read backwards for the top posts
+        db.Index('ix_post_deleted_vote_score', 'deleted', 'vote_score', 'id'),
+        db.Index('ix_post_category_deleted_vote_score',
+                 'category_path', 'deleted', 'vote_score', 'id'),
+        db.Index('ix_post_deleted_hot_score', 'deleted', 'hot_score', 'id'),
+        db.Index('ix_post_category_deleted_hot_score',
+                 'category_path', 'deleted', 'hot_score', 'id'),
+        # Archiver: deleted posts by the time they were deleted
+        db.Index('ix_post_deleted_ms', 'deleted_ms',
+                 sqlite_where=text('deleted_ms IS NOT NULL')),
+    )
 
     author = db.Column(db.String(), nullable=False)
     body = db.Column(db.String(), nullable=False)
@@ -48,8 +136,11 @@ class Post(db.Model):
     category = db.relationship(Category)
     comment_count = db.Column(db.Integer)
     deleted = db.Column(db.Boolean, nullable=False)
+    deleted_ms = db.Column(db.BigInteger)
+    hot_score = db.Column(db.Float, default=default_hot_score)
     id = db.Column(db.String(36), primary_key=True)
     timestamp = db.Column(db.DateTime, nullable=False)
+    timestamp_ms = db.Column(db.BigInteger, default=default_timestamp_ms)
     title = db.Column(db.String(), nullable=False)
     vote_score = db.Column(db.Integer)
 
@@ -60,8 +151,7 @@ class Post(db.Model):
     @property
     def serialize(self):
         """ Return object data in easily serializeable format
-                - timestamp: convert Python datetime.datetime() object to
-                    JavaScript Date.now() object (time in milliseconds)
+                - timestamp: time in milliseconds, like JavaScript Date.now()
         """
         return {
             'author': self.author,
@@ -70,7 +160,9 @@ class Post(db.Model):
             'commentCount': self.comment_count,
             'deleted': self.deleted,
             'id': self.id,
-            'timestamp': int(self.timestamp.timestamp() * 1000),
+            'timestamp': self.timestamp_ms
+            if self.timestamp_ms is not None
+            else to_milliseconds(self.timestamp),
             'title': self.title,
             'voteScore': self.vote_score
         }
@@ -83,22 +175,36 @@ class Comment(db.Model):
         author: string. Author name of the comment
         body: string. Body of the comment
         deleted: bool. Flag variable if the comment is deleted
+        deleted_ms: int. time in milliseconds at which the comment was
+            flagged as deleted, or None
         id: string. UUID(v4). Primary key
         parent_deleted: bool. Flag variable if the parent post is deleted
         parent_id: string. UUID(v4). ID of a Post. Foreign Key
         timestamp: datetime.datetime(). timestamp of the comment created
+        timestamp_ms: int. timestamp in milliseconds, stored so that lists
+            can be serialized without converting datetimes
         vote_score: int. Vote score of the comment
     """
     __tablename__ = 'comment'
+    __table_args__ = (
+        # GET /posts/:id/comments: live comments of a post in order
+        db.Index('ix_comment_parent_deleted_timestamp', 'parent_id',
+                 'deleted', 'parent_deleted', 'timestamp', 'id'),
+        # Archiver: deleted comments by the time they were deleted
+        db.Index('ix_comment_deleted_ms', 'deleted_ms',
+                 sqlite_where=text('deleted_ms IS NOT NULL')),
+    )
 
     author = db.Column(db.String(), nullable=False)
     body = db.Column(db.String(), nullable=False)
     deleted = db.Column(db.Boolean, nullable=False)
+    deleted_ms = db.Column(db.BigInteger)
     id = db.Column(db.String(36), primary_key=True)
     parent_deleted = db.Column(db.Boolean, nullable=False)
     parent_id = db.Column(db.String(36), db.ForeignKey('post.id'))
     post = db.relationship(Post)
     timestamp = db.Column(db.DateTime, nullable=False)
+    timestamp_ms = db.Column(db.BigInteger, default=default_timestamp_ms)
     vote_score = db.Column(db.Integer)
 
     def __repr__(self):
@@ -108,8 +214,7 @@ class Comment(db.Model):
     @property
     def serialize(self):
         """ Return object data in easily serializeable format
-                - timestamp: convert Python datetime.datetime() object to
-                    JavaScript Date.now() object (time in milliseconds)
+                - timestamp: time in milliseconds, like JavaScript Date.now()
         """
         return {
             'author': self.author,
@@ -118,6 +223,203 @@ class Comment(db.Model):
             'id': self.id,
             'parentDeleted': self.parent_deleted,
             'parentId': self.parent_id,
-            'timestamp': int(self.timestamp.timestamp() * 1000),
+            'timestamp': self.timestamp_ms
+            if self.timestamp_ms is not None
+            else to_milliseconds(self.timestamp),
             'voteScore': self.vote_score
         }
+
+
+# Triggers which keep post.comment_count equal to the number of comments of
+# the post which aren't deleted, so that write paths only insert comments or
+# flag them as deleted. reconcile_db.py repairs counts which have drifted
+COMMENT_COUNT_TRIGGERS = [
+    db.DDL('CREATE TRIGGER IF NOT EXISTS comment_count_insert '
+           'AFTER INSERT ON comment WHEN NEW.deleted = 0 BEGIN '
+           'UPDATE post SET comment_count = comment_count + 1 '
+           'WHERE id = NEW.parent_id; END'),
+    db.DDL('CREATE TRIGGER IF NOT EXISTS comment_count_flag '
+           'AFTER UPDATE OF deleted ON comment '
+           'WHEN OLD.deleted = 0 AND NEW.deleted = 1 BEGIN '
+           'UPDATE post SET comment_count = comment_count - 1 '
+           'WHERE id = NEW.parent_id; END'),
+    db.DDL('CREATE TRIGGER IF NOT EXISTS comment_count_unflag '
+           'AFTER UPDATE OF deleted ON comment '
+           'WHEN OLD.deleted = 1 AND NEW.deleted = 0 BEGIN '
+           'UPDATE post SET comment_count = comment_count + 1 '
+           'WHERE id = NEW.parent_id; END'),
+    db.DDL('CREATE TRIGGER IF NOT EXISTS comment_count_delete '
+           'AFTER DELETE ON comment WHEN OLD.deleted = 0 BEGIN '
+           'UPDATE post SET comment_count = comment_count - 1 '
+           'WHERE id = OLD.parent_id; END'),
+]
+for trigger in COMMENT_COUNT_TRIGGERS:
+    event.listen(Comment.__table__, 'after_create',
+                 trigger.execute_if(dialect='sqlite'))
+
+
+# Triggers which keep the aggregates of category equal to those of the posts
+# of the category which aren't deleted, so that GET /categories never scans
+# post. A vote only adds its delta. Flagging or deleting the newest post
+# looks up the next newest one through ix_post_category_deleted_timestamp.
+# reconcile_db.py repairs aggregates which have drifted
+LATEST_POST_MS = ('(SELECT timestamp_ms FROM post '
+                  'WHERE category_path = {0}.category_path AND deleted = 0 '
+                  'ORDER BY timestamp DESC LIMIT 1)')
+CATEGORY_STATS_TRIGGERS = [
+    db.DDL('CREATE TRIGGER IF NOT EXISTS category_stats_insert '
+           'AFTER INSERT ON post WHEN NEW.deleted = 0 BEGIN '
+           'UPDATE category SET post_count = post_count + 1, '
+           'vote_total = vote_total + ifnull(NEW.vote_score, 0), '
+           'latest_post_ms = max(ifnull(latest_post_ms, NEW.timestamp_ms), '
+           'NEW.timestamp_ms) '
+           'WHERE path = NEW.category_path; END'),
+    db.DDL('CREATE TRIGGER IF NOT EXISTS category_stats_vote '
+           'AFTER UPDATE OF vote_score ON post '
+           'WHEN OLD.deleted = 0 AND NEW.deleted = 0 BEGIN '
+           'UPDATE category SET vote_total = vote_total + '
+           'ifnull(NEW.vote_score, 0) - ifnull(OLD.vote_score, 0) '
+           'WHERE path = NEW.category_path; END'),
+    db.DDL('CREATE TRIGGER IF NOT EXISTS category_stats_flag '
+           'AFTER UPDATE OF deleted ON post '
+           'WHEN OLD.deleted = 0 AND NEW.deleted = 1 BEGIN '
+           'UPDATE category SET post_count = post_count - 1, '
+           'vote_total = vote_total - ifnull(OLD.vote_score, 0), '
+           'latest_post_ms = ' + LATEST_POST_MS.format('OLD') + ' '
+           'WHERE path = OLD.category_path; END'),
+    db.DDL('CREATE TRIGGER IF NOT EXISTS category_stats_unflag '
+           'AFTER UPDATE OF deleted ON post '
+           'WHEN OLD.deleted = 1 AND NEW.deleted = 0 BEGIN '
+           'UPDATE category SET post_count = post_count + 1, '
+           'vote_total = vote_total + ifnull(NEW.vote_score, 0), '
+           'latest_post_ms = max(ifnull(latest_post_ms, NEW.timestamp_ms), '
+           'NEW.timestamp_ms) '
+           'WHERE path = NEW.category_path; END'),
+    db.DDL('CREATE TRIGGER IF NOT EXISTS category_stats_delete '
+           'AFTER DELETE ON post WHEN OLD.deleted = 0 BEGIN '
+           'UPDATE category SET post_count = post_count - 1, '
+           'vote_total = vote_total - ifnull(OLD.vote_score, 0), '
+           'latest_post_ms = ' + LATEST_POST_MS.format('OLD') + ' '
+           'WHERE path = OLD.category_path; END'),
+]
+for trigger in CATEGORY_STATS_TRIGGERS:
+    event.listen(Post.__table__, 'after_create',
+                 trigger.execute_if(dialect='sqlite'))
+
+
+# Triggers which stamp posts and comments with the time at which they are
+# flagged as deleted, so that the archiver moves them out of the live tables
+# once ARCHIVE_AFTER_DAYS have passed, whichever write path deleted them
+NOW_MS = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+DELETED_MS_TRIGGERS = [
+    db.DDL('CREATE TRIGGER IF NOT EXISTS {0}_deleted_ms '
+           'AFTER UPDATE OF deleted ON {0} '
+           'WHEN OLD.deleted = 0 AND NEW.deleted = 1 BEGIN '
+           'UPDATE {0} SET deleted_ms = {1} WHERE rowid = NEW.rowid; END'
+           .format(table, NOW_MS))
+    for table in ('post', 'comment')
+]
+event.listen(Post.__table__, 'after_create',
+             DELETED_MS_TRIGGERS[0].execute_if(dialect='sqlite'))
+event.listen(Comment.__table__, 'after_create',
+             DELETED_MS_TRIGGERS[1].execute_if(dialect='sqlite'))
+
+
+def category_stats():
+    """ Return the values of an UPDATE of the category table which
+        recount the aggregates of every category from its posts
+    """
+    category, post = Category.__table__, Post.__table__
+    live = and_(post.c.category_path == category.c.path,
+                post.c.deleted.is_(False))
+    return {
+        'latest_post_ms': select([func.max(post.c.timestamp_ms)])
+        .where(live).as_scalar(),
+        'post_count': select([func.count()]).where(live).as_scalar(),
+        'vote_total': select([func.coalesce(func.sum(post.c.vote_score), 0)])
+        .where(live).as_scalar(),
+    }
+
+
+class VoteJournalCheckpoint(db.Model):
+    """  A class which represents how far a vote journal has been flushed
+
+    Attributes:
+        journal: string. Path of the vote journal. Primary key
+        seq: int. Sequence number of the last vote applied to the database
+    """
+    __tablename__ = 'vote_journal_checkpoint'
+
+    journal = db.Column(db.String(), primary_key=True)
+    seq = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        """ Define string representations of the object """
+        return "VoteJournalCheckpoint(journal='{}', seq={})".format(self.journal, self.seq)  # noqa
+
+
+class ResourceVersion(db.Model):
+    """  A class which represents the version of an API resource. It is
+         incremented by every write which changes the resource, and used to
+         build ETags
+
+    Attributes:
+        key: string. Name of the resource, e.g. 'post:<id>'. Primary key
+        version: int. Number of changes to the resource
+    """
+    __tablename__ = 'resource_version'
+
+    key = db.Column(db.String(), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        """ Define string representations of the object """
+        return "ResourceVersion(key='{}', version={})".format(self.key, self.version)  # noqa
+
+
+class Change(db.Model):
+    """  A class which represents a change of a post or a comment in the
+         change log, which clients read with GET /changes to sync
+         incrementally, see app/changes.py
+
+    Attributes:
+        kind: string. 'post' or 'comment', the table of the changed object
+        object_id: string. ID of the changed post or comment
+        seq: int. Sequence number of the change. Primary key. Never reused,
+            so it only increases
+    """
+    __tablename__ = 'change'
+    __table_args__ = (
+        # Compaction: the latest change of each object
+        db.Index('ix_change_kind_object_id_seq', 'kind', 'object_id', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+
+    kind = db.Column(db.String(16), nullable=False)
+    object_id = db.Column(db.String(36), nullable=False)
+    seq = db.Column(db.Integer, primary_key=True)
+
+    def __repr__(self):
+        """ Define string representations of the object """
+        return "Change(seq={}, kind='{}', object_id='{}')".format(self.seq, self.kind, self.object_id)  # noqa
+
+
+def archive_table(model):
+    """ Return a table which holds the rows of a model moved out of its
+        table by the archiver, see app/archive.py
+
+    It has the columns of the model without their constraints and defaults,
+    and archived_ms: the time in milliseconds at which a row was archived
+    """
+    name = model.__tablename__ + '_archive'
+    columns = [db.Column(column.name, column.type,
+                         primary_key=column.primary_key)
+               for column in model.__table__.columns]
+    return db.Table(name, db.metadata, *columns,
+                    db.Column('archived_ms', db.BigInteger, nullable=False),
+                    # Purge: archived rows by the time they were archived
+                    db.Index('ix_{}_archived_ms'.format(name), 'archived_ms'))
+
+
+POST_ARCHIVE = archive_table(Post)
+COMMENT_ARCHIVE = archive_table(Comment)
@@ -0,0 +1,166 @@
+import base64
+import collections
+import datetime
+import json
+from flask import current_app
+from sqlalchemy import or_
+
+# Cursors carry the timestamp as whole microseconds since this epoch, so that
+# they round-trip the stored datetime.datetime() values exactly
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# The order of a list endpoint: a sort column, followed by the id column to
+# break ties, ascending or descending, and the decoder of its cursors
+SortOrder = collections.namedtuple('SortOrder',
+                                   ['column', 'descending', 'decode'])
+
+
+class InvalidPageArgument(ValueError):
+    """ Raised when 'limit', 'cursor', 'sort' or 'include' query parameters
+        can't be parsed
+    """
+
+
+def encode_token(values):
+    """ Encode a list of JSON values into an opaque token """
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_token(token):
+    """ Decode an opaque token back into a list of JSON values """
+    padding = '=' * (-len(token) % 4)
+    raw = base64.urlsafe_b64decode((token + padding).encode('ascii'))
+    return json.loads(raw.decode('utf-8'))
+
+
+def encode_cursor(value, id):
+    """ Encode the sort key (value, id) of a row into an opaque token
+
+    A timestamp is encoded as microseconds since EPOCH, scores as they are
+    """
+    if isinstance(value, datetime.datetime):
+        value = (value - EPOCH) // datetime.timedelta(microseconds=1)
+    return encode_token([value, id])
+
+
+def decode_cursor(cursor):
+    """ Decode an opaque token back into the sort key (timestamp, id) """
+    try:
+        micros, id = decode_token(cursor)
+        return EPOCH + datetime.timedelta(microseconds=int(micros)), str(id)
+    except Exception:
+        raise InvalidPageArgument('Invalid Cursor')
+
+
+def decode_score_cursor(cursor):
+    """ Decode an opaque token back into the sort key (score, id) """
+    try:
+        score, id = decode_token(cursor)
+        if isinstance(score, bool) or not isinstance(score, (int, float)):
+            raise ValueError(score)
+        return score, str(id)
+    except Exception:
+        raise InvalidPageArgument('Invalid Cursor')
+
+
+def parse_page_args(args, config=None, decode=decode_cursor):
+    """ Parse 'limit' and 'cursor' query parameters of a list endpoint
+
+    Returns None when neither is given, so that the endpoint keeps returning
+    the whole list. Otherwise returns a tuple (limit, after) where 'after' is
+    the sort key of the last row of the previous page decoded by decode, or
+    None. config defaults to the config of the current Flask app.
+    """
+    if 'limit' not in args and 'cursor' not in args:
+        return None
+
+    if config is None:
+        config = current_app.config
+    cursor = args.get('cursor')
+    return parse_limit(args, config), decode(cursor) if cursor else None
+
+
+def parse_limit(args, config):
+    """ Parse the 'limit' query parameter, DEFAULT_PAGE_SIZE by default """
+    max_size = config['MAX_PAGE_SIZE']
+    try:
+        limit = int(args.get('limit', config['DEFAULT_PAGE_SIZE']))
+    except ValueError:
+        raise InvalidPageArgument("'limit' parameter must be an integer")
+    if limit < 1 or limit > max_size:
+        raise InvalidPageArgument(
+            "'limit' parameter must be between 1 and {}".format(max_size))
+    return limit
+
+
+def parse_include(args, config=None):
+    """ Parse 'include' and 'comment_limit' query parameters of post
+        endpoints
+
+    Returns the number of comments to embed in each post, or None when
+    comments aren't included. config defaults to the config of the current
+    Flask app.
+    """
+    include = args.get('include')
+    if include is None:
+        return None
+    if include != 'comments':
+        raise InvalidPageArgument("'include' parameter must be 'comments'")
+
+    if config is None:
+        config = current_app.config
+    max_limit = config['MAX_COMMENT_LIMIT']
+    try:
+        limit = int(args.get('comment_limit',
+                             config['DEFAULT_COMMENT_LIMIT']))
+    except ValueError:
+        raise InvalidPageArgument(
+            "'comment_limit' parameter must be an integer")
+    if limit < 0 or limit > max_limit:
+        raise InvalidPageArgument(
+            "'comment_limit' parameter must be between 0 and {}".format(
+                max_limit))
+    return limit
+
+
+def parse_sort(args, sorts, default):
+    """ Return the SortOrder of the 'sort' query parameter of a list
+        endpoint, out of a dict of names to SortOrder
+    """
+    name = args.get('sort', default)
+    if name not in sorts:
+        raise InvalidPageArgument("'sort' parameter must be one of {}".format(
+            ', '.join(sorted(sorts))))
+    return sorts[name]
+
+
+def keyset_query(query, page, sort_column, id_column, descending=False):
+    """ Order a query by (sort_column, id) and restrict it to the given page
+
+    A page starts right after the sort key in the cursor, so that fetching a
+    page costs an index seek plus 'limit' rows no matter how deep the client
+    goes. One extra row is fetched to find out whether there is a next page.
+
+    The seek condition is written as 'value >= ? AND (value > ? OR id > ?)'
+    rather than an OR of two ranges, so that SQLite can start an index range
+    scan right at the cursor. In descending order, the same index is read
+    backwards.
+    """
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column, id_column)
+    if page is None:
+        return query
+
+    limit, after = page
+    if after is not None:
+        value, id = after
+        if descending:
+            query = query.filter(sort_column <= value)\
+                .filter(or_(sort_column < value, id_column < id))
+        else:
+            query = query.filter(sort_column >= value)\
+                .filter(or_(sort_column > value, id_column > id))
+    return query.limit(limit + 1)
@@ -0,0 +1,253 @@
+import collections
+import functools
+import math
+import threading
+import time
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.utils import import_string
+
+from . import encoder
+
+# Statements which take the write lock of SQLite
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Weight of a new lock wait in the moving average, and the seconds after
+# which an average is halved when no writes are measured, so that shedding
+# stops once writers stop waiting
+LOCK_WAIT_WEIGHT = 0.2
+LOCK_WAIT_HALF_LIFE = 1.0
+
+# Token bucket of RedisStore: KEYS[1] is the bucket, ARGV are rate, burst
+# and the current time. Returns the seconds to wait, as a string, since Lua
+# numbers are truncated to integers
+TAKE_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]),
+    tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated', ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+def take_token(tokens, updated, now, rate, burst):
+    """ Refill a token bucket which held tokens at updated, and take a token
+
+    Returns a tuple (tokens left, seconds to wait), where the wait is 0 when
+    a token was taken
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryStore(object):
+    """ Token buckets of one server process
+
+    Buckets of the least recently seen clients are dropped beyond
+    RATE_LIMIT_MAX_CLIENTS, which gives those clients a full bucket again
+    """
+
+    def __init__(self, app):
+        self.maxsize = app.config['RATE_LIMIT_MAX_CLIENTS']
+        self._lock = threading.Lock()
+        self._buckets = collections.OrderedDict()
+
+    def take(self, key, rate, burst, now):
+        """ Take a token from the bucket of key, which holds up to burst
+            tokens and gains rate tokens per second. Returns the seconds to
+            wait for a token, or 0 when a token was taken
+        """
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens, wait = take_token(tokens, updated, now, rate, burst)
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class RedisStore(object):
+    """ Token buckets shared by all server processes, stored in Redis
+
+    Requires the 'redis' package and RATE_LIMIT_REDIS_URL. A bucket is
+    updated atomically by a Lua script, and expires once it would be full.
+    """
+
+    def __init__(self, app):
+        import redis
+        self.redis = redis.StrictRedis.from_url(
+            app.config['RATE_LIMIT_REDIS_URL'])
+        self.script = self.redis.register_script(TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, now):
+        return float(self.script(keys=['ratelimit:' + key],
+                                 args=[rate, burst, repr(now)]))
+
+
+def retry_later(message, wait, status=429):
+    """ Return an error response which asks the client to retry after wait
+        seconds
+    """
+    response = encoder.jsonify({'error': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, int(math.ceil(wait))))
+    return response
+
+
+class RateLimiter(object):
+    """ Token buckets of write endpoints per client
+
+    When RATE_LIMIT_ENABLED is set, every client may send a burst of
+    requests to a limited endpoint, and then a steady rate, as configured
+    in RATE_LIMITS by name. Further requests get 429 Too Many Requests with
+    a Retry-After header. Clients are told apart by remote address, or by
+    the first address of X-Forwarded-For with RATE_LIMIT_TRUST_FORWARDED,
+    behind a proxy which sets it.
+
+    The store is RATE_LIMIT_STORE, an import path of a class which is
+    created with the app, like MemoryStore, whose buckets are private to a
+    process, or RedisStore, whose buckets are shared by all processes.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['RATE_LIMIT_ENABLED']
+        self.limits = app.config['RATE_LIMITS']
+        self.trust_forwarded = app.config['RATE_LIMIT_TRUST_FORWARDED']
+        if self.enabled:
+            store = import_string(app.config['RATE_LIMIT_STORE'])
+            self.store = store(app)
+
+    def client(self):
+        """ Return the identity of the client of the current request """
+        if self.trust_forwarded and request.access_route:
+            return request.access_route[0]
+        return request.remote_addr or ''
+
+    def limited(self, name):
+        """ Decorator which limits the requests of every client to a view
+            by the token bucket of RATE_LIMITS[name]
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.enabled:
+                    rate, burst = self.limits[name]
+                    wait = self.store.take(
+                        '{}:{}'.format(name, self.client()), rate, burst,
+                        time.time())
+                    if wait > 0:
+                        return retry_later('Too Many Requests', wait)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+class AdmissionControl(object):
+    """ Shed writes while writers wait too long for the SQLite write lock
+
+    SQLite has a single writer: a transaction takes the write lock with its
+    first write statement, which waits up to busy_timeout while another
+    transaction holds it. The time of that statement is averaged over recent
+    transactions, through SQLAlchemy engine events. While the average
+    exceeds ADMISSION_MAX_LOCK_WAIT_MS, write requests of a registered
+    blueprint get 503 Service Unavailable with a Retry-After header before
+    they touch the database, so that the queue of writers drains and reads,
+    which don't take the lock, stay fast.
+
+    The average is kept in each server process, which all wait for the same
+    lock.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._wait = 0.0
+        self._updated = time.monotonic()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_wait = app.config['ADMISSION_MAX_LOCK_WAIT_MS'] / 1000.0
+        self.enabled = self.max_wait > 0
+        if self.enabled:
+            event.listen(Engine, 'before_cursor_execute',
+                         self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+            event.listen(Engine, 'handle_error', self._on_error)
+            event.listen(Engine, 'commit', self._end_transaction)
+            event.listen(Engine, 'rollback', self._end_transaction)
+
+    def register(self, blueprint):
+        """ Shed the write requests of a blueprint under contention """
+        blueprint.before_request(self._admit)
+
+    def lock_wait(self):
+        """ Return the average recent wait for the write lock in seconds """
+        with self._lock:
+            return self._decayed(time.monotonic())
+
+    def observe(self, seconds):
+        """ Add the lock wait of a transaction to the average """
+        with self._lock:
+            now = time.monotonic()
+            self._wait = self._decayed(now) * (1 - LOCK_WAIT_WEIGHT) + \
+                seconds * LOCK_WAIT_WEIGHT
+            self._updated = now
+
+    def _decayed(self, now):
+        return self._wait * 0.5 ** ((now - self._updated) /
+                                    LOCK_WAIT_HALF_LIFE)
+
+    def _admit(self):
+        if not self.enabled or request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return None
+        wait = self.lock_wait()
+        if wait > self.max_wait:
+            # Until the average decays below the threshold
+            return retry_later(
+                'Service Unavailable',
+                LOCK_WAIT_HALF_LIFE * math.log2(wait / self.max_wait),
+                status=503)
+        return None
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        # Only the first write of a transaction waits for the lock
+        if 'admission_locked' not in conn.info and \
+                statement.lstrip().upper().startswith(WRITE_STATEMENTS):
+            conn.info['admission_started'] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        started = conn.info.pop('admission_started', None)
+        if started is not None:
+            conn.info['admission_locked'] = True
+            self.observe(time.perf_counter() - started)
+
+    def _on_error(self, context):
+        # A statement which timed out waiting for the lock
+        if context.connection is not None:
+            started = context.connection.info.pop('admission_started', None)
+            if started is not None:
+                self.observe(time.perf_counter() - started)
+
+    def _end_transaction(self, conn):
+        conn.info.pop('admission_locked', None)
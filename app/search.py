@@ -0,0 +1,167 @@
+from sqlalchemy import DDL, event, select, text
+
+# Import the database object and models
+from . import db
+from .models import Comment, Post
+from .pagination import InvalidPageArgument, decode_token, encode_token
+from .serializers import COMMENT_FIELDS, POST_FIELDS
+from .votes import LIVE_FLAGS
+
+
+class SearchIndex(object):
+    """ An SQLite FTS5 index of text columns of the live rows of a model
+
+    The index reads its content from the table by rowid, so the text isn't
+    stored twice. Triggers add a row to the index when it is inserted live,
+    remove it when it is deleted or flagged, and replace it when its text
+    changes, so that every write path keeps the index in sync.
+
+    A full VACUUM may change rowids, so run 'migrate_db.py --rebuild-search'
+    after it.
+    """
+
+    def __init__(self, name, model, columns):
+        self.name = name
+        self.table = model.__table__
+        self.columns = columns
+        self.flags = LIVE_FLAGS[model]
+
+    def _values(self, row):
+        """ Return the rowid and indexed columns of NEW, OLD or the table """
+        return ', '.join([row + '.rowid'] +
+                         ['{}.{}'.format(row, c) for c in self.columns])
+
+    def _live(self, row):
+        """ Return a condition which is true when the row is live """
+        return ' AND '.join('{}.{} = 0'.format(row, flag)
+                            for flag in self.flags)
+
+    @property
+    def ddl(self):
+        """ Return DDL statements which create the index and its triggers """
+        names = dict(index=self.name, table=self.table.name,
+                     columns=', '.join(self.columns),
+                     watched=', '.join(self.columns + self.flags),
+                     new=self._values('NEW'), old=self._values('OLD'),
+                     new_live=self._live('NEW'), old_live=self._live('OLD'))
+        return [DDL(sql.format(**names)) for sql in (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5("
+            "{columns}, content='{table}', tokenize='porter unicode61')",
+            "CREATE TRIGGER IF NOT EXISTS {index}_insert "
+            "AFTER INSERT ON {table} WHEN {new_live} BEGIN "
+            "INSERT INTO {index}(rowid, {columns}) VALUES ({new}); END",
+            "CREATE TRIGGER IF NOT EXISTS {index}_update "
+            "AFTER UPDATE OF {watched} ON {table} BEGIN "
+            "INSERT INTO {index}({index}, rowid, {columns}) "
+            "SELECT 'delete', {old} WHERE {old_live}; "
+            "INSERT INTO {index}(rowid, {columns}) "
+            "SELECT {new} WHERE {new_live}; END",
+            "CREATE TRIGGER IF NOT EXISTS {index}_delete "
+            "AFTER DELETE ON {table} WHEN {old_live} BEGIN "
+            "INSERT INTO {index}({index}, rowid, {columns}) "
+            "VALUES ('delete', {old}); END",
+        )]
+
+    def rebuild(self, connection):
+        """ Replace the content of the index with the live rows """
+        connection.execute(
+            "INSERT INTO {index}({index}) VALUES ('delete-all')"
+            .format(index=self.name))
+        connection.execute(
+            'INSERT INTO {index}(rowid, {columns}) '
+            'SELECT {values} FROM {table} WHERE {live}'.format(
+                index=self.name, columns=', '.join(self.columns),
+                values=self._values(self.table.name), table=self.table.name,
+                live=self._live(self.table.name)))
+
+
+SEARCH_INDEXES = [
+    SearchIndex('post_search', Post, ('title', 'body')),
+    SearchIndex('comment_search', Comment, ('body',)),
+]
+
+for index in SEARCH_INDEXES:
+    for statement in index.ddl:
+        event.listen(index.table, 'after_create',
+                     statement.execute_if(dialect='sqlite'))
+
+# Posts and comments which match a query, best first. bm25() is lower for
+# better matches, and matches in post titles weigh 10 times more than
+# matches in post bodies
+SEARCH_QUERY = '''
+SELECT kind, id, score FROM (
+    SELECT 'comment' AS kind, comment.id AS id,
+           bm25(comment_search) AS score
+    FROM comment_search JOIN comment ON comment.rowid = comment_search.rowid
+    WHERE comment_search MATCH :query
+      AND comment.deleted = 0 AND comment.parent_deleted = 0
+    UNION ALL
+    SELECT 'post', post.id, bm25(post_search, 10.0, 1.0)
+    FROM post_search JOIN post ON post.rowid = post_search.rowid
+    WHERE post_search MATCH :query AND post.deleted = 0
+)
+WHERE {after}
+ORDER BY score, kind, id
+LIMIT :limit
+'''
+AFTER_CURSOR = '''score > :score
+    OR (score = :score AND (kind > :kind OR (kind = :kind AND id > :id)))'''
+
+
+def match_expression(q):
+    """ Turn the words of a search query into an FTS5 query which matches
+        rows containing all of them
+
+    Every word is quoted, so that FTS5 operators and punctuation in the
+    query are searched for as text instead of being a syntax error
+    """
+    words = ['"{}"'.format(word.replace('"', '""')) for word in q.split()]
+    return ' '.join(words)
+
+
+def decode_search_cursor(cursor):
+    """ Decode an opaque token into the sort key (score, kind, id) """
+    try:
+        score, kind, id = decode_token(cursor)
+        return float(score), str(kind), str(id)
+    except Exception:
+        raise InvalidPageArgument('Invalid Cursor')
+
+
+def search(q, page):
+    """ Return a tuple (list of results, next_cursor) of a page of the
+        posts and comments which match q, best first
+
+    Every result is {'type': 'post', 'post': {...}} or {'type': 'comment',
+    'comment': {...}}. page is a tuple (limit, after) of parse_page_args.
+    """
+    limit, after = page
+    params = {'query': match_expression(q), 'limit': limit + 1}
+    if after is not None:
+        params.update(zip(('score', 'kind', 'id'), after))
+    matches = db.session.execute(
+        text(SEARCH_QUERY.format(after=AFTER_CURSOR if after else '1')),
+        params).fetchall()
+
+    next_cursor = None
+    if len(matches) > limit:
+        matches = matches[:limit]
+        kind, id, score = matches[-1]
+        next_cursor = encode_token([score, kind, id])
+
+    # Serialize the matches with one query per kind
+    found = {}
+    for kind, model, fields in (('post', Post, POST_FIELDS),
+                                ('comment', Comment, COMMENT_FIELDS)):
+        ids = [id for match_kind, id, score in matches if match_kind == kind]
+        if ids:
+            keys = [key for key, column in fields]
+            rows = db.session.execute(
+                select([column for key, column in fields])
+                .where(model.id.in_(ids)))
+            for row in rows:
+                item = dict(zip(keys, row))
+                found[(kind, item['id'])] = item
+    results = [{'type': kind, kind: found[(kind, id)]}
+               for kind, id, score in matches if (kind, id) in found]
+    return results, next_cursor
@@ -0,0 +1,137 @@
+from sqlalchemy import String, select, type_coerce
+
+# Import the database object and models
+from . import db
+from .models import Comment, Post
+from .pagination import SortOrder, decode_cursor, decode_score_cursor, \
+    encode_cursor, keyset_query
+
+# Keys and columns of Post.serialize and Comment.serialize. Lists select only
+# these columns through SQLAlchemy Core, and build dicts straight from the
+# row tuples, without hydrating ORM objects or converting datetimes
+POST_FIELDS = (
+    ('author', Post.author),
+    ('body', Post.body),
+    ('category', Post.category_path),
+    ('commentCount', Post.comment_count),
+    ('deleted', Post.deleted),
+    ('id', Post.id),
+    ('timestamp', Post.timestamp_ms),
+    ('title', Post.title),
+    ('voteScore', Post.vote_score),
+)
+
+COMMENT_FIELDS = (
+    ('author', Comment.author),
+    ('body', Comment.body),
+    ('deleted', Comment.deleted),
+    ('id', Comment.id),
+    ('parentDeleted', Comment.parent_deleted),
+    ('parentId', Comment.parent_id),
+    ('timestamp', Comment.timestamp_ms),
+    ('voteScore', Comment.vote_score),
+)
+
+
+# Orders of GET /posts and GET /:category/posts by the 'sort' query
+# parameter. Top and hot posts come first, and each order has an index
+POST_SORTS = {
+    'timestamp': SortOrder(Post.timestamp, False, decode_cursor),
+    'voteScore': SortOrder(Post.vote_score, True, decode_score_cursor),
+    'hot': SortOrder(Post.hot_score, True, decode_score_cursor),
+}
+
+
+def select_embedded_comments(post_ids, limit):
+    """ Return a SELECT of the first limit live comments of each post, in
+        one statement
+
+    Each post joins the ids of its first comments, found by a correlated
+    subquery with LIMIT, so that every post costs an index seek plus limit
+    rows of ix_comment_parent_deleted_timestamp, however many comments it
+    has. A window function would read all comments of the posts instead.
+    """
+    post, comment = Post.__table__, Comment.__table__
+    first = comment.alias('first_comment')
+    first_ids = select([first.c.id])\
+        .where(first.c.parent_id == post.c.id)\
+        .where(first.c.deleted.is_(False))\
+        .where(first.c.parent_deleted.is_(False))\
+        .order_by(first.c.timestamp, first.c.id)\
+        .limit(limit)\
+        .correlate(post)
+    return select([column for key, column in COMMENT_FIELDS])\
+        .select_from(post.join(comment, comment.c.id.in_(first_ids)))\
+        .where(post.c.id.in_(post_ids))\
+        .order_by(comment.c.parent_id, comment.c.timestamp, comment.c.id)
+
+
+def attach_comments(posts, rows):
+    """ Add the comments of rows of select_embedded_comments to the
+        serialized posts, as 'comments'
+    """
+    keys = [key for key, column in COMMENT_FIELDS]
+    comments = {post['id']: [] for post in posts}
+    for row in rows:
+        comment = dict(zip(keys, row))
+        comments[comment['parentId']].append(comment)
+    for post in posts:
+        post['comments'] = comments[post['id']]
+
+
+def select_statement(query, fields, page, sort_column, id_column,
+                     descending=False):
+    """ Return a Core SELECT of a page of a list query, selecting only the
+        given fields
+
+    The sort key is selected as well, with a timestamp as the raw string
+    stored by SQLite, so that it is only parsed for the last row of a page.
+    """
+    return keyset_query(query, page, sort_column, id_column, descending)\
+        .with_entities(*[column for key, column in fields] +
+                       [type_coerce(sort_column, String)
+                        .label('sort_value'),
+                        id_column.label('sort_id')])\
+        .statement
+
+
+def select_fields(query, fields, page, sort_column, id_column,
+                  descending=False):
+    """ Execute a page of a list query, selecting only the given fields
+
+    Returns a Core result which yields row tuples.
+    """
+    return db.session.execute(select_statement(
+        query, fields, page, sort_column, id_column, descending))
+
+
+def serialize_rows(result, fields, page, sort_column):
+    """ Yield (dict, None) for every row of a page of select_fields, then
+        (None, next_cursor) if there is a next page
+    """
+    keys = [key for key, column in fields]
+    limit = page[0] if page is not None else None
+    last = None
+    for count, row in enumerate(result):
+        if count == limit:
+            dialect = db.engine.dialect
+            parse = sort_column.type.dialect_impl(dialect)\
+                .result_processor(dialect, None)
+            value = parse(last.sort_value) if parse else last.sort_value
+            yield None, encode_cursor(value, last.sort_id)
+            return
+        yield dict(zip(keys, row)), None
+        last = row
+
+
+def serialize_page(query, fields, page, sort_column, id_column,
+                   descending=False):
+    """ Return a tuple (list of dicts, next_cursor) of a page of a query """
+    result = select_fields(query, fields, page, sort_column, id_column,
+                           descending)
+    items, next_cursor = [], None
+    for item, next_cursor in serialize_rows(result, fields, page,
+                                            sort_column):
+        if item is not None:
+            items.append(item)
+    return items, next_cursor
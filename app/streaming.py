@@ -0,0 +1,74 @@
+import json
+from flask import Response, current_app, request, stream_with_context
+
+from .serializers import select_fields, serialize_rows
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def streaming_format():
+    """ Return the streaming format requested by the client
+
+    'ndjson' when the client prefers application/x-ndjson in Accept,
+    'json' when the query parameter 'stream' is set, or None
+    """
+    if request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        return 'ndjson'
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return 'json'
+    return None
+
+
+def fetch_in_batches(result, size):
+    """ Yield the rows of a Core result, fetching size rows at a time """
+    while True:
+        rows = result.fetchmany(size)
+        if not rows:
+            return
+        for row in rows:
+            yield row
+
+
+def stream_list(query, fields, page, sort_column, id_column, key, format,
+                descending=False):
+    """ Return a streamed response of a list endpoint
+
+    Rows are fetched in batches of STREAM_BATCH_SIZE, and every row is
+    encoded as soon as it is fetched. So memory use doesn't grow with the
+    size of the list, and the first bytes are sent before the query is done.
+
+    'json' streams the same document as the buffered endpoint, e.g.
+    {"posts":[...],"next":null}. 'ndjson' streams one object per line,
+    followed by a line {"next":"<cursor>"} if there is a next page.
+    """
+    result = select_fields(query, fields, page, sort_column, id_column,
+                           descending)
+    rows = serialize_rows(
+        fetch_in_batches(result, current_app.config['STREAM_BATCH_SIZE']),
+        fields, page, sort_column)
+
+    def generate_json():
+        yield '{{"{}":['.format(key)
+        next_cursor = None
+        separator = ''
+        for item, next_cursor in rows:
+            if item is not None:
+                yield separator + json.dumps(item, separators=(',', ':'),
+                                             sort_keys=True)
+                separator = ','
+        yield '],"next":{}}}\n'.format(json.dumps(next_cursor))
+
+    def generate_ndjson():
+        for item, next_cursor in rows:
+            if item is not None:
+                yield json.dumps(item, separators=(',', ':'),
+                                 sort_keys=True) + '\n'
+            else:
+                yield json.dumps({'next': next_cursor},
+                                 separators=(',', ':')) + '\n'
+
+    if format == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()),
+                        mimetype=NDJSON_MIMETYPE)
+    return Response(stream_with_context(generate_json()),
+                    mimetype='application/json')
@@ -0,0 +1,115 @@
+import functools
+import zlib
+from flask import Response, g, make_response, request
+from sqlalchemy import func, select
+from werkzeug.urls import url_encode
+
+# Import the database object and models
+from . import db, encoder
+from .models import Comment, ResourceVersion
+
+
+def version_keys(keys):
+    """ Return the sorted keys of the versions to increment for changed
+        resources
+
+    Lists of posts with embedded comments change with the comments of any
+    post, so 'comments' is incremented with every 'comments:<post id>'
+    """
+    keys = set(keys)
+    if any(key.startswith('comments:') for key in keys):
+        keys.add('comments')
+    return sorted(keys)
+
+
+def bump(*keys, connection=None):
+    """ Increment versions of resources, e.g. 'posts', 'post:<id>' or
+        'comments:<post id>'
+
+    Must be called within the transaction which changes the resources, so
+    that a new version is never visible before the new data.
+    """
+    executor = connection if connection is not None else db.session
+    table = ResourceVersion.__table__
+    for key in version_keys(keys):
+        updated = executor.execute(
+            table.update()
+            .where(table.c.key == key)
+            .values(version=table.c.version + 1))
+        if updated.rowcount == 0:
+            executor.execute(table.insert().values(key=key, version=1))
+
+
+def bump_votes(connection, keys):
+    """ Increment versions of resources changed by a batch of votes
+
+    keys are (table, id) tuples of voted posts and comments
+    """
+    post_ids = [object_id for table, object_id in keys if table == 'post']
+    comment_ids = [object_id for table, object_id in keys
+                   if table == 'comment']
+
+    changed = ['post:' + post_id for post_id in post_ids]
+    if post_ids:
+        changed.append('posts')
+    if comment_ids:
+        parents = connection.execute(
+            select([Comment.parent_id])
+            .where(Comment.id.in_(comment_ids))
+            .distinct())
+        changed.extend('comments:' + parent_id for parent_id, in parents)
+    bump(*changed, connection=connection)
+
+
+def current_etag(key, pending=0):
+    """ Return the ETag of the representation of a resource for the current
+        request, without rendering it
+
+    key is a resource key, or a tuple of the keys of a representation made
+    of several resources, whose versions are summed. pending is the sum of
+    votes in the vote buffer, which are part of the representation but not
+    of the version yet
+    """
+    keys = key if isinstance(key, tuple) else (key,)
+    version = db.session.query(func.sum(ResourceVersion.version))\
+        .filter(ResourceVersion.key.in_(keys))\
+        .scalar() or 0
+    # Query parameters, Accept and Accept-Encoding select the representation
+    variant = '{}|{}|{}'.format(url_encode(request.args, sort=True),
+                                request.accept_mimetypes.best,
+                                encoder.coding())
+    return '{}.{}-{:08x}'.format(version, pending,
+                                 zlib.crc32(variant.encode('utf-8')))
+
+
+def conditional(resource, pending=None, consistent=None):
+    """ Decorator which answers GET requests with 304 Not Modified when
+        If-None-Match matches the current ETag of the resource
+
+    resource is called with the view arguments and returns the resource key,
+    or a tuple of keys.
+    pending, if given, is called with the view arguments and returns the sum
+    of pending votes. consistent, if given, reads the version and the
+    pending votes together, like VoteBuffer.consistent(). The ETag is stored
+    in flask.g.etag, so that cached responses can be keyed by it.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            def etag():
+                return current_etag(resource(*args, **kwargs),
+                                    pending(*args, **kwargs) if pending
+                                    else 0)
+            g.etag = consistent(etag) if consistent else etag()
+            if request.if_none_match.contains(g.etag):
+                response = Response(status=304)
+                response.set_etag(g.etag)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(g.etag)
+                response.vary.add('Accept')
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,259 @@
+import atexit
+import glob
+import json
+import os
+import threading
+from sqlalchemy import bindparam
+
+# Import the database object and models
+from . import db
+from .changes import record
+from .models import Comment, Post, VoteJournalCheckpoint, vote_values
+from .versions import bump_votes
+
+MODELS = {model.__tablename__: model for model in (Post, Comment)}
+
+
+class VoteBuffer(object):
+    """ Coalesce votes in memory and write them to the database in batches
+
+    Instead of one transaction per vote, per-object deltas are collected and
+    flushed in a single transaction every VOTE_BUFFER_FLUSH_INTERVAL_MS
+    milliseconds, or as soon as VOTE_BUFFER_MAX_PENDING votes are pending.
+
+    Every vote is appended to a journal before it is acknowledged. The
+    journal is split into segments named '<VOTE_BUFFER_JOURNAL>.<seq>', and
+    every line carries a sequence number. A flush stores the sequence number
+    of its last vote in the vote_journal_checkpoint table within the same
+    transaction, so that after a crash only votes newer than the checkpoint
+    are replayed, and no vote is applied twice.
+
+    Each server process needs its own journal path.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Odd while a batch is being written, see consistent()
+        self._generation = 0
+        self._flushed = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._pending = {}
+        self._flushing = {}
+        self._count = 0
+        self._seq = 0
+        self._segment = None
+        self._closed_segments = []
+        self._pid = None
+        self._listeners = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """ Read settings and replay the journal before the first request """
+        self.app = app
+        self.enabled = app.config['VOTE_BUFFER_ENABLED']
+        self.journal = app.config['VOTE_BUFFER_JOURNAL']
+        self.interval = app.config['VOTE_BUFFER_FLUSH_INTERVAL_MS'] / 1000.0
+        self.max_pending = app.config['VOTE_BUFFER_MAX_PENDING']
+        self.fsync = app.config['VOTE_BUFFER_FSYNC']
+        if self.enabled:
+            app.before_first_request(self._start)
+            atexit.register(self.flush)
+
+    def add(self, model, object_id, delta):
+        """ Journal a vote and add it to the pending deltas """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            self._seq += 1
+            line = json.dumps([self._seq, model.__tablename__, object_id,
+                               delta])
+            self._segment.write(line + '\n')
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+
+            key = (model.__tablename__, object_id)
+            self._pending[key] = self._pending.get(key, 0) + delta
+            self._count += 1
+            if self._count >= self.max_pending:
+                self._wake.set()
+
+    def on_flush(self, listener):
+        """ Register a function which is called with the keys (table, id)
+            of the objects in every batch written to the database
+        """
+        self._listeners.append(listener)
+        return listener
+
+    def pending(self, model, object_id):
+        """ Return the sum of not yet flushed votes for an object """
+        if not self.enabled:
+            return 0
+        key = (model.__tablename__, object_id)
+        with self._lock:
+            return self._pending.get(key, 0) + self._flushing.get(key, 0)
+
+    def consistent(self, read):
+        """ Return read(), which reads vote scores or versions from the
+            database and adds pending() votes, without counting a batch
+            twice or not at all
+
+        A flush commits its batch and then drops it from pending(), so a
+        read in between would count the batch twice. read() is called once
+        no flush is in progress, and called again if a flush started before
+        it returned. The session gives its connection back to the pool
+        before waiting, because the flush may need it
+        """
+        if not self.enabled:
+            return read()
+        while True:
+            with self._lock:
+                generation = self._generation
+            if generation % 2:
+                db.session.commit()
+                with self._flushed:
+                    while self._generation == generation:
+                        self._flushed.wait()
+                continue
+            result = read()
+            with self._lock:
+                if self._generation == generation:
+                    return result
+
+    def flush(self):
+        """ Write pending deltas to the database in a single transaction """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                batch, count = self._pending, self._count
+                self._pending, self._count = {}, 0
+                self._flushing = batch
+                self._generation += 1
+                seq = self._seq
+                # Votes which arrive during the flush go to a new segment
+                self._closed_segments.append(self._segment.name)
+                self._segment.close()
+                self._segment = self._open_segment(seq + 1)
+
+            try:
+                self._apply(batch, seq)
+            except Exception:
+                # Keep the deltas. The closed segments stay on disk until
+                # a later flush has checkpointed them
+                with self._lock:
+                    for key, delta in batch.items():
+                        self._pending[key] = self._pending.get(key, 0) + delta
+                    self._count += count
+                    self._flushing = {}
+                    self._generation += 1
+                    self._flushed.notify_all()
+                raise
+
+            with self._lock:
+                self._flushing = {}
+                self._generation += 1
+                self._flushed.notify_all()
+                closed, self._closed_segments = self._closed_segments, []
+            for name in closed:
+                os.remove(name)
+            self._notify(batch)
+
+    def _start(self):
+        """ Replay the journal, open a new segment and start the flusher
+
+        Called once per process, because threads don't survive fork()
+        """
+        self._pid = os.getpid()
+        self._recover()
+        self._segment = self._open_segment(self._seq + 1)
+        flusher = threading.Thread(target=self._run, name='vote-flusher')
+        flusher.daemon = True
+        flusher.start()
+
+    def _run(self):
+        """ Flush pending deltas periodically, or when woken up early """
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Failed to flush votes')
+
+    def _open_segment(self, first_seq):
+        """ Open a new journal segment for votes from first_seq on """
+        return open('{}.{:012d}'.format(self.journal, first_seq), 'a')
+
+    def _recover(self):
+        """ Apply votes which were journaled but not flushed before a crash """
+        with self.app.app_context():
+            checkpoint = db.session.query(VoteJournalCheckpoint)\
+                .get(self.journal)
+            applied = checkpoint.seq if checkpoint else 0
+            db.session.remove()
+
+        segments = sorted(glob.glob(self.journal + '.*'))
+        batch, seq = {}, applied
+        for name in segments:
+            with open(name) as segment:
+                for line in segment:
+                    try:
+                        line_seq, table, object_id, delta = json.loads(line)
+                    except ValueError:
+                        # A torn write at the end of the segment. This vote
+                        # was never acknowledged
+                        break
+                    seq = max(seq, line_seq)
+                    if line_seq > applied:
+                        key = (table, object_id)
+                        batch[key] = batch.get(key, 0) + delta
+
+        if batch:
+            self.app.logger.info('Replaying %d journaled votes', len(batch))
+            self._apply(batch, seq)
+            self._notify(batch)
+        for name in segments:
+            os.remove(name)
+        self._seq = seq
+
+    def _notify(self, batch):
+        """ Call the flush listeners within an app context """
+        with self.app.app_context():
+            for listener in self._listeners:
+                listener(list(batch))
+
+    def _apply(self, batch, seq):
+        """ Add deltas to vote scores and move the checkpoint to seq """
+        with self.app.app_context(), db.engine.begin() as connection:
+            for table_name, model in MODELS.items():
+                params = [{'object_id': object_id, 'delta': delta}
+                          for (table, object_id), delta in batch.items()
+                          if table == table_name and delta != 0]
+                if not params:
+                    continue
+                table = model.__table__
+                connection.execute(
+                    table.update()
+                    .where(table.c.id == bindparam('object_id'))
+                    .values(vote_values(table, bindparam('delta'))),
+                    params)
+
+            bump_votes(connection, list(batch))
+            for table_name in MODELS:
+                record(table_name, sorted(object_id
+                                          for table, object_id in batch
+                                          if table == table_name),
+                       connection=connection)
+
+            checkpoint = VoteJournalCheckpoint.__table__
+            updated = connection.execute(
+                checkpoint.update()
+                .where(checkpoint.c.journal == self.journal)
+                .values(seq=seq))
+            if updated.rowcount == 0:
+                connection.execute(checkpoint.insert()
+                                   .values(journal=self.journal, seq=seq))
@@ -0,0 +1,122 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.orm.exc import NoResultFound
+
+# Import the database object and models
+from . import db, vote_buffer
+from .changes import record
+from .models import Comment, Post
+from .versions import bump
+
+# Flag columns which must be False for an object to accept votes
+LIVE_FLAGS = {
+    Post: ('deleted',),
+    Comment: ('deleted', 'parent_deleted'),
+}
+
+# SET clauses of a vote. The hot score of a post is updated in the same
+# statement as its vote score, like models.vote_values()
+VOTE_ASSIGNMENTS = {
+    Post: 'vote_score = vote_score + :delta, '
+          'hot_score = hot_score(vote_score + :delta, timestamp_ms)',
+    Comment: 'vote_score = vote_score + :delta',
+}
+
+
+def supports_returning(dialect):
+    """ Return True if UPDATE ... RETURNING can be used with the dialect
+
+    SQLite supports RETURNING since 3.35.0, but SQLAlchemy doesn't know it
+    """
+    if dialect.name == 'sqlite':
+        return dialect.server_version_info >= (3, 35, 0)
+    return dialect.implicit_returning
+
+
+def vote(model, object_id, delta):
+    """ Add delta to vote_score of a post or a comment inside the database
+
+    The score is incremented by a single UPDATE statement, so concurrent
+    votes can't overwrite each other. The hot score of a post is updated by
+    the same statement. The updated object is returned in the same statement
+    with RETURNING when the database supports it. Otherwise it is selected
+    after the UPDATE, within the same transaction.
+
+    When the vote buffer is enabled, the object is only checked to be live
+    and the vote is handed to the buffer.
+
+    Raise NoResultFound when there is no live object with the id.
+    The caller is responsible for committing the session.
+    """
+    table = model.__table__
+    if vote_buffer.enabled:
+        query = db.session.query(model).filter(model.id == object_id)
+        for flag in LIVE_FLAGS[model]:
+            query = query.filter(getattr(model, flag).is_(False))
+        obj = query.one()
+        vote_buffer.add(model, object_id, delta)
+        return obj
+
+    flags = ['{} = :false'.format(flag) for flag in LIVE_FLAGS[model]]
+    conditions = ' AND '.join(['id = :id'] + flags)
+
+    if supports_returning(db.engine.dialect):
+        statement = text(
+            'UPDATE {table} SET {assignments} '
+            'WHERE {conditions} RETURNING {columns}'.format(
+                table=table.name, assignments=VOTE_ASSIGNMENTS[model],
+                conditions=conditions,
+                columns=', '.join(column.name for column in table.columns)))
+        statement = statement.bindparams(id=object_id, delta=delta,
+                                         false=False)\
+            .columns(*table.columns)
+        obj = db.session.query(model)\
+            .from_statement(statement)\
+            .populate_existing()\
+            .one()
+        bump_versions(obj)
+        return obj
+
+    updated = db.session.execute(
+        text('UPDATE {table} SET {assignments} '
+             'WHERE {conditions}'.format(table=table.name,
+                                         assignments=VOTE_ASSIGNMENTS[model],
+                                         conditions=conditions)),
+        {'id': object_id, 'delta': delta, 'false': False})
+    if updated.rowcount == 0:
+        raise NoResultFound()
+    obj = db.session.query(model)\
+        .filter(model.id == object_id)\
+        .populate_existing()\
+        .one()
+    bump_versions(obj)
+    return obj
+
+
+def bump_versions(obj):
+    """ Increment versions of resources which show the vote score of obj,
+        and record its change
+    """
+    if isinstance(obj, Post):
+        bump('posts', 'post:' + obj.id)
+    else:
+        bump('comments:' + obj.parent_id)
+    record(obj.__tablename__, [obj.id])
+
+
+def serialize(obj):
+    """ Serialize a post or a comment, including votes which are still
+        pending in the vote buffer
+
+    The object is read again from the database, consistently with the
+    pending votes, so that a batch flushed meanwhile is counted once
+    """
+    if not vote_buffer.enabled:
+        return obj.serialize
+
+    def read():
+        if inspect(obj).persistent:
+            db.session.refresh(obj)
+        data = obj.serialize
+        data['voteScore'] += vote_buffer.pending(type(obj), obj.id)
+        return data
+    return vote_buffer.consistent(read)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+"""
+    Python script to archive posts and comments which were deleted more than
+    ARCHIVE_AFTER_DAYS ago, purge archived rows older than
+    ARCHIVE_PURGE_AFTER_DAYS, and return free pages to the filesystem, once
+
+    Usage: python3 archive_db.py [--after-days N] [--purge-after-days N]
+
+    It does what the archiving thread of the server does with
+    ARCHIVE_ENABLED, e.g. to run it from cron instead. Rows are moved in
+    short transactions, so it is safe to run against the database of a live
+    server.
+"""
+import argparse
+from app import app, archiver
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive deleted rows')
+    parser.add_argument('--after-days', type=float,
+                        default=app.config['ARCHIVE_AFTER_DAYS'])
+    parser.add_argument('--purge-after-days', type=float,
+                        default=app.config['ARCHIVE_PURGE_AFTER_DAYS'])
+    args = parser.parse_args()
+
+    app.config['ARCHIVE_AFTER_DAYS'] = args.after_days
+    app.config['ARCHIVE_PURGE_AFTER_DAYS'] = args.purge_after_days
+    archiver.init_app(app)
+    counts = archiver.run()
+    print('Archived {posts} posts and {comments} comments, purged {purged} '
+          'archived rows and freed {pages} pages'.format(**counts))
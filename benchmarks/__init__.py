@@ -0,0 +1,5 @@
+"""
+    Load tests and benchmarks for the API server
+
+    Run them from the project root, e.g. `python3 -m benchmarks.vote_load`
+"""
@@ -0,0 +1,214 @@
+"""
+    Contract test of the sync and async APIs: start the production server
+    and the async server on two temporary databases, send the same requests
+    to both, and check that every response has the expected status code and
+    that both servers return the same status codes and JSON bodies
+
+    Usage: python3 -m benchmarks.contract
+"""
+import json
+import multiprocessing
+import sys
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+from app import app
+from serve import Server, options
+from .utils import remove_database, use_temporary_database
+
+SYNC_BIND = ('127.0.0.1', 8765)
+ASYNC_BIND = ('127.0.0.1', 8766)
+
+POST = {'author': 'author', 'body': 'body', 'category': 'react',
+        'id': 'post-1', 'timestamp': 1467166872634, 'title': 'title'}
+COMMENT = {'author': 'author', 'body': 'body', 'id': 'comment-1',
+           'parentId': 'post-1', 'timestamp': 1468166872634}
+
+
+class Client(object):
+    """ Send requests to a server and record (status, JSON body) """
+
+    def __init__(self, host, port):
+        self.base = 'http://{}:{}/api'.format(host, port)
+        self.responses = []
+
+    def send(self, method, path, data=None):
+        request = Request(
+            self.base + path, method=method,
+            data=json.dumps(data).encode('utf-8') if data is not None
+            else None,
+            headers={'Content-Type': 'application/json'})
+        try:
+            with urlopen(request, timeout=10) as response:
+                status, body = response.status, response.read()
+        except HTTPError as error:
+            status, body = error.code, error.read()
+        body = json.loads(body.decode('utf-8')) if body else None
+        self.responses.append((method, path, status, body))
+        return status, body
+
+    def wait_until_ready(self, timeout=10):
+        started = time.time()
+        while time.time() - started < timeout:
+            try:
+                return self.send('GET', '/categories')
+            except URLError:
+                time.sleep(0.1)
+        raise RuntimeError('The server at {} did not start'.format(self.base))
+
+
+def scenario(client):
+    """ Send the requests of the contract and return the list of expected
+        status codes
+    """
+    expected = []
+
+    def check(status, method, path, data=None):
+        expected.append(status)
+        return client.send(method, path, data)[1]
+
+    check(200, 'GET', '/categories')
+    since = check(200, 'GET', '/changes')['next']
+    check(200, 'POST', '/posts', POST)
+    check(400, 'POST', '/posts', POST)
+    check(400, 'POST', '/posts', dict(POST, id='post-2', title=' '))
+    check(400, 'POST', '/posts', dict(POST, id='post-2', category='none'))
+    check(400, 'POST', '/posts', {'id': 'post-2'})
+    for i in range(2, 6):
+        check(200, 'POST', '/posts',
+              dict(POST, id='post-{}'.format(i),
+                   category='redux' if i % 2 else 'react',
+                   timestamp=POST['timestamp'] + i))
+    check(200, 'GET', '/posts')
+    check(200, 'GET', '/react/posts')
+    check(200, 'GET', '/udacity/posts')
+
+    # Follow the cursors of a paginated list to its end
+    page = check(200, 'GET', '/posts?limit=2')
+    while page['next']:
+        page = check(200, 'GET', '/posts?limit=2&cursor=' + page['next'])
+    check(400, 'GET', '/posts?limit=0')
+    check(400, 'GET', '/posts?cursor=invalid')
+
+    check(200, 'GET', '/posts/post-1')
+    check(404, 'GET', '/posts/none')
+    check(200, 'POST', '/posts/post-1', {'option': 'upVote'})
+    check(200, 'POST', '/posts/post-1', {'option': 'downVote'})
+    check(200, 'POST', '/posts/post-1', {'option': 'upVote'})
+    check(400, 'POST', '/posts/post-1', {'option': 'sideVote'})
+    check(400, 'POST', '/posts/post-1', {})
+    check(404, 'POST', '/posts/none', {'option': 'upVote'})
+    check(200, 'PUT', '/posts/post-1', {'body': 'new body', 'title': 'new'})
+    check(400, 'PUT', '/posts/post-1', {'body': ' ', 'title': 'new'})
+    check(404, 'PUT', '/posts/none', {'body': 'body', 'title': 'title'})
+
+    # Top and hot posts, after the votes
+    check(200, 'POST', '/posts/post-3', {'option': 'upVote'})
+    check(200, 'GET', '/posts?sort=voteScore')
+    page = check(200, 'GET', '/react/posts?sort=hot&limit=1')
+    while page['next']:
+        page = check(200, 'GET', '/react/posts?sort=hot&limit=1&cursor=' +
+                     page['next'])
+    check(400, 'GET', '/posts?sort=title')
+
+    check(200, 'POST', '/comments', COMMENT)
+    check(409, 'POST', '/comments', COMMENT)
+    check(403, 'POST', '/comments', dict(COMMENT, id='c', parentId='none'))
+    check(400, 'POST', '/comments', dict(COMMENT, id='c', body=''))
+    for i in range(2, 5):
+        check(200, 'POST', '/comments',
+              dict(COMMENT, id='comment-{}'.format(i),
+                   timestamp=COMMENT['timestamp'] + i))
+    check(200, 'GET', '/posts/post-1')
+    check(200, 'GET', '/posts/post-1/comments')
+    check(200, 'GET', '/posts/post-1/comments?limit=3')
+    check(200, 'GET', '/comments/comment-1')
+    check(200, 'POST', '/comments/comment-1', {'option': 'downVote'})
+    check(200, 'PUT', '/comments/comment-1', {'body': 'new body'})
+    check(400, 'PUT', '/comments/comment-1', {'body': ''})
+    check(200, 'DELETE', '/comments/comment-2')
+    check(404, 'DELETE', '/comments/comment-2')
+    check(404, 'GET', '/comments/comment-2')
+    check(200, 'GET', '/posts/post-1')
+
+    # Posts with their first comments embedded
+    check(200, 'GET', '/posts/post-1?include=comments')
+    check(200, 'GET', '/posts?include=comments&comment_limit=2')
+    check(200, 'GET', '/react/posts?include=comments&limit=2')
+    check(400, 'GET', '/posts?include=votes')
+    check(400, 'GET', '/posts/post-1?include=comments&comment_limit=-1')
+
+    check(200, 'DELETE', '/posts/post-1')
+    check(404, 'DELETE', '/posts/post-1')
+    check(404, 'GET', '/comments/comment-1')
+    check(200, 'GET', '/posts/post-1/comments')
+    check(200, 'GET', '/posts')
+
+    # Follow the change log from before the first post to its end
+    page = check(200, 'GET', '/changes?limit=5&since={}'.format(since))
+    while page['more']:
+        page = check(200, 'GET', '/changes?limit=5&since={}'.format(
+            page['next']))
+    check(400, 'GET', '/changes?since=-1')
+    check(410, 'GET', '/changes?since={}'.format(page['next'] + 1))
+
+    check(404, 'GET', '/no/such/route')
+    check(405, 'DELETE', '/categories')
+    return expected
+
+
+def run_async_server():
+    from aiohttp import web
+    from app.async_api import create_app
+    web.run_app(create_app(), host=ASYNC_BIND[0], port=ASYNC_BIND[1],
+                print=None)
+
+
+def compare(sync, async_, expected):
+    """ Print differences between the responses, return their number """
+    failures = 0
+    for (method, path, status, body), (_, _, async_status, async_body), \
+            expected_status in zip(sync.responses, async_.responses,
+                                   expected):
+        problems = []
+        if status != expected_status:
+            problems.append('sync status {}'.format(status))
+        if async_status != expected_status:
+            problems.append('async status {}'.format(async_status))
+        if body != async_body:
+            problems.append('bodies differ:\n  sync:  {}\n  async: {}'
+                            .format(body, async_body))
+        if problems:
+            failures += 1
+            print('{} {} (expected {}): {}'.format(
+                method, path, expected_status, '; '.join(problems)))
+    return failures
+
+
+if __name__ == '__main__':
+    paths = [use_temporary_database()]
+    servers = [multiprocessing.Process(target=Server(app, options(
+        '{}:{}'.format(*SYNC_BIND), workers=1)).run)]
+    servers[0].start()
+    paths.append(use_temporary_database())
+    servers.append(multiprocessing.Process(target=run_async_server))
+    servers[1].start()
+
+    try:
+        sync, async_ = Client(*SYNC_BIND), Client(*ASYNC_BIND)
+        for client in (sync, async_):
+            client.wait_until_ready()
+            client.responses = []
+            expected = scenario(client)
+        failures = compare(sync, async_, expected)
+    finally:
+        for server in servers:
+            server.terminate()
+            server.join()
+        for path in paths:
+            remove_database(path)
+    if failures:
+        print('FAIL: {} of {} responses differ'.format(failures,
+                                                       len(expected)))
+        sys.exit(1)
+    print('OK: {} responses match'.format(len(expected)))
@@ -0,0 +1,183 @@
+"""
+    Synthetic data generator: bulk-load a database with a configurable number
+    of posts and comments, with skewed distributions of categories, votes
+    and comments per post, in large batched transactions
+
+    Usage: python3 -m benchmarks.datagen --database PATH [--posts N]
+               [--comments N] [--categories N] [--seed S]
+
+    The same seed always generates the same rows.
+"""
+import argparse
+import array
+import datetime
+import itertools
+import os
+import random
+import sys
+import time
+import uuid
+from app import app, category_registry, db
+from app.bulk import bulk_load
+from app.models import Category, Comment, Post, hot_score, to_milliseconds
+
+SYLLABLES = ['ka', 're', 'mi', 'to', 'su', 'na', 'lo', 'pe', 'di', 'vo',
+             'an', 'et', 'ir', 'ou', 'ul']
+
+# Posts are spread over the year before END, and comments follow their post
+END = datetime.datetime(2017, 6, 29)
+PERIOD_SECONDS = 365 * 24 * 3600
+
+# Fractions of posts and comments which are deleted
+DELETED_POSTS = 0.02
+DELETED_COMMENTS = 0.03
+
+
+def make_vocabulary(size, rng):
+    """ Return size distinct made-up words """
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES)
+                          for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def zipf_weights(count, exponent=1.0):
+    """ Return cumulative weights of count items whose popularity follows
+        Zipf's law, for random.choices()
+    """
+    return list(itertools.accumulate(1.0 / (rank + 1) ** exponent
+                                     for rank in range(count)))
+
+
+def vote_score(rng):
+    """ Return a vote score: mostly around zero, with a long tail of very
+        popular posts, and some downvoted ones
+    """
+    if rng.random() < 0.1:
+        return -int(rng.paretovariate(2.0))
+    return min(int(rng.paretovariate(1.2)) - 1, 100000)
+
+
+class Generator(object):
+    """ Generate the rows of posts and comments with a random generator
+
+    Only the id, timestamp and flags of the posts are kept in memory, in
+    compact arrays, until the posts are inserted with their comment counts
+    """
+
+    def __init__(self, posts, categories, seed):
+        self.rng = random.Random(seed)
+        self.categories = ['category-{}'.format(i) for i in range(categories)]
+        self.category_weights = zipf_weights(categories)
+        self.words = make_vocabulary(5000, self.rng)
+        self.word_weights = zipf_weights(len(self.words))
+
+        self.post_ids = [self.id() for _ in range(posts)]
+        self.post_seconds = array.array('d', (
+            self.rng.uniform(0, PERIOD_SECONDS) for _ in range(posts)))
+        self.post_deleted = bytearray(self.rng.random() < DELETED_POSTS
+                                      for _ in range(posts))
+        self.comment_counts = array.array('l', [0]) * posts
+
+    def id(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def text(self, count):
+        return ' '.join(self.rng.choices(
+            self.words, cum_weights=self.word_weights, k=count))
+
+    def post(self, index):
+        timestamp = END - datetime.timedelta(seconds=self.post_seconds[index])
+        timestamp_ms = to_milliseconds(timestamp)
+        score = vote_score(self.rng)
+        return dict(author='author-{}'.format(self.rng.randrange(10000)),
+                    body=self.text(30),
+                    category_path=self.rng.choices(
+                        self.categories,
+                        cum_weights=self.category_weights)[0],
+                    comment_count=self.comment_counts[index],
+                    deleted=bool(self.post_deleted[index]),
+                    hot_score=hot_score(score, timestamp_ms),
+                    id=self.post_ids[index], timestamp=timestamp,
+                    timestamp_ms=timestamp_ms, title=self.text(6),
+                    vote_score=score)
+
+    def comment(self, index):
+        seconds = max(self.post_seconds[index] -
+                      self.rng.expovariate(1 / 86400.0), 0)
+        timestamp = END - datetime.timedelta(seconds=seconds)
+        deleted = self.rng.random() < DELETED_COMMENTS
+        if not deleted:
+            self.comment_counts[index] += 1
+        return dict(author='author-{}'.format(self.rng.randrange(10000)),
+                    body=self.text(15), deleted=deleted, id=self.id(),
+                    parent_deleted=bool(self.post_deleted[index]),
+                    parent_id=self.post_ids[index], timestamp=timestamp,
+                    timestamp_ms=to_milliseconds(timestamp),
+                    vote_score=vote_score(self.rng))
+
+
+def insert(table, rows):
+    """ Insert rows with executemany in one transaction """
+    with db.engine.begin() as connection:
+        connection.execute(table.insert(), rows)
+
+
+def generate(posts, comments, categories=10, seed=42, batch_size=50000,
+             log=print):
+    """ Load posts and comments into the empty database of the app, in
+        transactions of batch_size rows. Returns the ids of the posts
+
+    Comments are generated first, so that every post is inserted with its
+    final comment_count. Popular posts get most of the comments, and
+    popular categories most of the posts.
+    """
+    started = time.time()
+    generator = Generator(posts, categories, seed)
+    db.session.add_all([Category(name=path, path=path)
+                        for path in generator.categories])
+    db.session.commit()
+    category_registry.invalidate()
+    db.session.remove()
+
+    with bulk_load():
+        popular = list(range(posts))
+        generator.rng.shuffle(popular)
+        weights = zipf_weights(posts, 0.8)
+        for first in range(0, comments if posts else 0, batch_size):
+            parents = generator.rng.choices(
+                popular, cum_weights=weights,
+                k=min(batch_size, comments - first))
+            insert(Comment.__table__,
+                   [generator.comment(index) for index in parents])
+            log('{} comments'.format(first + len(parents)))
+        for first in range(0, posts, batch_size):
+            insert(Post.__table__,
+                   [generator.post(index) for index in
+                    range(first, min(first + batch_size, posts))])
+            log('{} posts'.format(min(first + batch_size, posts)))
+        log('Building indexes')
+    log('Generated {} posts and {} comments in {:.1f}s'.format(
+        posts, comments, time.time() - started))
+    return generator.post_ids
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a database')
+    parser.add_argument('--database', required=True,
+                        help='path of the SQLite database to create')
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--comments', type=int, default=10000000)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    path = os.path.abspath(args.database)
+    if os.path.exists(path):
+        sys.exit('{} already exists'.format(path))
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    db.create_all()
+    generate(args.posts, args.comments, args.categories, args.seed,
+             args.batch_size)
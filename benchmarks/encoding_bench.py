@@ -0,0 +1,111 @@
+"""
+    Benchmark of response encodings: bytes on the wire and CPU time of
+    encoding and compressing the bodies of list endpoints, per format and
+    content coding
+
+    Usage: python3 -m benchmarks.encoding_bench [--posts N] [--comments N]
+               [--repeat N]
+
+    MessagePack and the 'br' coding are only measured when the 'msgpack' and
+    'brotli' packages are installed.
+"""
+import argparse
+import json
+import time
+from flask import json as flask_json
+from sqlalchemy import select
+from app import app, db, encoder
+from app.encoding import compressor, optional_import
+from app.models import Post
+from .datagen import generate
+from .utils import remove_database, use_temporary_database
+
+
+def best_of(repeat, function, *args):
+    """ Return (result, shortest time of repeat calls in milliseconds) """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return result, min(timings) * 1000
+
+
+def formats():
+    """ Return a list of (name, function which encodes data into bytes) """
+    encoders = [
+        ('json pretty', lambda data: flask_json.dumps(
+            data, indent=2, separators=(', ', ': ')).encode('utf-8')),
+        ('json', lambda data: flask_json.dumps(
+            data, separators=(',', ':')).encode('utf-8')),
+    ]
+    msgpack = optional_import('msgpack')
+    if msgpack is not None:
+        encoders.append(('msgpack', lambda data: msgpack.packb(
+            data, use_bin_type=True)))
+    return encoders
+
+
+def codings():
+    """ Return a list of (name, function which compresses bytes) """
+    compressors = [('identity', lambda data: data)]
+    for coding in ('gzip', 'br'):
+        compress = compressor(coding, app.config)
+        if compress is not None:
+            compressors.append((coding, compress))
+    return compressors
+
+
+def payloads():
+    """ Return a list of (name, data of the response) of list endpoints """
+    popular = db.session.execute(
+        select([Post.id]).order_by(Post.comment_count.desc()).limit(1))\
+        .scalar()
+    client = app.test_client()
+    paths = [
+        ('/posts?limit=20', '/api/posts?limit=20'),
+        ('/posts?limit=100', '/api/posts?limit=100'),
+        ('/posts?limit=20&include=comments',
+         '/api/posts?limit=20&include=comments'),
+        ('/posts/:id/comments?limit=100',
+         '/api/posts/{}/comments?limit=100'.format(popular)),
+    ]
+    return [(name, json.loads(client.get(path).data.decode('utf-8')))
+            for name, path in paths]
+
+
+def run(repeat):
+    print('{:34} {:17} {:>8} {:>6} {:>10} {:>12}'.format(
+        'response', 'encoding', 'bytes', 'ratio', 'encode ms',
+        'compress ms'))
+    for name, data in payloads():
+        baseline = None
+        for format_name, encode in formats():
+            body, encode_ms = best_of(repeat, encode, data)
+            for coding_name, compress in codings():
+                wire, compress_ms = best_of(repeat, compress, body)
+                baseline = baseline or len(wire)
+                print('{:34} {:17} {:8d} {:6.2f} {:10.3f} {:12.3f}'.format(
+                    name, format_name + ' ' + coding_name
+                    if coding_name != 'identity' else format_name,
+                    len(wire), len(wire) / baseline, encode_ms,
+                    compress_ms))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Response encodings')
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--comments', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    path = use_temporary_database(categories=())
+    try:
+        with app.app_context():
+            generate(args.posts, args.comments, log=lambda message: None)
+            print('Formats: {}'.format(', '.join(encoder.mimetypes)))
+            run(args.repeat)
+    finally:
+        db.session.remove()
+        db.get_engine().dispose()
+        remove_database(path)
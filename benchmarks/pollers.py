@@ -0,0 +1,111 @@
+"""
+    Concurrency test of many slow pollers: every client keeps its own
+    connection open and polls GET /posts/:id at a fixed interval, while a
+    writer votes on the post. Prints the number of polls, the median and
+    99th percentile latency, and the number of failed polls
+
+    Usage: python3 -m benchmarks.pollers [--clients N] [--interval S]
+                                         [--duration S] [--server SERVER]
+
+    SERVER is 'async' for run_async.py or 'sync' for serve.py
+"""
+import argparse
+import asyncio
+import multiprocessing
+import sys
+import time
+import aiohttp
+from aiohttp import web
+from app import app
+from app.async_api import create_app
+from serve import Server, options
+from .utils import remove_database, use_temporary_database
+
+HOST, PORT = '127.0.0.1', 8767
+POST = {'author': 'bench', 'body': 'body', 'category': 'react',
+        'id': 'post-1', 'timestamp': 1467166872634, 'title': 'Pollers'}
+
+
+def run_async_server():
+    web.run_app(create_app(), host=HOST, port=PORT, print=None)
+
+
+async def poller(url, deadline, interval, latencies, failures):
+    """ Poll a URL over one connection until the deadline """
+    connector = aiohttp.TCPConnector(limit=1)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        while time.time() < deadline:
+            started = time.time()
+            try:
+                async with session.get(url) as response:
+                    await response.read()
+                    if response.status == 200:
+                        latencies.append(time.time() - started)
+                    else:
+                        failures.append(response.status)
+            except aiohttp.ClientError as error:
+                failures.append(error)
+            await asyncio.sleep(interval)
+
+
+async def voter(url, deadline):
+    """ Vote on the post while the pollers run """
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            async with session.post(url, json={'option': 'upVote'}) as r:
+                await r.read()
+            await asyncio.sleep(0.05)
+
+
+async def run(clients, interval, duration):
+    base = 'http://{}:{}/api'.format(HOST, PORT)
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.post(base + '/posts', json=POST) as r:
+                    await r.read()
+                    break
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+
+    url = base + '/posts/' + POST['id']
+    deadline = time.time() + duration
+    latencies, failures = [], []
+    await asyncio.gather(voter(url, deadline), *[
+        poller(url, deadline, interval, latencies, failures)
+        for _ in range(clients)])
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+    print('{} clients: {} polls in {:.0f}s, p50 {:.1f} ms, p99 {:.1f} ms, '
+          '{} failed'.format(clients, len(latencies), duration, p50, p99,
+                             len(failures)))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Slow pollers test')
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--interval', type=float, default=1)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--server', choices=('async', 'sync'),
+                        default='async')
+    args = parser.parse_args()
+
+    path = use_temporary_database()
+    if args.server == 'async':
+        target = run_async_server
+    else:
+        target = Server(app, options('{}:{}'.format(HOST, PORT))).run
+    server = multiprocessing.Process(target=target)
+    server.start()
+    try:
+        failures = asyncio.get_event_loop().run_until_complete(
+            run(args.clients, args.interval, args.duration))
+    finally:
+        server.terminate()
+        server.join()
+        remove_database(path)
+    if failures:
+        sys.exit(1)
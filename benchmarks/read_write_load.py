@@ -0,0 +1,130 @@
+"""
+    Mixed read/write load test: readers list posts and comments while
+    writers add comments and vote, for a fixed time. Prints the throughput,
+    the median and 99th percentile latency, and the number of failed
+    requests of both
+
+    Usage: python3 -m benchmarks.read_write_load [--duration S]
+               [--readers R] [--writers W] [--journal-mode MODE]
+               [--read-engine]
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+import uuid
+from app import app
+from .utils import remove_database, use_temporary_database
+
+POSTS = 20
+
+
+def percentile(latencies, p):
+    """ Return the p-th percentile of a sorted list, in milliseconds """
+    if not latencies:
+        return 0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+
+def create_posts(client):
+    """ Create posts with a few comments each, and return their ids """
+    post_ids = [str(uuid.uuid4()) for _ in range(POSTS)]
+    for post_id in post_ids:
+        client.post('/api/posts', content_type='application/json',
+                    data=json.dumps({'author': 'bench', 'body': 'body',
+                                     'category': 'react', 'id': post_id,
+                                     'timestamp': int(time.time() * 1000),
+                                     'title': 'Read/write load test'}))
+        for _ in range(5):
+            add_comment(client, post_id)
+    return post_ids
+
+
+def add_comment(client, post_id):
+    data = {'author': 'bench', 'body': 'body', 'id': str(uuid.uuid4()),
+            'parentId': post_id, 'timestamp': int(time.time() * 1000)}
+    return client.post('/api/comments', content_type='application/json',
+                       data=json.dumps(data))
+
+
+def reader(client, post_ids, i):
+    if i % 2:
+        return client.get('/api/posts?limit=20')
+    return client.get('/api/posts/{}/comments'.format(
+        post_ids[i % len(post_ids)]))
+
+
+def writer(client, post_ids, i):
+    post_id = post_ids[i % len(post_ids)]
+    if i % 2:
+        return add_comment(client, post_id)
+    return client.post('/api/posts/' + post_id,
+                       content_type='application/json',
+                       data=json.dumps({'option': 'upVote'}))
+
+
+def worker(request, post_ids, deadline, latencies, failures):
+    """ Send requests until the deadline, recording latencies """
+    client = app.test_client()
+    i = 0
+    while time.time() < deadline:
+        started = time.time()
+        response = request(client, post_ids, i)
+        if response.status_code == 200:
+            latencies.append(time.time() - started)
+        else:
+            failures.append(response.status_code)
+        i += 1
+
+
+def run(duration, readers, writers):
+    """ Run readers and writers in parallel and print their statistics """
+    post_ids = create_posts(app.test_client())
+    deadline = time.time() + duration
+    results = {'read': ([], []), 'write': ([], [])}
+    threads = [threading.Thread(target=worker,
+                                args=(request, post_ids, deadline) +
+                                results[kind])
+               for kind, request, count in (('read', reader, readers),
+                                            ('write', writer, writers))
+               for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for kind, (latencies, failures) in sorted(results.items()):
+        latencies.sort()
+        print('{:5}: {:6.0f} requests/s, p50 {:6.1f} ms, p99 {:6.1f} ms, '
+              '{} failed'.format(kind, len(latencies) / duration,
+                                 percentile(latencies, 0.5),
+                                 percentile(latencies, 0.99), len(failures)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mixed read/write load test')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--journal-mode', default='wal',
+                        help='SQLite journal mode, e.g. wal or delete')
+    parser.add_argument('--read-engine', action='store_true',
+                        help='serve GET requests from the read-only engine')
+    args = parser.parse_args()
+
+    # Count failed requests instead of raising their exceptions
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    app.logger.setLevel(logging.CRITICAL)
+    app.config['SQLITE_PRAGMAS'] = dict(app.config['SQLITE_PRAGMAS'],
+                                        journal_mode=args.journal_mode)
+    app.config['READ_ENGINE_ENABLED'] = args.read_engine
+    # One connection per thread, so that no request waits for the pool
+    app.config['DATABASE_CONNECT_OPTIONS'] = dict(
+        app.config['DATABASE_CONNECT_OPTIONS'],
+        pool_size=args.readers + args.writers, max_overflow=0)
+    path = use_temporary_database()
+    try:
+        run(args.duration, args.readers, args.writers)
+    finally:
+        remove_database(path)
@@ -0,0 +1,91 @@
+"""
+    Benchmark of GET /search: full-text search with the FTS5 index against
+    scanning post titles and bodies with LIKE, on a temporary database of
+    generated posts
+
+    Usage: python3 -m benchmarks.search_bench [--posts N] [--repeat R]
+"""
+import argparse
+import datetime
+import random
+import time
+from sqlalchemy import text
+from app import app, db
+from app.models import Post
+from .datagen import make_vocabulary
+from .utils import remove_database, use_temporary_database
+
+# LIKE can't rank, so it only has to find any 21 matching rows
+LIKE_QUERY = text('SELECT id FROM post WHERE deleted = 0 '
+                  'AND (title LIKE :pattern OR body LIKE :pattern) '
+                  'LIMIT 21')
+
+
+def create_posts(count, vocabulary, rng, batch_size=10000):
+    """ Insert count posts whose words follow a Zipf-like distribution """
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    started = datetime.datetime(2017, 1, 1)
+    for first in range(0, count, batch_size):
+        size = min(batch_size, count - first)
+        words = rng.choices(vocabulary, weights, k=size * 35)
+        rows = [dict(author='author', category_path='react',
+                     comment_count=0, deleted=False, id='post-{}'.format(i),
+                     timestamp=started + datetime.timedelta(seconds=i),
+                     title=' '.join(words[j * 35:j * 35 + 5]),
+                     body=' '.join(words[j * 35 + 5:j * 35 + 35]),
+                     vote_score=0)
+                for j, i in enumerate(range(first, first + size))]
+        for row in rows:
+            row['timestamp_ms'] = int(row['timestamp'].timestamp() * 1000)
+        db.session.execute(Post.__table__.insert(), rows)
+        db.session.commit()
+
+
+def timed(function, repeat):
+    """ Return the median time of function() in milliseconds """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def run(posts, repeat):
+    rng = random.Random(42)
+    vocabulary = make_vocabulary(20000, rng)
+    started = time.time()
+    create_posts(posts, vocabulary, rng)
+    print('Inserted {} posts with their full-text index in {:.1f}s'.format(
+        posts, time.time() - started))
+
+    client = app.test_client()
+    queries = [('common word', vocabulary[0]),
+               ('medium word', vocabulary[100]),
+               ('rare word', vocabulary[-1]),
+               ('two words', '{} {}'.format(vocabulary[3], vocabulary[50]))]
+    print('{:12} {:>14} {:>14}'.format('query', 'FTS5 (ms)', 'LIKE (ms)'))
+    for label, q in queries:
+        fts = timed(lambda: client.get('/api/search', query_string={
+            'q': q, 'limit': 20}), repeat)
+        # LIKE matches substrings, so only single words are compared
+        words = q.split()
+        pattern = '%{}%'.format(words[0])
+        like = timed(lambda: db.session.execute(
+            LIKE_QUERY, {'pattern': pattern}).fetchall(),
+            repeat) if len(words) == 1 else float('nan')
+        print('{:12} {:14.1f} {:14.1f}'.format(label, fts, like))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search benchmark')
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = use_temporary_database()
+    try:
+        run(args.posts, args.repeat)
+    finally:
+        db.session.remove()
+        remove_database(path)
@@ -0,0 +1,71 @@
+"""
+    Micro-benchmark of list serialization: ORM objects and Post.serialize
+    compared with the Core column projection of app/serializers.py
+
+    Usage: python3 -m benchmarks.serialize_bench [--rows 10000 100000]
+"""
+import argparse
+import datetime
+import time
+from app import app, db
+from app.controllers import query_posts
+from app.models import Post
+from app.serializers import POST_FIELDS, serialize_page
+from .utils import remove_database, use_temporary_database
+
+
+def insert_posts(count, batch_size=10000):
+    """ Insert count posts with executemany """
+    started = datetime.datetime(2017, 1, 1)
+    for first in range(0, count, batch_size):
+        db.session.execute(Post.__table__.insert(), [
+            dict(author='author', body='body ' * 20, category_path='react',
+                 comment_count=0, deleted=False, id='post-{:09d}'.format(i),
+                 timestamp=started + datetime.timedelta(seconds=i),
+                 title='title {}'.format(i), vote_score=i % 100)
+            for i in range(first, min(first + batch_size, count))])
+        db.session.commit()
+
+
+def best_of(repeat, function):
+    """ Return the shortest time of repeat calls of function in seconds """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+        db.session.remove()
+    return min(timings)
+
+
+def orm_serialize():
+    query = query_posts().order_by(Post.timestamp, Post.id)
+    return [post.serialize for post in query]
+
+
+def core_serialize():
+    return serialize_page(query_posts(), POST_FIELDS, None,
+                          Post.timestamp, Post.id)[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='List serialization')
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        path = use_temporary_database()
+        try:
+            with app.app_context():
+                insert_posts(rows)
+                assert orm_serialize() == core_serialize()
+                orm = best_of(args.repeat, orm_serialize)
+                core = best_of(args.repeat, core_serialize)
+            print('{:>8} rows: ORM + serialize {:.3f}s, Core projection '
+                  '{:.3f}s ({:.1f}x)'.format(rows, orm, core, orm / core))
+        finally:
+            db.session.remove()
+            db.get_engine().dispose()
+            remove_database(path)
@@ -0,0 +1,100 @@
+"""
+    Load test of the production server: start serve.py with several worker
+    processes on a temporary SQLite database, send parallel votes and reads
+    over HTTP, and check that no request failed and no vote was lost
+
+    Usage: python3 -m benchmarks.serve_load [--requests N] [--clients C]
+                                            [--workers W] [--threads T]
+"""
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+from app import app
+from serve import Server, options
+from .utils import remove_database, use_temporary_database
+
+BIND = '127.0.0.1:8765'
+
+
+def send(method, path, data=None):
+    """ Send a request to the server and return (status, JSON body) """
+    request = Request('http://{}{}'.format(BIND, path), method=method,
+                      data=json.dumps(data).encode('utf-8') if data else None,
+                      headers={'Content-Type': 'application/json'})
+    try:
+        with urlopen(request, timeout=60) as response:
+            return response.status, json.loads(response.read().decode())
+    except HTTPError as error:
+        return error.code, None
+
+
+def wait_until_ready(timeout=10):
+    """ Wait until the server accepts connections """
+    started = time.time()
+    while time.time() - started < timeout:
+        try:
+            return send('GET', '/api/categories')
+        except URLError:
+            time.sleep(0.1)
+    raise RuntimeError('The server did not start')
+
+
+def run(requests, clients):
+    """ Create a post, send votes and reads in parallel, and return the
+        number of votes, the number of failed requests and the final score
+    """
+    post_id = str(uuid.uuid4())
+    send('POST', '/api/posts', {'author': 'bench', 'body': 'body',
+                                'category': 'react', 'id': post_id,
+                                'timestamp': int(time.time() * 1000),
+                                'title': 'Server load test'})
+    # One vote for every three requests, the rest are reads
+    calls = [('POST', '/api/posts/' + post_id, {'option': 'upVote'})
+             if i % 3 == 0 else
+             ('GET', '/api/posts' if i % 3 == 1 else '/api/posts/' + post_id,
+              None)
+             for i in range(requests)]
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        statuses = list(executor.map(lambda call: send(*call)[0], calls))
+    elapsed = time.time() - started
+
+    votes = len([call for call in calls if call[0] == 'POST'])
+    failed = len([status for status in statuses if status != 200])
+    score = send('GET', '/api/posts/' + post_id)[1]['post']['voteScore']
+    print('{} requests with {} clients in {:.2f}s ({:.0f} requests/s), '
+          '{} failed'.format(requests, clients, elapsed, requests / elapsed,
+                             failed))
+    return votes, failed, score
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Production server test')
+    parser.add_argument('--requests', type=int, default=600)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=2)
+    args = parser.parse_args()
+
+    path = use_temporary_database()
+    server = multiprocessing.Process(
+        target=Server(app, options(BIND, args.workers, args.threads)).run)
+    server.start()
+    try:
+        wait_until_ready()
+        votes, failed, score = run(args.requests, args.clients)
+    finally:
+        server.terminate()
+        server.join()
+        remove_database(path)
+    if failed or score != votes:
+        print('FAIL: expected vote score {}, got {}'.format(votes, score))
+        sys.exit(1)
+    print('OK: vote score is {}'.format(score))
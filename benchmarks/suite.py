@@ -0,0 +1,277 @@
+"""
+    Benchmark suite of every route of the API: generate a dataset with
+    benchmarks.datagen, send requests to each route through the Flask test
+    client, and report throughput and p50/p99 latency per route.
+
+    Results are compared with a baseline file, and the run fails when the
+    p50 latency of a route is more than --tolerance slower than its baseline.
+    --save writes the results as the new baseline. Baselines depend on the
+    machine, so save one before changing the code, on the same machine.
+
+    Usage: python3 -m benchmarks.suite [--posts N] [--comments N]
+               [--requests N] [--baseline PATH] [--save] [--tolerance F]
+               [--database PATH]
+
+    --database runs the suite against an existing database, e.g. one made by
+    benchmarks.datagen, instead of a temporary one. The suite adds, edits
+    and deletes posts and comments of that database.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from sqlalchemy import func, literal_column, select
+from app import app, db
+from app.models import Comment, Post
+from app.votes import LIVE_FLAGS
+from .datagen import generate
+from .utils import remove_database, use_temporary_database
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def sample_ids(model, count, rng):
+    """ Return the ids of up to count random live posts or comments """
+    table = model.__table__
+    rowid = literal_column('rowid')
+    last = db.session.execute(select([func.max(rowid)])
+                              .select_from(table)).scalar() or 0
+    query = select([table.c.id])\
+        .where(rowid.in_(rng.sample(range(1, last + 1),
+                                    min(count * 2, last))))
+    for flag in LIVE_FLAGS[model]:
+        query = query.where(table.c[flag].is_(False))
+    ids = sorted(id for id, in db.session.execute(query))
+    rng.shuffle(ids)
+    return ids[:count]
+
+
+def build_routes(count, rng):
+    """ Return a list of (name, expected status, function of i which returns
+        the arguments of the i-th request of the route)
+
+    Routes which delete run last, so that the other routes find their rows
+    """
+    posts = sample_ids(Post, count * 4, rng)
+    comments = sample_ids(Comment, count * 3, rng)
+    if len(posts) < count * 4 or len(comments) < count * 3:
+        sys.exit('The database needs at least {} live posts and {} live '
+                 'comments'.format(count * 4, count * 3))
+    # Read, vote on and edit the first quarter of posts, comment on the
+    # second, and delete the third
+    read, commented, deleted = posts[:count], posts[count:count * 2], \
+        posts[count * 2:count * 3]
+    categories = [path for path, in db.session.execute(
+        'SELECT path FROM category ORDER BY path')]
+    titles = db.session.execute(
+        select([Post.title]).where(Post.id.in_(read[:50]))).fetchall()
+    words = sorted({word for title, in titles for word in title.split()})
+    first_page = app.test_client().get('/api/posts?limit=20')
+    etag = first_page.headers.get('ETag', '')
+    # Changes made by the write routes of previous runs on the database
+    latest = json.loads(app.test_client().get('/api/changes')
+                        .get_data(as_text=True))['next']
+    since = max(latest - 100, 0)
+
+    def post(i, prefix='bench-post'):
+        return {'author': 'bench', 'body': 'body',
+                'category': categories[i % len(categories)],
+                'id': '{}-{}'.format(prefix, i),
+                'timestamp': 1498694400000 + i, 'title': 'title'}
+
+    def comment(i, prefix='bench-comment'):
+        return {'author': 'bench', 'body': 'body',
+                'id': '{}-{}'.format(prefix, i),
+                'parentId': commented[i % count],
+                'timestamp': 1498694400000 + i}
+
+    def vote(i):
+        return {'option': 'upVote' if i % 3 else 'downVote'}
+
+    return [
+        ('GET /categories', 200, lambda i: ('GET', '/categories')),
+        ('GET /posts?limit=20', 200,
+         lambda i: ('GET', '/posts?limit=20')),
+        ('GET /posts?limit=20 (If-None-Match)', 304,
+         lambda i: ('GET', '/posts?limit=20', None,
+                    {'If-None-Match': etag})),
+        ('GET /posts?limit=20&sort=hot', 200,
+         lambda i: ('GET', '/posts?limit=20&sort=hot')),
+        ('GET /posts?limit=20&sort=voteScore', 200,
+         lambda i: ('GET', '/posts?limit=20&sort=voteScore')),
+        ('GET /posts?limit=100&stream=true', 200,
+         lambda i: ('GET', '/posts?limit=100&stream=true')),
+        ('GET /:category/posts?limit=20', 200,
+         lambda i: ('GET', '/{}/posts?limit=20'.format(
+             categories[i % len(categories)]))),
+        ('GET /:category/posts?limit=20&include=comments', 200,
+         lambda i: ('GET', '/{}/posts?limit=20&include=comments'.format(
+             categories[i % len(categories)]))),
+        ('GET /search?q=<word>&limit=20', 200,
+         lambda i: ('GET', '/search?limit=20&q=' + words[i % len(words)])),
+        ('GET /changes?since=<seq>&limit=20', 200,
+         lambda i: ('GET', '/changes?limit=20&since={}'.format(since))),
+        ('GET /posts/:id', 200, lambda i: ('GET', '/posts/' + read[i])),
+        ('GET /posts/:id?include=comments', 200,
+         lambda i: ('GET', '/posts/{}?include=comments'.format(read[i]))),
+        ('GET /posts/:id/comments', 200,
+         lambda i: ('GET', '/posts/{}/comments'.format(read[i]))),
+        ('GET /posts/:id/comments?limit=20', 200,
+         lambda i: ('GET', '/posts/{}/comments?limit=20'.format(read[i]))),
+        ('GET /comments/:id', 200,
+         lambda i: ('GET', '/comments/' + comments[i])),
+        ('GET /cache/stats', 200, lambda i: ('GET', '/cache/stats')),
+        ('POST /posts', 200, lambda i: ('POST', '/posts', post(i))),
+        ('POST /posts:batch (100 posts)', 200,
+         lambda i: ('POST', '/posts:batch', [
+             post(j, 'bench-batch-post') for j in range(i * 100, i * 100 + 100)
+         ])),
+        ('POST /posts/:id', 200,
+         lambda i: ('POST', '/posts/' + read[i], vote(i))),
+        ('PUT /posts/:id', 200,
+         lambda i: ('PUT', '/posts/' + read[i],
+                    {'body': 'edited body', 'title': 'edited title'})),
+        ('POST /comments', 200,
+         lambda i: ('POST', '/comments', comment(i))),
+        ('POST /comments:batch (100 comments)', 200,
+         lambda i: ('POST', '/comments:batch', [
+             comment(j, 'bench-batch-comment')
+             for j in range(i * 100, i * 100 + 100)])),
+        ('POST /comments/:id', 200,
+         lambda i: ('POST', '/comments/' + comments[i], vote(i))),
+        ('PUT /comments/:id', 200,
+         lambda i: ('PUT', '/comments/' + comments[i],
+                    {'body': 'edited body', 'timestamp': 1498694400000})),
+        ('DELETE /comments/:id', 200,
+         lambda i: ('DELETE', '/comments/' + comments[count + i])),
+        ('DELETE /posts/:id', 200,
+         lambda i: ('DELETE', '/posts/' + deleted[i])),
+    ]
+
+
+def send(client, method, path, data=None, headers=None):
+    """ Send a request and read the whole response """
+    response = client.open('/api' + path, method=method, headers=headers,
+                           data=json.dumps(data) if data is not None
+                           else None, content_type='application/json')
+    response.get_data()
+    return response.status_code
+
+
+def run_route(client, requests, expected, make_request):
+    """ Send requests to a route and return its results in milliseconds """
+    latencies = []
+    started = time.perf_counter()
+    for i in range(requests):
+        request_started = time.perf_counter()
+        status = send(client, *make_request(i))
+        latencies.append(time.perf_counter() - request_started)
+        if status != expected:
+            raise RuntimeError('{} {}: status {}'.format(
+                *make_request(i)[:2], status))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+            'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+            'rps': round(requests / elapsed, 1)}
+
+
+def compare(results, baseline, tolerance):
+    """ Print the results next to the baseline, and return the names of the
+        routes whose p50 latency regressed by more than tolerance
+    """
+    regressions = []
+    print('{:48} {:>9} {:>9} {:>9} {:>11}'.format(
+        'route', 'req/s', 'p50 ms', 'p99 ms', 'p50 change'))
+    for name, result in results.items():
+        before = baseline.get(name)
+        change = ''
+        if before:
+            ratio = result['p50_ms'] / before['p50_ms'] - 1
+            change = '{:+.0%}'.format(ratio)
+            if ratio > tolerance:
+                change += ' !'
+                regressions.append(name)
+        print('{:48} {:9.1f} {:9.3f} {:9.3f} {:>11}'.format(
+            name, result['rps'], result['p50_ms'], result['p99_ms'], change))
+    return regressions
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    client = app.test_client()
+    routes = build_routes(args.requests, rng)
+    results = {}
+    for name, expected, make_request in routes:
+        # Warm up caches and compiled statements before timing reads
+        if make_request(0)[0] == 'GET':
+            for i in range(min(5, args.requests)):
+                send(client, *make_request(i))
+        results[name] = run_route(client, args.requests, expected,
+                                  make_request)
+        db.session.remove()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='API benchmark suite')
+    parser.add_argument('--posts', type=int, default=50000)
+    parser.add_argument('--comments', type=int, default=500000)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per route')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database',
+                        help='run against an existing database instead')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed p50 slowdown, e.g. 0.25 for 25%%')
+    args = parser.parse_args()
+
+    if args.database:
+        dataset = {'database': os.path.basename(args.database)}
+        app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + os.path.abspath(args.database)
+        path = None
+    else:
+        dataset = {'comments': args.comments, 'posts': args.posts,
+                   'seed': args.seed}
+        path = use_temporary_database(categories=())
+        with app.app_context():
+            generate(args.posts, args.comments, seed=args.seed,
+                     log=lambda message: None)
+    dataset['requests'] = args.requests
+
+    try:
+        with app.app_context():
+            results = run(args)
+    finally:
+        db.session.remove()
+        db.get_engine().dispose()
+        if path:
+            remove_database(path)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved['dataset'] == dataset:
+            baseline = saved['routes']
+        else:
+            print('The baseline was measured on a different dataset, '
+                  '{}'.format(saved['dataset']))
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'dataset': dataset, 'routes': results}, f, indent=2,
+                      sort_keys=True)
+            f.write('\n')
+        print('Saved the baseline to {}'.format(args.baseline))
+    elif regressions:
+        print('{} routes are more than {:.0%} slower than the baseline'
+              .format(len(regressions), args.tolerance))
+        sys.exit(1)
@@ -0,0 +1,30 @@
+import os
+import tempfile
+from app import app, category_registry, db
+from app.models import Category
+
+
+def use_temporary_database(categories=('react', 'redux', 'udacity')):
+    """ Point the app to a new, empty SQLite database file
+
+    Must be called before the app touches the database.
+    Returns the path of the database file
+    """
+    fd, path = tempfile.mkstemp(prefix='readable_bench_', suffix='.db')
+    os.close(fd)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    db.create_all()
+    db.session.add_all([Category(name=c, path=c) for c in categories])
+    db.session.commit()
+    category_registry.invalidate()
+    db.session.remove()
+    return path
+
+
+def remove_database(path):
+    """ Remove a temporary database file with its WAL and shared memory
+        files
+    """
+    for name in (path, path + '-wal', path + '-shm'):
+        if os.path.exists(name):
+            os.remove(name)
@@ -0,0 +1,74 @@
+"""
+    Load test for voting: fire N parallel upVotes on a single post and check
+    that the final vote score is exactly N
+
+    Usage: python3 -m benchmarks.vote_load [--votes N] [--workers W]
+                                           [--buffered]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from app import app, vote_buffer
+from .utils import remove_database, use_temporary_database
+
+
+def vote(client, url):
+    """ Send an upVote and return the HTTP status code """
+    response = client.post(url, data=json.dumps({'option': 'upVote'}),
+                           content_type='application/json')
+    return response.status_code
+
+
+def run(votes, workers):
+    """ Create a post, vote on it in parallel and return its final score """
+    client = app.test_client()
+    post_id = str(uuid.uuid4())
+    client.post('/api/posts', content_type='application/json',
+                data=json.dumps({'author': 'bench', 'body': 'body',
+                                 'category': 'react', 'id': post_id,
+                                 'timestamp': int(time.time() * 1000),
+                                 'title': 'Vote load test'}))
+    url = '/api/posts/' + post_id
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        statuses = list(executor.map(lambda _: vote(app.test_client(), url),
+                                     range(votes)))
+    elapsed = time.time() - started
+
+    failed = len([status for status in statuses if status != 200])
+    vote_buffer.flush()
+    score = json.loads(client.get(url).data.decode('utf-8'))['post']['voteScore']  # noqa
+    print('{} votes with {} workers in {:.2f}s ({:.0f} votes/s), '
+          '{} failed'.format(votes, workers, elapsed, votes / elapsed, failed))
+    return score, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel voting load test')
+    parser.add_argument('--votes', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--buffered', action='store_true',
+                        help='coalesce votes with the vote buffer')
+    args = parser.parse_args()
+
+    path = use_temporary_database()
+    if args.buffered:
+        app.config['VOTE_BUFFER_ENABLED'] = True
+        app.config['VOTE_BUFFER_JOURNAL'] = path + '.votes'
+        vote_buffer.init_app(app)
+    try:
+        score, failed = run(args.votes, args.workers)
+    finally:
+        remove_database(path)
+        for name in glob.glob(path + '.votes.*'):
+            os.remove(name)
+    if failed or score != args.votes:
+        print('FAIL: expected vote score {}, got {}'.format(args.votes, score))
+        sys.exit(1)
+    print('OK: vote score is {}'.format(score))
@@ -7,9 +7,169 @@ DEBUG = True
 # Define the database
 SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, 'readable.db')
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-DATABASE_CONNECT_OPTIONS = {}
 
+# Engine options of every server process. With a pool_size, SQLite
+# connections are pooled and shared by the threads of a process. Connections
+# are never shared between processes: serve.py disposes of the pool after
+# fork()
+DATABASE_CONNECT_OPTIONS = {
+    'pool_size': 4,
+    'max_overflow': 4,
+    'pool_recycle': 3600,
+    'pool_timeout': 10,
+}
+
+# PRAGMA statements run on every new SQLite connection. In WAL mode readers
+# don't block the writer and the writer doesn't block readers, and
+# synchronous=NORMAL only syncs at checkpoints, which is safe with WAL: a
+# power loss may undo the last transactions, but never corrupts the database.
+# cache_size is in KiB when negative. busy_timeout is how many milliseconds a
+# write waits for the lock of another connection before 'database is
+# locked'; keep it longer than the slowest write transaction
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -8000,
+    'mmap_size': 268435456,
+    'busy_timeout': 15000,
+    # Set before the tables of a new database are created, so that the
+    # archiver can return free pages with 'PRAGMA incremental_vacuum'. See
+    # 'migrate_db.py --incremental-vacuum' for an existing database
+    'auto_vacuum': 'INCREMENTAL',
+}
+
+# Serve the queries of GET requests from a second, read-only engine, so that
+# reads never wait for a pooled connection which is used by a write
+READ_ENGINE_ENABLED = False
+
+# Production server, see serve.py: WORKERS pre-forked processes with
+# THREADS_PER_PAGE threads each. SQLite allows one writer at a time, so more
+# processes add read throughput, not write throughput. Keep pool_size +
+# max_overflow >= THREADS_PER_PAGE, so that no thread waits for a connection
+SERVER_BIND = '0.0.0.0:8000'
+WORKERS = 4
 THREADS_PER_PAGE = 2
+WORKER_TIMEOUT = 30
 
 # Secret key for signing cookies
 SECRET_KEY = "YOUR_SECRET_KEY_HERE"
+
+# Keyset pagination of list endpoints: ?limit=<n>&cursor=<token>
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Comments embedded in each post with ?include=comments&comment_limit=<n>
+DEFAULT_COMMENT_LIMIT = 5
+MAX_COMMENT_LIMIT = 100
+
+# Write-behind vote buffer: coalesce votes in memory, journal them to disk and
+# flush them to the database in batches
+VOTE_BUFFER_ENABLED = False
+VOTE_BUFFER_FLUSH_INTERVAL_MS = 200
+VOTE_BUFFER_MAX_PENDING = 1000
+VOTE_BUFFER_JOURNAL = os.path.join(BASE_DIR, 'votes.journal')
+VOTE_BUFFER_FSYNC = True
+
+# Read-through cache of JSON responses of list endpoints. Set the backend to
+# 'app.cache.RedisBackend' to share one cache between server processes
+RESPONSE_CACHE_ENABLED = False
+RESPONSE_CACHE_BACKEND = 'app.cache.LRUBackend'
+RESPONSE_CACHE_MAXSIZE = 1024
+RESPONSE_CACHE_TTL = 30
+RESPONSE_CACHE_REDIS_URL = 'redis://localhost:6379/0'
+
+# Opt-in instrumentation of the API: latency histograms per route, SQL
+# statement counts and time, ORM objects loaded and response bytes, served at
+# /metrics in the Prometheus text format, and a Server-Timing header on every
+# API response. Requests which execute more than METRICS_MAX_STATEMENTS SQL
+# statements are logged as possible N+1 queries
+METRICS_ENABLED = False
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                           5)
+METRICS_MAX_STATEMENTS = 20
+
+# Change log of posts and comments, read with GET /changes?since=<seq>. It is
+# compacted every CHANGES_COMPACT_INTERVAL changes: only the latest change of
+# each object and the CHANGES_MAX_ENTRIES latest sequence numbers are kept.
+# Clients which fall further behind get 410 Gone and fetch the lists again
+CHANGES_MAX_ENTRIES = 100000
+CHANGES_COMPACT_INTERVAL = 1000
+
+# Server-Sent Events streams of posts and categories: GET /posts/:id/events
+# and GET /:category/events. Every stream holds a thread of the Flask server
+# until the client disconnects, so serve many streams from the async API.
+# Each stream queues at most EVENTS_QUEUE_SIZE events; a client which falls
+# further behind gets a 'reset' event and is disconnected. Set the backend to
+# 'app.events.RedisBackend' to deliver events to the streams of every server
+# process, not only those of the process which handled the write
+EVENTS_ENABLED = False
+EVENTS_BACKEND = 'app.events.LocalBackend'
+EVENTS_QUEUE_SIZE = 100
+EVENTS_KEEPALIVE_SECONDS = 15
+EVENTS_REDIS_URL = 'redis://localhost:6379/0'
+
+# Token buckets of write endpoints per client: every client may send 'burst'
+# requests at once, then 'rate' requests per second, or gets 429 Too Many
+# Requests. Clients are told apart by remote address, or by the first address
+# of X-Forwarded-For behind a proxy which sets it. Set the store to
+# 'app.ratelimit.RedisStore' to share the buckets between server processes
+RATE_LIMIT_ENABLED = False
+RATE_LIMIT_STORE = 'app.ratelimit.MemoryStore'
+RATE_LIMIT_MAX_CLIENTS = 100000
+RATE_LIMIT_TRUST_FORWARDED = False
+RATE_LIMIT_REDIS_URL = 'redis://localhost:6379/0'
+RATE_LIMITS = {
+    # name: (rate per second, burst)
+    'posts': (0.5, 10),
+    'comments': (1, 20),
+    'votes': (5, 50),
+}
+
+# Admission control: while writers waited longer than this for the SQLite
+# write lock on average, write requests get 503 Service Unavailable, so that
+# reads stay fast. 0 disables it
+ADMISSION_MAX_LOCK_WAIT_MS = 0
+
+# Categories are loaded once per server process, to validate new posts and
+# to serve GET /categories, and loaded again after this many seconds, so that
+# categories added to the database of a running server are seen
+CATEGORY_REGISTRY_TTL = 300
+
+# The aggregates of categories are kept for GET /categories too. The process
+# reads them again when it writes posts, or after this many seconds, so that
+# posts written by other processes are counted
+CATEGORY_STATS_TTL = 1
+
+# Archival of deleted posts and comments: ARCHIVE_AFTER_DAYS after a post or
+# a comment is deleted, it is moved to an archive table, in transactions of
+# ARCHIVE_BATCH_SIZE rows, by a thread which runs every
+# ARCHIVE_INTERVAL_SECONDS. Archived rows are deleted for good after
+# ARCHIVE_PURGE_AFTER_DAYS more days; None keeps them. Freed pages are
+# returned to the filesystem ARCHIVE_VACUUM_PAGES at a time
+ARCHIVE_ENABLED = False
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_PURGE_AFTER_DAYS = None
+ARCHIVE_INTERVAL_SECONDS = 3600
+ARCHIVE_BATCH_SIZE = 100
+ARCHIVE_VACUUM_PAGES = 1000
+
+# Maximum number of items in POST /posts:batch and POST /comments:batch
+MAX_BATCH_SIZE = 1000
+
+# Number of rows fetched per batch by streamed list responses
+STREAM_BATCH_SIZE = 500
+
+# Encoding of API responses. JSON is compact unless pretty printing is set.
+# Clients which prefer application/msgpack in Accept get MessagePack when the
+# 'msgpack' package is installed. Bodies of at least COMPRESS_MIN_SIZE bytes
+# are compressed with the coding of COMPRESS_ENCODINGS which the client
+# prefers; 'br' requires the 'brotli' package
+JSONIFY_PRETTYPRINT_REGULAR = False
+MSGPACK_ENABLED = True
+COMPRESS_ENCODINGS = ['br', 'gzip']
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 5
+
+# Number of aiosqlite connections of the async API, see run_async.py
+ASYNC_POOL_SIZE = 4
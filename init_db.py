@@ -2,83 +2,226 @@
 
 """
     Python script to create database schema and add dummy data
+
+    Usage: python3 init_db.py [--seed PATH] [--database PATH]
+               [--batch-size N]
+
+    Without --seed, the sample categories, posts and comments of SAMPLE_SEED
+    are added. --seed loads a file in the JSON format of the API instead:
+
+    - a .json file holds an object like
+      {"categories": [...], "posts": [...], "comments": [...]}
+    - a .ndjson or .jsonl file holds one category, post or comment per line,
+      like the responses of GET /posts and GET /posts/:id/comments with
+      Accept: application/x-ndjson. Lines are read one at a time, so use it
+      for files which don't fit in memory.
+
+    Rows are inserted with executemany in transactions of --batch-size rows,
+    with the indexes and triggers of posts and comments dropped until the
+    end, see app/bulk.py. The commentCount of seeded posts is ignored, and
+    the comment counts of all posts are computed in one UPDATE at the end.
 """
+import argparse
 import datetime
+import io
+import json
+import os
+import sys
+import time
+from sqlalchemy import func, select
 from app import app, db
-from app.models import Category, Comment, Post
-
-# Create Database tables
-db.create_all()
-
-# Add Category data
-category1 = Category(name="react", path="react")
-db.session.add(category1)
-db.session.commit()
-
-category2 = Category(name="redux", path="redux")
-db.session.add(category2)
-db.session.commit()
-
-category3 = Category(name="udacity", path="udacity")
-db.session.add(category3)
-db.session.commit()
-
-# Add Post data
-post1 = Post(id='0d154a66-2b39-4276-9e77-5651f6a17444',
-             timestamp=datetime.datetime.fromtimestamp(1467166872634 / 1000.0),
-             title='Udacity is the best place to learn React',
-             body='Everyone says so after all.',
-             author='thingtwo',
-             category_path='react',
-             vote_score=6,
-             deleted=False,
-             comment_count=2)
-db.session.add(post1)
-db.session.commit()
-
-post2 = Post(id='2008fab6-78a4-4242-bad2-71249814ae84',
-             timestamp=datetime.datetime.fromtimestamp(1468479767190 / 1000.0),
-             title='Learn Redux in 10 minutes!',
-             body='Just kidding. It takes more than 10 minutes to learn technology.',  # noqa
-             author='thingone',
-             category_path='redux',
-             vote_score=-5,
-             deleted=False,
-             comment_count=0)
-db.session.add(post2)
-db.session.commit()
-
-post3 = Post(id='ac54c88d-121a-48db-88e5-b0a68f053a71',
-             timestamp=datetime.datetime.fromtimestamp(1513320276285 / 1000.0),
-             title='Testing Adding Posts !',
-             body='Testing is important.',
-             author='thingone',
-             category_path='react',
-             vote_score=4,
-             deleted=False,
-             comment_count=0)
-db.session.add(post3)
-db.session.commit()
-
-# Add Comment data
-comment1 = Comment(id='322b4b0c-0bd5-4ea9-9342-c735ceae3326',
-                   parent_id='0d154a66-2b39-4276-9e77-5651f6a17444',
-                   timestamp=datetime.datetime.fromtimestamp(1468166872634 / 1000.0),  # noqa
-                   body='Hi there! I am a COMMENT.',
-                   author='thingtwo',
-                   vote_score=6,
-                   deleted=False,
-                   parent_deleted=False)
-db.session.add(comment1)
-db.session.commit()
-
-comment2 = Comment(id='465e554e-8ba3-48f1-8346-4511e3502bd0',
-                   parent_id='0d154a66-2b39-4276-9e77-5651f6a17444',
-                   timestamp=datetime.datetime.fromtimestamp(1469479767190 / 1000.0),  # noqa
-                   body='Comments. Are. Cool.',
-                   author='thingone',
-                   vote_score=-2,
-                   deleted=False,
-                   parent_deleted=False)
-db.session.add(comment2)
-db.session.commit()
+from app.bulk import bulk_load
+from app.models import Category, Comment, Post, hot_score
+
+SAMPLE_SEED = {
+    'categories': [
+        {'name': 'react', 'path': 'react'},
+        {'name': 'redux', 'path': 'redux'},
+        {'name': 'udacity', 'path': 'udacity'},
+    ],
+    'posts': [
+        {'id': '0d154a66-2b39-4276-9e77-5651f6a17444',
+         'timestamp': 1467166872634,
+         'title': 'Udacity is the best place to learn React',
+         'body': 'Everyone says so after all.',
+         'author': 'thingtwo',
+         'category': 'react',
+         'voteScore': 6,
+         'deleted': False},
+        {'id': '2008fab6-78a4-4242-bad2-71249814ae84',
+         'timestamp': 1468479767190,
+         'title': 'Learn Redux in 10 minutes!',
+         'body': 'Just kidding. It takes more than 10 minutes to learn '
+                 'technology.',
+         'author': 'thingone',
+         'category': 'redux',
+         'voteScore': -5,
+         'deleted': False},
+        {'id': 'ac54c88d-121a-48db-88e5-b0a68f053a71',
+         'timestamp': 1513320276285,
+         'title': 'Testing Adding Posts !',
+         'body': 'Testing is important.',
+         'author': 'thingone',
+         'category': 'react',
+         'voteScore': 4,
+         'deleted': False},
+    ],
+    'comments': [
+        {'id': '322b4b0c-0bd5-4ea9-9342-c735ceae3326',
+         'parentId': '0d154a66-2b39-4276-9e77-5651f6a17444',
+         'timestamp': 1468166872634,
+         'body': 'Hi there! I am a COMMENT.',
+         'author': 'thingtwo',
+         'voteScore': 6,
+         'deleted': False,
+         'parentDeleted': False},
+        {'id': '465e554e-8ba3-48f1-8346-4511e3502bd0',
+         'parentId': '0d154a66-2b39-4276-9e77-5651f6a17444',
+         'timestamp': 1469479767190,
+         'body': 'Comments. Are. Cool.',
+         'author': 'thingone',
+         'voteScore': -2,
+         'deleted': False,
+         'parentDeleted': False},
+    ],
+}
+
+
+def category_values(data):
+    """ Convert a category in the JSON format of the API into column values
+    """
+    return dict(name=data['name'], path=data['path'])
+
+
+def post_values(data):
+    """ Convert a post in the JSON format of the API into column values """
+    timestamp_ms = int(data['timestamp'])
+    vote_score = data.get('voteScore', 0)
+    return dict(author=data['author'], body=data['body'],
+                category_path=data['category'], comment_count=0,
+                deleted=bool(data.get('deleted', False)),
+                hot_score=hot_score(vote_score, timestamp_ms), id=data['id'],
+                timestamp=datetime.datetime.fromtimestamp(
+                    timestamp_ms / 1000.0),
+                timestamp_ms=timestamp_ms, title=data['title'],
+                vote_score=vote_score)
+
+
+def comment_values(data):
+    """ Convert a comment in the JSON format of the API into column values
+    """
+    timestamp_ms = int(data['timestamp'])
+    return dict(author=data['author'], body=data['body'],
+                deleted=bool(data.get('deleted', False)), id=data['id'],
+                parent_deleted=bool(data.get('parentDeleted', False)),
+                parent_id=data['parentId'],
+                timestamp=datetime.datetime.fromtimestamp(
+                    timestamp_ms / 1000.0),
+                timestamp_ms=timestamp_ms,
+                vote_score=data.get('voteScore', 0))
+
+
+# Tables of the seed, with the function which converts their items
+TABLES = {
+    'categories': (Category.__table__, category_values),
+    'posts': (Post.__table__, post_values),
+    'comments': (Comment.__table__, comment_values),
+}
+
+
+def item_kind(data):
+    """ Return the key in TABLES of an item of an NDJSON seed """
+    if 'parentId' in data:
+        return 'comments'
+    if 'category' in data:
+        return 'posts'
+    if 'path' in data:
+        return 'categories'
+    raise ValueError('Not a category, post or comment: {}'.format(data))
+
+
+def read_seed(path):
+    """ Yield (kind, item) of every category, post and comment of a JSON or
+        NDJSON seed file
+    """
+    with io.open(path, encoding='utf-8') as f:
+        if os.path.splitext(path)[1] in ('.ndjson', '.jsonl'):
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    yield item_kind(item), item
+        else:
+            seed = json.load(f)
+            for kind in TABLES:
+                for item in seed.get(kind, []):
+                    yield kind, item
+
+
+def count_comments(connection):
+    """ Set the comment count of every post, in one statement """
+    post, comment = Post.__table__, Comment.__table__
+    connection.execute(
+        post.update()
+        .values(comment_count=select([func.count()])
+                .where(comment.c.parent_id == post.c.id)
+                .where(comment.c.deleted.is_(False))
+                .as_scalar()))
+
+
+def load(items, batch_size=50000):
+    """ Insert (kind, item) pairs into the empty database, in transactions
+        of batch_size rows of a table. Returns the number of rows per table
+    """
+    pending = {kind: [] for kind in TABLES}
+    counts = dict.fromkeys(TABLES, 0)
+
+    def flush(kind):
+        table = TABLES[kind][0]
+        with db.engine.begin() as connection:
+            connection.execute(table.insert(), pending[kind])
+        counts[kind] += len(pending[kind])
+        pending[kind] = []
+
+    with bulk_load():
+        for kind, item in items:
+            pending[kind].append(TABLES[kind][1](item))
+            if len(pending[kind]) >= batch_size:
+                flush(kind)
+        for kind in TABLES:
+            if pending[kind]:
+                flush(kind)
+    with db.engine.begin() as connection:
+        count_comments(connection)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create a database')
+    parser.add_argument('--seed', help='JSON or NDJSON file to load')
+    parser.add_argument('--database',
+                        help='path of the SQLite database, instead of '
+                             'SQLALCHEMY_DATABASE_URI')
+    parser.add_argument('--batch-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    if args.database:
+        app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + os.path.abspath(args.database)
+
+    # Create Database tables
+    db.create_all()
+    if db.session.query(Post.id).first() or \
+            db.session.query(Category.path).first():
+        sys.exit('The database already has data')
+    db.session.remove()
+
+    started = time.time()
+    if args.seed:
+        items = read_seed(args.seed)
+    else:
+        items = ((kind, item) for kind in TABLES
+                 for item in SAMPLE_SEED[kind])
+    counts = load(items, args.batch_size)
+    print('Loaded {categories} categories, {posts} posts and {comments} '
+          'comments in {seconds:.1f}s'.format(
+              seconds=time.time() - started, **counts))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+"""
+    Python script to bring an existing database up to date with the schema
+    in app/models.py, and to check that API queries use their indexes
+
+    Usage:
+        python3 migrate_db.py         : Create missing tables, columns, indexes
+                                        and triggers
+        python3 migrate_db.py --check : Fail if a query doesn't use its index
+        python3 migrate_db.py --rebuild-search : Rebuild full-text indexes
+        python3 migrate_db.py --incremental-vacuum : Set auto_vacuum to
+                                        INCREMENTAL with a full VACUUM
+
+    Every index is built in its own short transaction. SQLite keeps serving
+    readers while an index is built, and writers wait for the lock instead of
+    failing, so the migration can run against the database of a live server.
+    --incremental-vacuum rewrites the whole database and holds the lock
+    until it is done, so stop the server first.
+"""
+import argparse
+import datetime
+import sys
+from sqlalchemy import bindparam, func, inspect, select
+from sqlalchemy.schema import CreateColumn
+from app import db
+from app.archive import stamp_deleted
+from app.controllers import query_comments, query_posts
+from app.models import CATEGORY_STATS_TRIGGERS, COMMENT_COUNT_TRIGGERS, \
+    DELETED_MS_TRIGGERS, Category, Comment, Post, category_stats, \
+    to_milliseconds
+from app.pagination import SortOrder, keyset_query
+from app.search import SEARCH_INDEXES
+from app.serializers import POST_SORTS
+
+
+def create_missing_tables():
+    """ Create tables which don't exist in the database yet """
+    existing = set(inspect(db.engine).get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            print('Creating table {}'.format(table.name))
+            table.create(bind=db.engine)
+
+
+def add_missing_columns():
+    """ Add columns which don't exist in the database yet """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            print('Adding column {}.{}'.format(table.name, column.name))
+            spec = CreateColumn(column).compile(dialect=db.engine.dialect)
+            db.engine.execute('ALTER TABLE {} ADD COLUMN {}'.format(
+                table.name, spec))
+
+
+def backfill_timestamp_ms(batch_size=1000):
+    """ Fill timestamp_ms of rows created before the column existed, in
+        short transactions of batch_size rows
+    """
+    for model in (Post, Comment):
+        table = model.__table__
+        update = table.update()\
+            .where(table.c.id == bindparam('row_id'))\
+            .values(timestamp_ms=bindparam('ms'))
+        filled = 0
+        while True:
+            with db.engine.begin() as connection:
+                rows = connection.execute(
+                    select([table.c.id, table.c.timestamp])
+                    .where(table.c.timestamp_ms.is_(None))
+                    .limit(batch_size)).fetchall()
+                if not rows:
+                    break
+                connection.execute(update, [
+                    {'row_id': id, 'ms': to_milliseconds(timestamp)}
+                    for id, timestamp in rows])
+            filled += len(rows)
+        if filled:
+            print('Filled {}.timestamp_ms of {} rows'.format(table.name,
+                                                             filled))
+
+
+def backfill_hot_score(batch_size=1000):
+    """ Fill hot_score of posts created before the column existed, in short
+        transactions of batch_size rows
+    """
+    table = Post.__table__
+    filled = 0
+    while True:
+        with db.engine.begin() as connection:
+            ids = select([table.c.id])\
+                .where(table.c.hot_score.is_(None))\
+                .limit(batch_size)
+            updated = connection.execute(
+                table.update()
+                .where(table.c.id.in_(ids))
+                .values(hot_score=func.hot_score(table.c.vote_score,
+                                                 table.c.timestamp_ms)))
+        if updated.rowcount == 0:
+            break
+        filled += updated.rowcount
+    if filled:
+        print('Filled post.hot_score of {} rows'.format(filled))
+
+
+def backfill_deleted_ms():
+    """ Stamp posts and comments which were deleted before deleted_ms
+        existed with the current time, so that they are archived
+        ARCHIVE_AFTER_DAYS from now
+    """
+    with db.engine.begin() as connection:
+        stamped = stamp_deleted(connection)
+    if stamped:
+        print('Filled deleted_ms of {} rows'.format(stamped))
+
+
+def create_missing_indexes():
+    """ Build indexes which don't exist in the database yet """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name in existing:
+                continue
+            print('Building index {}'.format(index.name))
+            started = datetime.datetime.now()
+            index.create(bind=db.engine)
+            print('    done in {}'.format(datetime.datetime.now() - started))
+
+
+def create_missing_triggers():
+    """ Create the comment_count, category aggregate and deleted_ms
+        triggers if they don't exist yet
+
+    Counts which drifted before the comment_count triggers existed are not
+    repaired. Run reconcile_db.py to repair them. The aggregates of
+    categories are counted in the transaction which creates their triggers
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    query = "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+    existing = {name for name, in db.engine.execute(query)}
+    for trigger in COMMENT_COUNT_TRIGGERS + DELETED_MS_TRIGGERS:
+        db.engine.execute(trigger)
+    with db.engine.begin() as connection:
+        for trigger in CATEGORY_STATS_TRIGGERS:
+            connection.execute(trigger)
+        created = {name for name, in connection.execute(query)} - existing
+        if any(name.startswith('category_stats_') for name in created):
+            print('Counting posts of categories')
+            connection.execute(
+                Category.__table__.update().values(category_stats()))
+    for name in sorted(created):
+        print('Created trigger {}'.format(name))
+
+
+def create_missing_search_indexes():
+    """ Create full-text indexes which don't exist yet, fill them with the
+        live posts and comments, and create their triggers
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    existing = set(inspect(db.engine).get_table_names())
+    for index in SEARCH_INDEXES:
+        with db.engine.begin() as connection:
+            for statement in index.ddl:
+                connection.execute(statement)
+            if index.name not in existing:
+                print('Building full-text index {}'.format(index.name))
+                index.rebuild(connection)
+
+
+def rebuild_search_indexes():
+    """ Refill full-text indexes from the live posts and comments """
+    for index in SEARCH_INDEXES:
+        print('Rebuilding full-text index {}'.format(index.name))
+        with db.engine.begin() as connection:
+            index.rebuild(connection)
+
+
+def enable_incremental_vacuum():
+    """ Set auto_vacuum to INCREMENTAL, which only takes effect with a
+        full VACUUM, so that the archiver can return free pages to the
+        filesystem. The VACUUM may renumber rows, so the full-text indexes
+        are rebuilt afterwards
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.connect() as connection:
+        # 2 is INCREMENTAL
+        if connection.execute('PRAGMA auto_vacuum').scalar() == 2:
+            print('auto_vacuum is already INCREMENTAL')
+            return
+        print('Rewriting the database with VACUUM')
+        connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        connection.execute('VACUUM')
+    rebuild_search_indexes()
+
+
+def explain(query):
+    """ Return EXPLAIN QUERY PLAN details for an ORM query """
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    rows = db.engine.execute('EXPLAIN QUERY PLAN ' + str(compiled), *params)
+    return [row[-1] for row in rows]
+
+
+def check_query_plans():
+    """ Check that every list endpoint reads its rows through its index,
+        and that no temporary b-tree is needed for ORDER BY
+
+    Returns True when all queries use their index
+    """
+    by_timestamp = POST_SORTS['timestamp']
+    comments = SortOrder(Comment.timestamp, False, None)
+    checks = [
+        ('GET /posts', query_posts, by_timestamp,
+         'ix_post_deleted_timestamp'),
+        ('GET /:category/posts', lambda: query_posts('react'), by_timestamp,
+         'ix_post_category_deleted_timestamp'),
+        ('GET /posts/:id/comments', lambda: query_comments(''), comments,
+         'ix_comment_parent_deleted_timestamp'),
+    ]
+    for name in ('voteScore', 'hot'):
+        sort = POST_SORTS[name]
+        checks += [
+            ('GET /posts?sort=' + name, query_posts, sort,
+             'ix_post_deleted_' + sort.column.key),
+            ('GET /:category/posts?sort=' + name,
+             lambda: query_posts('react'), sort,
+             'ix_post_category_deleted_' + sort.column.key),
+        ]
+
+    ok = True
+    for endpoint, build_query, sort, index in checks:
+        model = sort.column.class_
+        value = datetime.datetime.now() \
+            if isinstance(sort.column.type, db.DateTime) else 0
+        for label, page in (('all', None), ('first page', (20, None)),
+                            ('next page', (20, (value, '')))):
+            query = keyset_query(build_query(), page, sort.column, model.id,
+                                 sort.descending)
+            plan = explain(query)
+            passed = any(index in detail for detail in plan) and \
+                not any('TEMP B-TREE' in detail for detail in plan)
+            ok = ok and passed
+            print('[{}] {} ({})'.format('OK' if passed else 'FAIL',
+                                        endpoint, label))
+            for detail in plan:
+                print('        ' + detail)
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate the database')
+    parser.add_argument('--check', action='store_true',
+                        help='check query plans instead of migrating')
+    parser.add_argument('--rebuild-search', action='store_true',
+                        help='rebuild full-text indexes, e.g. after VACUUM')
+    parser.add_argument('--incremental-vacuum', action='store_true',
+                        help='set auto_vacuum to INCREMENTAL with a VACUUM')
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check_query_plans() else 1)
+    if args.rebuild_search:
+        rebuild_search_indexes()
+        sys.exit(0)
+    if args.incremental_vacuum:
+        enable_incremental_vacuum()
+        sys.exit(0)
+
+    create_missing_tables()
+    add_missing_columns()
+    backfill_timestamp_ms()
+    backfill_hot_score()
+    backfill_deleted_ms()
+    create_missing_indexes()
+    create_missing_triggers()
+    create_missing_search_indexes()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""
+    Python script to find and repair comment counts of posts which don't
+    match the number of comments of the post which aren't deleted, and
+    aggregates of categories which don't match the posts of the category
+    which aren't deleted
+
+    Usage: python3 reconcile_db.py [--batch-size N] [--dry-run]
+
+    The counts of all posts are computed with a single GROUP BY, which reads
+    ix_comment_parent_deleted_timestamp without taking the write lock. Posts
+    are then compared in chunks of N, and the drifted posts of a chunk are
+    recounted and repaired in a short transaction of their own, so writers
+    never wait for more than one chunk. Repaired posts are recorded in the
+    change log, so that clients which sync with GET /changes see their new
+    counts. Categories are few, so their
+    aggregates are compared at once and repaired in one transaction. It is
+    safe to run against the database of a live server.
+"""
+import argparse
+from sqlalchemy import func, select
+from app import app, db
+from app.changes import record
+from app.models import Category, Comment, Post, category_stats
+from app.versions import bump
+
+
+def count_comments():
+    """ Return a dict of post id: number of comments which aren't deleted """
+    rows = db.engine.execute(
+        select([Comment.parent_id, func.count()])
+        .where(Comment.deleted.is_(False))
+        .group_by(Comment.parent_id))
+    return {post_id: count for post_id, count in rows}
+
+
+def find_drift(counts, batch_size):
+    """ Yield lists of (post id, stored count, counted) of drifted posts, in
+        chunks of batch_size posts ordered by id
+    """
+    last_id = ''
+    while True:
+        rows = db.engine.execute(
+            select([Post.id, Post.comment_count])
+            .where(Post.id > last_id)
+            .order_by(Post.id)
+            .limit(batch_size)).fetchall()
+        if not rows:
+            return
+        yield [(id, stored, counts.get(id, 0)) for id, stored in rows
+               if stored != counts.get(id, 0)]
+        last_id = rows[-1][0]
+
+
+def repair(post_ids):
+    """ Recount the comments of posts and store the counts, in one
+        transaction
+
+    The counts are computed again within the transaction, so comments added
+    since count_comments() are counted as well
+    """
+    post, comment = Post.__table__, Comment.__table__
+    with app.app_context(), db.engine.begin() as connection:
+        connection.execute(
+            post.update()
+            .where(post.c.id.in_(post_ids))
+            .values(comment_count=select([func.count()])
+                    .where(comment.c.parent_id == post.c.id)
+                    .where(comment.c.deleted.is_(False))
+                    .as_scalar()))
+        bump('posts', *['post:' + id for id in post_ids],
+             connection=connection)
+        record('post', post_ids, connection=connection)
+
+
+def find_category_drift():
+    """ Return a list of (path, stored aggregates, counted aggregates) of
+        drifted categories, where aggregates are tuples of (post count,
+        latest post timestamp, vote total)
+    """
+    counted = {row[0]: tuple(row[1:]) for row in db.engine.execute(
+        select([Post.category_path, func.count(), func.max(Post.timestamp_ms),
+                func.sum(Post.vote_score)])
+        .where(Post.deleted.is_(False))
+        .group_by(Post.category_path))}
+    drifted = []
+    for row in db.engine.execute(
+            select([Category.path, Category.post_count,
+                    Category.latest_post_ms, Category.vote_total])):
+        stored = tuple(row[1:])
+        expected = counted.get(row[0], (0, None, 0))
+        expected = expected[:2] + (expected[2] or 0,)
+        if stored != expected:
+            drifted.append((row[0], stored, expected))
+    return drifted
+
+
+def repair_categories(paths):
+    """ Recount the aggregates of categories and store them, in one
+        transaction
+    """
+    category = Category.__table__
+    with db.engine.begin() as connection:
+        connection.execute(category.update()
+                           .where(category.c.path.in_(paths))
+                           .values(category_stats()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Repair comment counts '
+                                                 'and category aggregates')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only print drifted posts')
+    args = parser.parse_args()
+
+    drifted = 0
+    for chunk in find_drift(count_comments(), args.batch_size):
+        for id, stored, counted in chunk:
+            print('Post {}: comment_count {}, counted {}'.format(
+                id, stored, counted))
+        if chunk and not args.dry_run:
+            repair([id for id, stored, counted in chunk])
+        drifted += len(chunk)
+    print('{} {} posts'.format('Found' if args.dry_run else 'Repaired',
+                               drifted))
+
+    categories = find_category_drift()
+    for path, stored, counted in categories:
+        print('Category {}: aggregates {}, counted {}'.format(
+            path, stored, counted))
+    if categories and not args.dry_run:
+        repair_categories([path for path, stored, counted in categories])
+    print('{} {} categories'.format('Found' if args.dry_run else 'Repaired',
+                                    len(categories)))
@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+
+"""
+    Python script to run the async variant of the API server with aiohttp.
+    Requires the packages of requirements-async.txt.
+"""
+from aiohttp import web
+from app.async_api import create_app
+
+web.run_app(create_app(), host='0.0.0.0', port=8000)
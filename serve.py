@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""
+    Python script to run the production server: gunicorn with WORKERS
+    pre-forked processes of THREADS_PER_PAGE threads each.
+
+    Usage: python3 serve.py [--bind HOST:PORT] [--workers N] [--threads N]
+"""
+import argparse
+from gunicorn.app.base import BaseApplication
+from app import app, archiver, db, vote_buffer
+
+
+def pre_fork(server, worker):
+    """ Give the new worker the lowest slot number not used by a live worker
+
+    A worker which replaces a dead one gets its slot, so it replays the vote
+    journal left by its predecessor
+    """
+    used = set(getattr(w, 'slot', None) for w in server.WORKERS.values())
+    worker.slot = min(set(range(len(used) + 1)) - used)
+
+
+def post_fork(server, worker):
+    """ Drop pooled connections copied from the master process, use a
+        vote journal of the worker's own, and only archive in one worker
+    """
+    db.dispose(app)
+    vote_buffer.journal = '{}.{}'.format(app.config['VOTE_BUFFER_JOURNAL'],
+                                         worker.slot)
+    archiver.enabled = archiver.enabled and worker.slot == 0
+
+
+class Server(BaseApplication):
+    """ Gunicorn application which serves the Flask app """
+
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super(Server, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def options(bind=None, workers=None, threads=None):
+    """ Return gunicorn settings from the app config """
+    return {
+        'bind': bind or app.config['SERVER_BIND'],
+        'workers': workers or app.config['WORKERS'],
+        'threads': threads or app.config['THREADS_PER_PAGE'],
+        'worker_class': 'gthread',
+        'timeout': app.config['WORKER_TIMEOUT'],
+        'pre_fork': pre_fork,
+        'post_fork': post_fork,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the production server')
+    parser.add_argument('--bind')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--threads', type=int)
+    args = parser.parse_args()
+
+    app.debug = False
+    Server(app, options(args.bind, args.workers, args.threads)).run()